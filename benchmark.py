@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import pygcode
+
+import filters
+from commons import gCodeBlocks
+from gdoctor import GCodeBlock, read_gcode, write_gcode
+
+# points of a contour
+CONTOUR_POINTS = 100
+# contours of a nested shape
+NESTED_LEVELS = 5
+# points of a raster scanline
+SCANLINE_POINTS = 200
+
+# filter name, function, arguments: every filter of filters.py
+FILTERS = (
+    ("feed_rate_multiply", filters.feed_rate_multiply_filter, ("0.5",)),
+    ("feed_rate_max", filters.feed_rate_max_filter, ("300",)),
+    ("spindle_speed_multiply", filters.spindle_speed_multiply_filter, ("2",)),
+    ("spindle_speed_max", filters.spindle_speed_max_filter, ("100",)),
+    ("start_x", filters.startx_filter, ("5",)),
+    ("start_y", filters.starty_filter, ("7",)),
+    ("resize", filters.resize_filter, ("100x100",)),
+    ("rotate", filters.rotate_filter, ("30",)),
+    ("mirror", filters.mirror_filter, ("x",)),
+    ("min_distance", filters.mindistance_filter, ("0.5",)),
+    ("simplify", filters.simplify_filter, ("0.05",)),
+    ("arc_fit", filters.arc_fit_filter, ("0.01",)),
+    ("dedupe", filters.dedupe_filter, ("0.01",)),
+    ("merge_collinear", filters.merge_collinear_filter, ("0.5",)),
+    ("inside_first", filters.inside_first_filter, ()),
+    ("optimize_path", filters.optimize_path_filter, ()),
+)
+
+
+def circle_lines(cx, cy, r, feed=1200, speed=800):
+    """
+    a closed contour, G0 to its start then G1
+    """
+    yield "G0 X{:.3f} Y{:.3f}".format(cx + r, cy)
+    for i in range(1, CONTOUR_POINTS):
+        a = 2 * math.pi * i / (CONTOUR_POINTS - 1)
+        yield "G1 X{:.3f} Y{:.3f} F{} S{}".format(cx + r * math.cos(a), cy + r * math.sin(a), feed, speed)
+
+
+def contour_lines(nlines, rnd):
+    """
+    contours scattered on the work area
+    """
+    for _i in range(nlines // CONTOUR_POINTS):
+        yield from circle_lines(rnd.uniform(0, 500), rnd.uniform(0, 500), rnd.uniform(2, 20))
+
+
+def nested_lines(nlines, rnd):
+    """
+    groups of concentric contours, outer first
+    """
+    for _i in range(nlines // (CONTOUR_POINTS * NESTED_LEVELS)):
+        cx = rnd.uniform(0, 500)
+        cy = rnd.uniform(0, 500)
+        r = rnd.uniform(10, 30)
+        for level in range(NESTED_LEVELS):
+            yield from circle_lines(cx, cy, r * (NESTED_LEVELS - level) / NESTED_LEVELS)
+
+
+def raster_lines(nlines, rnd):
+    """
+    scanlines, alternating direction, spindle speed changing along the line
+    """
+    for row in range(nlines // SCANLINE_POINTS):
+        y = row * 0.1
+        xs = [i * 0.1 for i in range(SCANLINE_POINTS)]
+        if row % 2:
+            xs.reverse()
+        yield "G0 X{:.3f} Y{:.3f}".format(xs[0], y)
+        for x in xs[1:]:
+            yield "G1 X{:.3f} Y{:.3f} F3000 S{}".format(x, y, rnd.randrange(0, 1000, 50))
+
+
+GENERATORS = {
+    "contours": contour_lines,
+    "nested": nested_lines,
+    "raster": raster_lines,
+}
+
+
+def write_job_file(filename, job, nlines, seed=1):
+    """
+    write a synthetic gcode job
+    :param filename:
+    :param job: one of GENERATORS
+    :param nlines: approximate number of lines
+    :param seed: random seed, the same seed gives the same file
+    :return:
+    """
+    rnd = random.Random(seed)
+    with open(filename, "w") as h:
+        h.write("G21\nG90\nM3 S0\n")
+        for line in GENERATORS[job](nlines, rnd):
+            h.write(line)
+            h.write("\n")
+        h.write("M5\nG0 X0 Y0\n")
+
+
+def write_contour_file(filename, nlines):
+    """
+    write a gcode file of circles made of plain G0/G1 lines
+    :param filename:
+    :param nlines:
+    :return:
+    """
+    with open(filename, "w") as h:
+        for i in range(nlines):
+            a = 2 * math.pi * (i % 100) / 100
+            x = 50 + 40 * math.cos(a) + i // 100
+            y = 50 + 40 * math.sin(a)
+            if i % 100 == 0:
+                h.write("G0 X{:.3f} Y{:.3f}\n".format(x, y))
+            else:
+                h.write("G1 X{:.3f} Y{:.3f} F1200 S800\n".format(x, y))
+
+
+def traced(function):
+    """
+    :param function:
+    :return: (result of function, bytes allocated and still referenced)
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        size, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def memory_benchmark(nlines):
+    """
+    per line memory of pygcode lines and of a loaded GCodeBlock
+    :param nlines:
+    :return: dict of bytes per line
+    """
+    fd, filename = tempfile.mkstemp(suffix=".gcode")
+    os.close(fd)
+    try:
+        write_contour_file(filename, nlines)
+        with open(filename) as fh:
+            texts = fh.readlines()
+
+        _lines, pygcode_size = traced(lambda: [pygcode.Line(text) for text in texts])
+        _block, block_size = traced(lambda: GCodeBlock.read_from_file(filename))
+        _block, pygcode_block_size = traced(lambda: GCodeBlock.read_from_file(filename, parser="pygcode"))
+    finally:
+        os.remove(filename)
+
+    return {
+        "pygcode Line": pygcode_size / nlines,
+        "GCodeBlock, fast parser": block_size / nlines,
+        "GCodeBlock, pygcode parser": pygcode_block_size / nlines,
+    }
+
+
+def timed(setup, function, repeat):
+    """
+    :param setup: called before every run, not timed
+    :param function: called after setup
+    :param repeat:
+    :return: best time of repeat runs, in seconds
+    """
+    best = None
+    for _i in range(repeat):
+        setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def load(filename):
+    del gCodeBlocks[:]
+    read_gcode(filename)
+
+
+def job_timings(filename, repeat):
+    """
+    time read, write and every filter on a gcode file, each filter on a freshly read file;
+    geometric filters are timed with the transform they defer to write time
+    :param filename:
+    :param repeat:
+    :return: dict of stage name and seconds
+    """
+    out = filename + ".out"
+    timings = {
+        "read": timed(lambda: None, lambda: GCodeBlock.read_from_file(filename), repeat),
+        "write": timed(lambda: load(filename), lambda: write_gcode(out), repeat),
+    }
+    for name, function, args in FILTERS:
+        timings[name] = timed(lambda: load(filename), lambda: (function(*args), gCodeBlocks[-1].applyTransform()),
+                              repeat)
+    os.remove(out)
+    return timings
+
+
+def commit():
+    """
+    :return: git commit of the tree, None if not available
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def time_benchmark(jobs, sizes, repeat=3):
+    """
+    time read, write and filters on synthetic jobs
+    :param jobs: names of GENERATORS
+    :param sizes: line counts
+    :param repeat: runs of every stage, the best one is taken
+    :return: dict, results is a list of {job, lines, stage, seconds}
+    """
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        for job in jobs:
+            for nlines in sizes:
+                filename = os.path.join(directory, "{}_{}.gcode".format(job, nlines))
+                write_job_file(filename, job, nlines)
+                with open(filename) as fh:
+                    lines = sum(1 for _line in fh)
+                # filters report what they do, keep the benchmark output readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    timings = job_timings(filename, repeat)
+                os.remove(filename)
+                for stage, seconds in timings.items():
+                    results.append({"job": job, "lines": lines, "stage": stage, "seconds": seconds})
+                    print("{:<10} {:>8} {:<24} {:10.4f}s".format(job, lines, stage, seconds))
+    finally:
+        os.rmdir(directory)
+
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """
+    print the time ratio of stages found in both reports
+    :param old: time_benchmark report
+    :param new: time_benchmark report
+    :return:
+    """
+    before = {(r["job"], r["lines"], r["stage"]): r["seconds"] for r in old["results"]}
+    print("{} -> {}".format(old.get("commit"), new.get("commit")))
+    for r in new["results"]:
+        seconds = before.get((r["job"], r["lines"], r["stage"]))
+        if seconds:
+            print("{:<10} {:>8} {:<24} {:10.4f}s {:10.4f}s {:7.2f}x".format(
+                r["job"], r["lines"], r["stage"], seconds, r["seconds"], seconds / r["seconds"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='gcode doctor benchmarks', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--lines", type=int, default=100000, help="lines of the generated gcode, memory benchmark")
+    parser.add_argument("--time", action="store_true", help="time read, write and filters instead of memory")
+    parser.add_argument("--jobs", nargs="+", choices=sorted(GENERATORS), default=sorted(GENERATORS),
+                        help="synthetic jobs of the time benchmark")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000], help="lines of the synthetic jobs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every stage, the best one is taken")
+    parser.add_argument("--json", help="write the time benchmark report to this file")
+    parser.add_argument("--compare", help="time benchmark report of a previous commit, to compare with")
+    parser.add_argument("--write-job", nargs=3, metavar=("JOB", "LINES", "FILE"),
+                        help="only write a synthetic job, e.g. nested 100000 nested.gcode")
+    args = parser.parse_args()
+
+    if args.write_job is not None:
+        job, nlines, filename = args.write_job
+        if job not in GENERATORS:
+            parser.error("unknown job {}, one of {}".format(job, ", ".join(sorted(GENERATORS))))
+        write_job_file(filename, job, int(nlines))
+    elif args.time:
+        report = time_benchmark(args.jobs, args.sizes, args.repeat)
+        if args.json is not None:
+            with open(args.json, "w") as h:
+                json.dump(report, h, indent=1)
+        if args.compare is not None:
+            with open(args.compare) as h:
+                compare(json.load(h), report)
+    else:
+        for name, size in memory_benchmark(args.lines).items():
+            print("{:<30} {:8.0f} bytes per line".format(name, size))
@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import numpy as np
+
+# bump when parsing, or the layout of cached arrays, changes
+CACHE_VERSION = 3
+
+
+class ParseCache:
+    """
+    content addressed cache of parsed gcode files: an entry is a .npz file of the arrays of a
+    GCodeBlock, named after the hash of the file content, the parser and CACHE_VERSION.
+    The least recently used entries are removed when the cache grows over max_size bytes
+    """
+    def __init__(self, directory, max_size=256*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(filename, parser):
+        """
+        :param filename:
+        :param parser: one of gdoctor.PARSERS
+        :return: hex digest of the file content, parser and cache version
+        """
+        h = hashlib.sha256("{}:{}:".format(CACHE_VERSION, parser).encode())
+        with open(filename, 'rb') as fh:
+            for data in iter(lambda: fh.read(1024*1024), b''):
+                h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """
+        :param key:
+        :return: dict of arrays, None if the entry is missing or unreadable
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        # mark as recently used
+        os.utime(path)
+        return arrays
+
+    def store(self, key, arrays):
+        """
+        write an entry, then evict old ones
+        :param key:
+        :param arrays: dict of numpy arrays
+        :return:
+        """
+        path = self.path(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, 'wb') as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """
+        remove least recently used entries, until the cache is not larger than max_size
+        :return: number of removed entries
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for _mtime, size, _name in entries)
+        removed = 0
+        for _mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
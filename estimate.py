@@ -0,0 +1,200 @@
+import numpy as np
+
+from commons import gCodeBlocks
+from geometry import fill_forward, RAPID, LINEAR, ARCS, ARC_CCW
+
+# default machine: G00 rate in mm/min, acceleration in mm/s^2, junction deviation in mm
+RAPID_RATE = 5000.0
+ACCELERATION = 1000.0
+JUNCTION_DEVIATION = 0.01
+
+# blocks listed by the report
+LONGEST_BLOCKS = 5
+
+
+def junction_speeds(entry, leave, acceleration, junction_deviation):
+    """
+    max squared speed through the junctions of consecutive moves, as the grbl planner
+    :param entry: (x, y, z) numpy arrays, unit vector of every move at its start
+    :param leave: (x, y, z) numpy arrays, unit vector of every move at its end
+    :param acceleration:
+    :param junction_deviation:
+    :return: numpy array, squared speed at the start of every move, 0 for the first one
+    """
+    w = np.zeros(len(entry[0]))
+    cos = -sum(b[:-1]*a[1:] for a, b in zip(entry, leave))
+    sin_half = np.sqrt(np.clip(0.5*(1.0 - cos), 0.0, 1.0))
+    with np.errstate(divide='ignore'):
+        w[1:] = np.where(sin_half > 0.999999, np.inf,
+                         acceleration*junction_deviation*sin_half/(1.0 - sin_half))
+    return w
+
+
+def arc_moves(dx, dy, dz, i, j, ccw):
+    """
+    length and tangents of arcs
+    :param dx: numpy arrays, from start to end point
+    :param dy:
+    :param dz:
+    :param i: numpy arrays, from start to center
+    :param j:
+    :param ccw: numpy array, True for G03
+    :return: length, radius, (x, y, z) unit vectors at start and at end
+    """
+    radius = np.hypot(i, j)
+    x0 = -i
+    y0 = -j
+    x1 = x0 + dx
+    y1 = y0 + dy
+    sweep = np.arctan2(x0*y1 - y0*x1, x0*x1 + y0*y1)
+    sweep = np.where(ccw, np.where(sweep <= 0, sweep + 2*np.pi, sweep), np.where(sweep >= 0, sweep - 2*np.pi, sweep))
+    length = np.hypot(radius*sweep, dz)
+    turn = np.where(ccw, 1.0, -1.0) / np.maximum(radius, 1e-12)
+    zero = np.zeros(len(dx))
+    return length, radius, (-y0*turn, x0*turn, zero), (-y1*turn, x1*turn, zero)
+
+
+def plan(limit, length, acceleration):
+    """
+    entry speeds of moves, as the forward and backward passes of a motion planner,
+    written as prefix minimums: w[i] = min(limit[i], w[i+1] + 2 a L[i]), then
+    w[i+1] = min(w[i+1], w[i] + 2 a L[i]), starting and ending at rest
+    :param limit: numpy array, max squared entry speed of every move
+    :param length: numpy array, length of every move
+    :param acceleration:
+    :return: numpy array of squared speeds, at the start of every move and at the end of the last one
+    """
+    limit = np.append(limit, 0.0)
+    reach = np.concatenate(([0.0], np.cumsum(2.0*acceleration*length)))
+    backward = np.minimum.accumulate((limit + reach)[::-1])[::-1] - reach
+    forward = np.minimum.accumulate(backward - reach) + reach
+    return np.clip(forward, 0.0, None)
+
+
+def trapezoid_times(length, entry, cruise, exit_speed, acceleration):
+    """
+    time of moves accelerating from entry to cruise speed, then decelerating to exit speed,
+    without reaching cruise speed when the move is too short
+    :return: numpy array of seconds
+    """
+    accelerate = (cruise*cruise - entry*entry)/(2.0*acceleration)
+    decelerate = (cruise*cruise - exit_speed*exit_speed)/(2.0*acceleration)
+    trapezoid = accelerate + decelerate <= length
+    peak = np.sqrt(np.maximum((2.0*acceleration*length + entry*entry + exit_speed*exit_speed)/2.0, 0.0))
+    top = np.where(trapezoid, cruise, np.minimum(peak, cruise))
+    cruising = np.where(trapezoid, (length - accelerate - decelerate)/cruise, 0.0)
+    return (top - entry)/acceleration + (top - exit_speed)/acceleration + cruising
+
+
+def move_times(block, rapid_rate=RAPID_RATE, acceleration=ACCELERATION, junction_deviation=JUNCTION_DEVIATION):
+    """
+    time of the G00, G01, G02 and G03 moves of a loaded block, in the order of its lines.
+    Moves start from the end of the last move, lines with other gcodes (e.g. M5) between moves
+    stop the machine, feed rate is modal, moves without a known feed rate, or with F0, go at rapid rate;
+    arcs read from file are timed along their chord, units are assumed to be mm
+    :param block: GCodeBlock
+    :param rapid_rate: mm/min
+    :param acceleration: mm/s^2
+    :param junction_deviation: mm
+    :return: (seconds, rapid) numpy arrays indexed by geometry row: time of the move of every line, G00 mask
+    """
+    geometry = block.geometry
+    order = np.array([line.index for line in block.lines], dtype=np.int64)
+    motion = geometry.motion[order]
+    rapid = motion == RAPID
+    arc = np.isin(motion, ARCS)
+    moves = rapid | (motion == LINEAR) | arc
+
+    dx, dy, dz = [np.nan_to_num(np.diff(fill_forward(np.where(moves, column[order], np.nan)), prepend=np.nan))
+                  for column in (geometry.x, geometry.y, geometry.z)]
+    length = np.sqrt(dx*dx + dy*dy + dz*dz)
+    segment = np.flatnonzero(moves & (length > 0))
+
+    feed = fill_forward(geometry.f[order])
+    # F0, or a negative F, is no feed rate
+    rate = np.where(rapid | ~(feed > 0), rapid_rate, feed)[segment] / 60.0
+    dx = dx[segment]
+    dy = dy[segment]
+    dz = dz[segment]
+    length = length[segment]
+    entry = [dx/length, dy/length, dz/length]
+    leave = [column.copy() for column in entry]
+
+    # arcs made by filters, arcs read from file, and arcs without radius, go along their chord
+    i = geometry.i[order][segment]
+    j = geometry.j[order][segment]
+    fitted = np.flatnonzero(arc[segment] & ~np.isnan(i) & ((i != 0) | (j != 0)))
+    if len(fitted):
+        arc_length, radius, arc_entry, arc_leave = arc_moves(dx[fitted], dy[fitted], dz[fitted], i[fitted], j[fitted],
+                                                             motion[segment][fitted] == ARC_CCW)
+        length[fitted] = arc_length
+        for column, arc_column in zip(entry + leave, arc_entry + arc_leave):
+            column[fitted] = arc_column
+        # centripetal acceleration
+        rate[fitted] = np.minimum(rate[fitted], np.sqrt(acceleration*radius))
+
+    w = junction_speeds(entry, leave, acceleration, junction_deviation)
+    w = np.minimum(w, rate*rate)
+    w[1:] = np.minimum(w[1:], rate[:-1]*rate[:-1])
+
+    # other gcodes between two moves empty the planner
+    barrier = np.cumsum([line.line is not None and not move and not line.empty()
+                         for line, move in zip(block.lines, moves.tolist())])
+    if len(segment) > 1:
+        w[1:][barrier[segment[1:]] != barrier[segment[:-1]]] = 0.0
+
+    speed = np.sqrt(plan(w, length, acceleration))
+    seconds = np.zeros(len(geometry))
+    seconds[order[segment]] = trapezoid_times(length, speed[:-1], rate, speed[1:], acceleration)
+    rapid_rows = np.zeros(len(geometry), dtype=bool)
+    rapid_rows[order[rapid]] = True
+    return seconds, rapid_rows
+
+
+def estimate(block, rapid_rate=RAPID_RATE, acceleration=ACCELERATION, junction_deviation=JUNCTION_DEVIATION):
+    """
+    :param block: GCodeBlock
+    :return: (total, rapid, cut) seconds of the block, list of (total, rapid, cut) of every G01Block
+    """
+    seconds, rapid = move_times(block, rapid_rate, acceleration, junction_deviation)
+    g01blocks = []
+    for g01block in block.g01blocks:
+        rows = np.array([line.index for line in g01block.lines], dtype=np.int64)
+        rapid_time = float(seconds[rows][rapid[rows]].sum())
+        total = float(seconds[rows].sum())
+        g01blocks.append((total, rapid_time, total - rapid_time))
+    rapid_time = float(seconds[rapid].sum())
+    total = float(seconds.sum())
+    return (total, rapid_time, total - rapid_time), g01blocks
+
+
+def hms(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return "{}:{:02d}:{:04.1f}".format(hours, minutes, seconds)
+
+
+def estimate_report(rapid_rate=RAPID_RATE, acceleration=ACCELERATION, junction_deviation=JUNCTION_DEVIATION):
+    """
+    print the estimated time of the last loaded block, and its longest G01Blocks
+    :return: (total, rapid, cut) seconds, None if not available
+    """
+    print("estimate, rapid rate {} mm/min, acceleration {} mm/s^2, junction deviation {} mm".format(
+        rapid_rate, acceleration, junction_deviation))
+    if len(gCodeBlocks) == 0:
+        print("estimate: no gcode loaded")
+        return None
+    block = gCodeBlocks[-1]
+    if block.streaming:
+        print("estimate: not available in stream mode")
+        return None
+    block.applyTransform()
+
+    job, g01blocks = estimate(block, rapid_rate, acceleration, junction_deviation)
+    print("estimate: {} total, {} rapid, {} cut, {} g01blocks".format(hms(job[0]), hms(job[1]), hms(job[2]),
+                                                                    len(g01blocks)))
+    longest = sorted(range(len(g01blocks)), key=lambda i: g01blocks[i][0], reverse=True)[:LONGEST_BLOCKS]
+    for i in longest:
+        print("estimate: g01block {}: {:.2f}s total, {:.2f}s rapid, {:.2f}s cut, {}".format(
+            i, g01blocks[i][0], g01blocks[i][1], g01blocks[i][2], block.g01blocks[i]))
+    return job
@@ -0,0 +1,263 @@
+import itertools
+import mmap
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pygcode
+
+from gcodeio import read_lines, line_ranges, lines_at
+from geometry import Geometry, gcode_values, block_bounds, RAPID, LINEAR, NAN, WORD_X, WORD_Y, WORD_Z, WORD_F, WORD_S
+from geometry import S_FIRST
+
+# G0/G1 followed only by X, Y, Z, F, S words, same number syntax of pygcode
+MOTION_LINE = re.compile(r'^\s*G0*([01])(?![\d.])((?:\s*[XYZFS]\s*-?(?:\d+\.?\d*|\.\d+))*)\s*$')
+MOTION_WORD = re.compile(r'([XYZFS])\s*(-?(?:\d+\.?\d*|\.\d+))')
+
+WORD_LETTERS = {
+    'X': WORD_X,
+    'Y': WORD_Y,
+    'Z': WORD_Z,
+    'F': WORD_F,
+    'S': WORD_S,
+}
+
+MOTION_CODES = {
+    '0': RAPID,
+    '1': LINEAR,
+}
+
+# ranges of a file parsed by every worker process, more than one so that workers finishing early take another
+RANGES_PER_WORKER = 4
+# lines sent to a worker at a time, for files that cannot be split by byte ranges, e.g. compressed ones
+PARALLEL_CHUNK = 50000
+
+
+def motion_words(text):
+    """
+    parse a plain G0/G1 line, without going through pygcode's text and modal machinery
+    :param text: line from a gcode file
+    :return: (motion, x, y, z, f, s, flags) as geometry.gcode_values, None if the line is not a plain G0/G1 line
+    """
+    match = MOTION_LINE.match(text)
+    if match is None:
+        return None
+
+    values = {}
+    flags = 0
+    for letter, value in MOTION_WORD.findall(match.group(2)):
+        if letter in values:
+            # let pygcode complain
+            return None
+        if letter == 'S' and 'F' not in values:
+            flags |= S_FIRST
+        values[letter] = float(value)
+        flags |= WORD_LETTERS[letter]
+
+    return (MOTION_CODES[match.group(1)], values.get('X', NAN), values.get('Y', NAN), values.get('Z', NAN),
+            values.get('F', NAN), values.get('S', NAN), flags)
+
+
+def segment(motion, breaks):
+    """
+    G01Blocks of lines, as read_from_file segments them
+    :param motion: numpy array, of every line
+    :param breaks: numpy array, True for lines starting a G01Block: lines other than G01 and empty lines,
+     the first line always starts one
+    :return: (sizes, islast) numpy arrays: lines of every G01Block; 1 for the last G00 or G01 move of a block,
+     0 for other moves, -1, None, for other lines
+    """
+    breaks = breaks.copy()
+    breaks[:1] = True
+    starts = np.flatnonzero(breaks)
+    sizes = np.diff(np.append(starts, len(motion)))
+    moves = (motion == RAPID) | (motion == LINEAR)
+    islast = np.where(moves, 0, -1).astype(np.int8)
+    if len(starts):
+        last = np.maximum.reduceat(np.where(moves, np.arange(len(motion)), -1), starts)
+        islast[last[last >= 0]] = 1
+    return sizes, islast
+
+
+def parse_lines(lines, parser="fast"):
+    """
+    parse lines as GCodeLine does, without making GCodeLine objects, e.g. in a worker process.
+    Lines do not depend on the lines before them: missing words are NaN, modal values are filled
+    by filters when needed, so that chunks of a file can be parsed separately
+    :param lines: list of lines
+    :param parser: one of gdoctor.PARSERS
+    :return: dict of numpy arrays: Geometry columns but I, J, flags, fallback_index and fallback_text of the lines
+     that are not plain G0/G1 lines, breaks, True for lines starting a G01Block, islast as if the chunk was a file
+    """
+    rows = []
+    fallback_index = []
+    fallback_text = []
+    empty = []
+    for k, text in enumerate(lines):
+        words = motion_words(text) if parser == "fast" else None
+        if words is None:
+            gcodes = pygcode.Line(text).block.gcodes
+            words = gcode_values(gcodes)
+            fallback_index.append(k)
+            fallback_text.append(text.rstrip("\n"))
+            if len(gcodes) == 0:
+                empty.append(k)
+        rows.append(words)
+
+    motion, x, y, z, f, s, flags = zip(*rows) if len(rows) else ((),) * 7
+    arrays = {name: np.array(values, dtype=np.float64) for name, values in zip(("x", "y", "z", "f", "s"), (x, y, z, f, s))}
+    arrays["motion"] = np.array(motion, dtype=np.int8)
+    arrays["flags"] = np.array(flags, dtype=np.uint8)
+    arrays["fallback_index"] = np.array(fallback_index, dtype=np.int64)
+    arrays["fallback_text"] = np.array(fallback_text, dtype=str)
+    arrays["breaks"] = arrays["motion"] != LINEAR
+    arrays["breaks"][empty] = False
+    _sizes, arrays["islast"] = segment(arrays["motion"], arrays["breaks"])
+    return arrays
+
+
+def parse_range(filename, offset, length, parser="fast"):
+    """
+    parse the lines of a byte range of a plain file, see line_ranges
+    :return: dict of numpy arrays, see parse_lines
+    """
+    with open(filename, 'rb') as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return parse_lines(lines_at(mm, offset, length), parser)
+
+
+def parse_chunks(filename, parser="fast", workers=2):
+    """
+    parse a file in a pool of worker processes: plain files are split at line boundaries into byte ranges
+    that workers read by themselves, other files are read here and sent in chunks of lines
+    :param filename:
+    :param parser: one of gdoctor.PARSERS
+    :param workers: worker processes
+    :return: generator of dict of numpy arrays, see parse_lines, in file order, as soon as they are parsed
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        ranges = line_ranges(filename, workers * RANGES_PER_WORKER)
+        if ranges is not None:
+            yield from executor.map(parse_range, itertools.repeat(filename), [r[0] for r in ranges],
+                                    [r[1] for r in ranges], itertools.repeat(parser))
+        else:
+            lines = read_lines(filename)
+            chunks = iter(lambda: list(itertools.islice(lines, PARALLEL_CHUNK)), [])
+            yield from executor.map(parse_lines, chunks, itertools.repeat(parser))
+
+
+def join_chunks(chunks):
+    """
+    join parsed chunks of a file, segmenting G01Blocks across chunk edges
+    :param chunks: list of dict of numpy arrays, see parse_lines, in file order
+    :return: dict of numpy arrays, as GCodeBlock.toArrays
+    """
+    if len(chunks) == 0:
+        chunks = [parse_lines([])]
+    arrays = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in ("x", "y", "z", "f", "s", "motion",
+                                                                                   "flags", "fallback_text")}
+    n = len(arrays["motion"])
+    arrays["i"] = np.full(n, np.nan)
+    arrays["j"] = np.full(n, np.nan)
+    offsets = np.cumsum([0] + [len(chunk["motion"]) for chunk in chunks[:-1]])
+    arrays["fallback_index"] = np.concatenate([chunk["fallback_index"] + offset
+                                               for chunk, offset in zip(chunks, offsets)])
+    sizes, arrays["islast"] = segment(arrays["motion"], np.concatenate([chunk["breaks"] for chunk in chunks]))
+    arrays["block_size"] = sizes.astype(np.int64)
+    arrays["block_bounds"] = block_bounds(arrays["x"], arrays["y"], arrays["motion"], sizes)
+    return arrays
+
+
+def check_lines(lines, name):
+    """
+    compare fast parsed lines against pygcode ones
+    :param lines: iterable of line texts
+    :param name: shown in the report, e.g. the file name
+    :return: (fast parsed lines, mismatching lines)
+    """
+    fast = 0
+    mismatches = 0
+    for n, text in enumerate(lines, 1):
+        words = motion_words(text)
+        if words is None:
+            continue
+        fast += 1
+        geometry = Geometry()
+        geometry.append(*words[:-1])
+        line = pygcode.Line(text)
+        expected = (str(line), gcode_values(line.block.gcodes))
+        got = (geometry.format(0, words[-1]), words)
+        if line.comment is not None or line.macro is not None or line.block.modal_params or repr(expected) != repr(got):
+            mismatches += 1
+            print("{}:{}: {!r} -> pygcode {} fast {}".format(name, n, text, expected, got))
+    return fast, mismatches
+
+
+def check_parity(filename):
+    """
+    compare fast parsed lines of a file against pygcode ones
+    :param filename:
+    :return: number of mismatching lines
+    """
+    fast, mismatches = check_lines(read_lines(filename), filename)
+    print("{}: {} fast parsed lines, {} mismatches".format(filename, fast, mismatches))
+    return mismatches
+
+
+def check_samples():
+    """
+    compare the fast parser against pygcode on PARITY_SAMPLES, checking also which lines take the fast path
+    :return: number of mismatching lines
+    """
+    _fast, mismatches = check_lines([text for text, _fast_path in PARITY_SAMPLES], "samples")
+    for text, fast_path in PARITY_SAMPLES:
+        if (motion_words(text) is not None) != fast_path:
+            mismatches += 1
+            print("samples: {!r} {} the fast parser".format(text, "should take" if fast_path else "should skip"))
+    print("samples: {} lines, {} mismatches".format(len(PARITY_SAMPLES), mismatches))
+    return mismatches
+
+
+# line, True if the fast parser takes it: every other line must be left to pygcode
+PARITY_SAMPLES = (
+    ("G1 X10 Y20 F300 S100", True),
+    ("G1 X10 Y20 S100 F300", True),
+    ("G1 S100 F300", True),
+    ("G0X1.5Y-2", True),
+    ("G01X.5Y-.25Z1F1200S0", True),
+    ("  G1  X 1  Y 2 ", True),
+    ("G1 X1.", True),
+    ("G00 Z5", True),
+    ("G1 Y7", True),
+    ("G1 F600", True),
+    ("G1", True),
+    ("X10 Y20", False),
+    ("Y20", False),
+    ("F300", False),
+    ("S100 F300", False),
+    ("G1 X10 Y20 ; comment", False),
+    ("G1 X10 (comment) Y20", False),
+    ("(comment)", False),
+    ("; comment", False),
+    ("N10 G1 X10 Y20", False),
+    ("G1 X1 X2", False),
+    ("G10 X1", False),
+    ("G1.1 X1", False),
+    ("G2 X20 Y0 I5 J0", False),
+    ("G03 X30 Y5 I5", False),
+    ("G2 X40 Y0 R5", False),
+    ("G1 X10 Y20 M3", False),
+    ("G1 X1 g1", False),
+    ("", False),
+)
+
+
+if __name__ == "__main__":
+    # python3 fastparse.py file.gcode ..., without files the parity check runs on PARITY_SAMPLES
+    failed = 0
+    for name in sys.argv[1:]:
+        failed += check_parity(name)
+    if len(sys.argv) == 1:
+        failed += check_samples()
+    sys.exit(1 if failed else 0)
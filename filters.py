@@ -1,7 +1,13 @@
 import math
 
-import pygcode
+import numpy as np
+
 from commons import gCodeBlocks
+from geometry import NO_MOTION, RAPID, LINEAR, ARC_CW, ARC_CCW, ARCS, WORD_X, WORD_Y, WORD_Z, WORD_F, WORD_S
+from geometry import S_FIRST
+from geometry import fill_forward, simplify_polyline, fit_arcs, translation, scaling, rotation, axis_aligned
+from spatial import PointGrid, LineGrid, containment_lists
+from tour import Tour
 
 
 def feed_rate_multiply_filter(par):
@@ -24,10 +30,11 @@ def feed_rate_multiply_filter(par):
 
     print("feed_rate_multiply_filter: {}".format(value))
 
-    for line in block_to_filter.lines:
-        if line.contains(pygcode.gcodes.GCodeFeedRate):
-            gcode_feed_rate = line.get(pygcode.gcodes.GCodeFeedRate)
-            gcode_feed_rate.word.value *= value
+    def multiply(block):
+        block.geometry.f *= value
+
+    block_to_filter.apply(multiply)
+    block_to_filter.mapStats("f", lambda v: v * value)
 
 
 def feed_rate_max_filter(par):
@@ -48,10 +55,13 @@ def feed_rate_max_filter(par):
 
     print("feed_rate_max_filter: {}".format(value))
 
-    for line in block_to_filter.lines:
-        if line.contains(pygcode.gcodes.GCodeFeedRate):
-            gcode_feed_rate = line.get(pygcode.gcodes.GCodeFeedRate)
-            gcode_feed_rate.word.value = gcode_feed_rate.word.value / block_to_filter.fmax * value
+    fmax = block_to_filter.fmax
+
+    def rescale(block):
+        block.geometry.f = block.geometry.f / fmax * value
+
+    block_to_filter.apply(rescale)
+    block_to_filter.mapStats("f", lambda v: v / fmax * value)
 
 
 
@@ -76,10 +86,11 @@ def spindle_speed_multiply_filter(par):
 
     print("spindle_speed_multiply_filter: {}".format(value))
 
-    for line in block_to_filter.lines:
-        if line.contains(pygcode.gcodes.GCodeSpindleSpeed):
-            gcode_spindle_speed = line.get(pygcode.gcodes.GCodeSpindleSpeed)
-            gcode_spindle_speed.word.value *= value
+    def multiply(block):
+        block.geometry.s *= value
+
+    block_to_filter.apply(multiply)
+    block_to_filter.mapStats("s", lambda v: v * value)
 
 
 def spindle_speed_max_filter(par):
@@ -101,10 +112,13 @@ def spindle_speed_max_filter(par):
 
     print("spindle_speed_max_filter: {}".format(value))
 
-    for line in block_to_filter.lines:
-        if line.contains(pygcode.gcodes.GCodeSpindleSpeed):
-            gcode_spindle_speed = line.get(pygcode.gcodes.GCodeSpindleSpeed)
-            gcode_spindle_speed.word.value = gcode_spindle_speed.word.value/ block_to_filter.smax * value
+    smax = block_to_filter.smax
+
+    def rescale(block):
+        block.geometry.s = block.geometry.s / smax * value
+
+    block_to_filter.apply(rescale)
+    block_to_filter.mapStats("s", lambda v: v / smax * value)
 
 
 def startx_filter(par):
@@ -125,16 +139,11 @@ def startx_filter(par):
 
     print("startx_filter: {}".format(value))
 
-    if block_to_filter.xmin == value:
+    xmin = block_to_filter.xmin
+    if xmin == value:
         print("startx_filter: already start at {}".format(value))
 
-    for line in block_to_filter.lines:
-        for gcode in line.block.gcodes:
-            try:
-                if gcode.X is not None:
-                    gcode.X = gcode.X - block_to_filter.xmin + value
-            except AttributeError:
-                pass
+    block_to_filter.transformBy(translation(value - xmin, 0.0))
 
 
 def mindistance_filter(par):
@@ -155,60 +164,605 @@ def mindistance_filter(par):
 
     print("mindistance_filter: {}".format(value))
 
+    if block_to_filter.streaming:
+        print("mindistance_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
     removed_codes = 0
     total_codes = 0
-    g01blocks = block_to_filter.g01blocks
-    ng01 = len(g01blocks)
+    geometry = block_to_filter.geometry
+    xs = geometry.x.tolist()
+    ys = geometry.y.tolist()
+    motions = geometry.motion.tolist()
 
-    for g01block in g01blocks:
+    # last seen coordinates, carried across blocks
+    px = None
+    py = None
+
+    for g01block in block_to_filter.g01blocks:
         if g01block.size() < 4:
             continue
         lastX = None
         lastY = None
+        # arcs start from the previous move
+        arc_starts = set()
+        previous = None
+        for line in g01block.lines:
+            if motions[line.index] != NO_MOTION:
+                if motions[line.index] in ARCS and previous is not None:
+                    arc_starts.add(previous)
+                previous = line.index
 
-        linecount = len(g01block.lines)
         first = True
-        for j, line in enumerate(g01block.lines):
-            gcode_to_remove = []
-            for i, gcode in enumerate(line.block.gcodes):
-                try:
-                    if gcode.X is not None:
-                        px = gcode.X
-                    if gcode.Y is not None:
-                        py = gcode.Y
-
-                    distance = None
-                    if not first and px is not None and py is not None:
-                        dx = px-lastX
-                        dy = py-lastY
-
-                        distance = math.sqrt(dx*dx+dy*dy)
-
-                    total_codes += 1
-                    if (distance is None) or (distance > value):
-                        # emetto
-                        lastX = px
-                        lastY = py
-                    else:
-                        # remove this code
-                        #print("remove {} from line {}".format(gcode, line))
-                        gcode_to_remove.append(gcode)
-
-                    first = False
-
-                except AttributeError:
-                    pass
-            if len(gcode_to_remove) and line.islast is not None and not line.islast:
-                removed_codes += len(gcode_to_remove)
-                new_gcode_block = []
-                for g1 in line.block.gcodes:
-                    if g1 not in gcode_to_remove:
-                        new_gcode_block.append(g1)
-                line.block.gcodes = new_gcode_block
-
+        for line in g01block.lines:
+            i = line.index
+            if motions[i] == NO_MOTION:
+                continue
+            # keep the last value of a missing word
+            if not math.isnan(xs[i]):
+                px = xs[i]
+            if not math.isnan(ys[i]):
+                py = ys[i]
+
+            distance = None
+            if not first and px is not None and py is not None and lastX is not None and lastY is not None:
+                dx = px-lastX
+                dy = py-lastY
+
+                distance = math.sqrt(dx*dx+dy*dy)
+
+            total_codes += 1
+            if (distance is None) or (distance > value):
+                # emetto
+                lastX = px
+                lastY = py
+            elif motions[i] == LINEAR and line.islast is not None and not line.islast and i not in arc_starts:
+                # remove the move of this line
+                removed_codes += 1
+                line.removeMotion()
+
+            first = False
+
+    block_to_filter.refreshStats()
     print ("Removed {} out of {}".format(removed_codes, total_codes))
 
 
+def simplify_filter(par):
+    """
+    remove G01 moves with Ramer-Douglas-Peucker simplification of every block:
+    removed points are not farther than parameter from the simplified path.
+    Moves with Z, changing F or S, or carrying comments are always kept
+    :param par: tolerance
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    try:
+        value = float(par)
+    except ValueError:
+        value = eval(par)
+
+    print("simplify_filter: {}".format(value))
+
+    if block_to_filter.streaming:
+        print("simplify_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
+    geometry = block_to_filter.geometry
+    total_points = 0
+    removed_rows = []
+
+    for g01block in block_to_filter.g01blocks:
+        rows = np.array([line.index for line in g01block.lines], dtype=np.intp)
+        motion = geometry.motion[rows]
+        points = np.flatnonzero((motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS))
+        total_points += len(points)
+        if len(points) < 3:
+            continue
+
+        point_rows = rows[points]
+        x = fill_forward(geometry.x[point_rows])
+        y = fill_forward(geometry.y[point_rows])
+        anchor = (geometry.motion[point_rows] != LINEAR) | ~np.isnan(geometry.z[point_rows])
+        anchor |= np.isnan(x) | np.isnan(y)
+        anchor |= changes(geometry.f[point_rows]) | changes(geometry.s[point_rows])
+        anchor |= np.array([g01block.lines[p].line is not None for p in points])
+        # arcs start from the previous point
+        anchor[:-1] |= np.isin(geometry.motion[point_rows[1:]], ARCS)
+        anchor[0] = anchor[-1] = True
+
+        keep = anchor.copy()
+        anchors = np.flatnonzero(anchor)
+        for a, b in zip(anchors[:-1], anchors[1:]):
+            if b - a > 1:
+                keep[a:b+1] |= simplify_polyline(x[a:b+1], y[a:b+1], value)
+
+        if keep.all():
+            continue
+        removed = set(points[~keep].tolist())
+        g01block.lines = [line for i, line in enumerate(g01block.lines) if i not in removed]
+        removed_rows.append(point_rows[~keep])
+
+    removed_points = 0
+    if len(removed_rows):
+        removed_rows = np.concatenate(removed_rows)
+        removed_points = len(removed_rows)
+        geometry.removeRows(removed_rows)
+
+        # rearrange original lines
+        block_to_filter.lines = []
+        for g01block in block_to_filter.g01blocks:
+            for line in g01block.lines:
+                block_to_filter.lines.append(line)
+        block_to_filter.refreshStats()
+
+    kept_points = total_points - removed_points
+    print("simplify_filter: kept {} out of {} points, reduction ratio {:.2f}".format(
+        kept_points, total_points, total_points / kept_points if kept_points else 1))
+
+
+def merge_collinear_filter(par):
+    """
+    merge runs of collinear G01 moves, with the same feed rate and about the same spindle speed, into a single
+    move, e.g. along the scanlines of raster engravings: every merged move turns by at most the angle
+    tolerance from the move kept, and its spindle speed differs at most by the power tolerance.
+    Moves with Z, or carrying comments, and moves across other lines are kept
+    :param par: angle tolerance in degrees, optionally followed by the spindle speed tolerance, e.g. 0.5,10
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    values = []
+    for value in par.split(","):
+        try:
+            values.append(float(value))
+        except ValueError:
+            values.append(eval(value))
+    angle = math.radians(values[0])
+    power = values[1] if len(values) > 1 else 0.0
+
+    print("merge_collinear_filter: {} degrees, spindle speed {}".format(values[0], power))
+
+    if block_to_filter.streaming:
+        print("merge_collinear_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
+    geometry = block_to_filter.geometry
+    lines = block_to_filter.lines
+    order = np.array([line.index for line in lines], dtype=np.intp)
+    motion = geometry.motion[order]
+    moves = (motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS)
+    flags = np.array([line.flags for line in lines], dtype=np.int64)
+    fallback = np.array([line.line is not None for line in lines])
+    # lines other than moves, e.g. M5 or comments, stop a run
+    barrier = np.cumsum(~moves & (fallback | ((flags & (WORD_F | WORD_S)) != 0)))
+
+    points = np.flatnonzero(moves)
+    rows = order[points]
+    x = fill_forward(geometry.x[rows])
+    y = fill_forward(geometry.y[rows])
+    f = fill_forward(geometry.f[order])[points]
+    s = fill_forward(geometry.s[order])[points]
+
+    # the move to point k can be merged with the move to point k + 1 if both are plain G01 moves
+    plain = (motion[points] == LINEAR) & ((flags[points] & WORD_Z) == 0) & ~fallback[points]
+    plain &= ~(np.isnan(x) | np.isnan(y))
+    plain[0] = False
+    plain[1:] &= ~(np.isnan(x[:-1]) | np.isnan(y[:-1]))
+    anchor = np.ones(len(points), dtype=bool)
+    anchor[:-1] = ~(plain[:-1] & plain[1:])
+    anchor[:-1] |= barrier[points[1:]] != barrier[points[:-1]]
+    # moves before the first F or S word, NaN there, go on with the same feed rate and spindle speed
+    anchor[:-1] |= ~((f[1:] == f[:-1]) | (np.isnan(f[1:]) & np.isnan(f[:-1])))
+    anchor[:-1] |= ~((np.abs(s[1:] - s[:-1]) <= power) | (np.isnan(s[1:]) & np.isnan(s[:-1])))
+
+    heading = np.zeros(len(points))
+    length = np.zeros(len(points))
+    if len(points) > 1:
+        heading[1:] = np.arctan2(np.diff(y), np.diff(x))
+        length[1:] = np.hypot(np.diff(x), np.diff(y))
+    # consecutive moves turning by more than twice the tolerance are not both within tolerance from a move kept
+    turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+    anchor[:-1] |= (turn > 2 * angle) & (length[:-1] > 0) & (length[1:] > 0)
+
+    # every move of a run within tolerance from its last move, the one kept: scanning back from it, the first
+    # move out of tolerance is kept too, and the moves before it are checked against it
+    positions = np.arange(len(points))
+    tail = np.minimum.accumulate(np.where(anchor, positions, len(points))[::-1])[::-1]
+    turn = np.abs((heading - heading[tail] + np.pi) % (2 * np.pi) - np.pi)
+    # spindle speeds of a run are all NaN, or none
+    off = ~anchor & (((turn > angle) & (length > 0)) | (np.abs(s - s[tail]) > power))
+    if off.any():
+        kept = anchor.tolist()
+        heading_list, length_list, s_list = heading.tolist(), length.tolist(), s.tolist()
+        for last in np.unique(tail[off]).tolist():
+            k = last - 1
+            while not kept[k]:
+                turned = abs((heading_list[k] - heading_list[last] + math.pi) % (2 * math.pi) - math.pi)
+                if (turned > angle and length_list[k] > 0) or abs(s_list[k] - s_list[last]) > power:
+                    kept[k] = True
+                    last = k
+                k -= 1
+        anchor = np.array(kept)
+        tail = np.minimum.accumulate(np.where(anchor, positions, len(points))[::-1])[::-1]
+
+    removed = np.flatnonzero(~anchor)
+    if len(removed) == 0:
+        print("merge_collinear_filter: no collinear moves, {} lines".format(len(lines)))
+        return
+
+    # the kept move gets the words of the removed ones, so that it goes to the same point, with the
+    # same modal feed rate and spindle speed
+    words = np.zeros(len(points), dtype=np.int64)
+    np.bitwise_or.at(words, tail[removed], flags[points[removed]] & (WORD_X | WORD_Y | WORD_F | WORD_S))
+    words &= ~flags[points]
+    for k in np.flatnonzero(words).tolist():
+        lines[points[k]].flags |= int(words[k])
+    for word, column, values in ((WORD_X, geometry.x, x), (WORD_Y, geometry.y, y), (WORD_F, geometry.f, f),
+                                 (WORD_S, geometry.s, s)):
+        added = np.flatnonzero(words & word)
+        column[rows[added]] = values[added]
+
+    geometry.removeRows(rows[removed])
+    gone = np.zeros(len(geometry), dtype=bool)
+    gone[rows[removed]] = True
+    for g01block in block_to_filter.g01blocks:
+        g01block.lines = [line for line in g01block.lines if not gone[line.index]]
+
+    # rearrange original lines
+    block_to_filter.lines = []
+    for g01block in block_to_filter.g01blocks:
+        for line in g01block.lines:
+            block_to_filter.lines.append(line)
+    block_to_filter.refreshStats()
+
+    runs = len(np.unique(tail[removed]))
+    print("merge_collinear_filter: {} G01 moves merged into {}, {} lines saved, from {} to {} lines".format(
+        len(removed) + runs, runs, len(removed), len(lines), len(block_to_filter.lines)))
+
+
+def arc_fit_filter(par):
+    """
+    replace runs of G01 moves of every block with G02/G03 arcs: the replaced moves are not farther
+    than parameter from the arc. Moves with Z, changing F or S, or carrying comments are kept
+    :param par: tolerance
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    try:
+        value = float(par)
+    except ValueError:
+        value = eval(par)
+
+    print("arc_fit_filter: {}".format(value))
+
+    if block_to_filter.streaming:
+        print("arc_fit_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
+    geometry = block_to_filter.geometry
+    total_lines = len(block_to_filter.lines)
+    removed_rows = []
+    arcs = 0
+    deviation = 0.0
+
+    for g01block in block_to_filter.g01blocks:
+        rows = np.array([line.index for line in g01block.lines], dtype=np.intp)
+        motion = geometry.motion[rows]
+        points = np.flatnonzero((motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS))
+        if len(points) < 4:
+            continue
+
+        point_rows = rows[points]
+        x = fill_forward(geometry.x[point_rows])
+        y = fill_forward(geometry.y[point_rows])
+        # moves that can end an arc, and moves that can be inside one
+        end = (geometry.motion[point_rows] == LINEAR) & np.isnan(geometry.z[point_rows])
+        end &= ~(np.isnan(x) | np.isnan(y))
+        end &= np.array([g01block.lines[p].line is None for p in points])
+        inside = end & ~(changes(geometry.f[point_rows]) | changes(geometry.s[point_rows]))
+        inside[-1] = False
+
+        removed = []
+        anchors = np.flatnonzero(~inside)
+        for a, b in zip(anchors[:-1], anchors[1:]):
+            if not end[b]:
+                b -= 1
+            if b - a < 3 or np.isnan(x[a]) or np.isnan(y[a]):
+                continue
+            for first, last, cx, cy, ccw, arc_deviation in fit_arcs(x[a:b+1], y[a:b+1], value):
+                first += a
+                last += a
+                row = point_rows[last]
+                geometry.motion[row] = ARC_CCW if ccw else ARC_CW
+                geometry.x[row] = x[last]
+                geometry.y[row] = y[last]
+                geometry.i[row] = cx - x[first]
+                geometry.j[row] = cy - y[first]
+                g01block.lines[points[last]].flags |= WORD_X | WORD_Y
+                removed.extend(points[first+1:last].tolist())
+                arcs += 1
+                deviation = max(deviation, arc_deviation)
+
+        if len(removed):
+            removed = set(removed)
+            removed_rows.append(rows[sorted(removed)])
+            g01block.lines = [line for i, line in enumerate(g01block.lines) if i not in removed]
+
+    if len(removed_rows):
+        geometry.removeRows(np.concatenate(removed_rows))
+
+        # rearrange original lines
+        block_to_filter.lines = []
+        for g01block in block_to_filter.g01blocks:
+            for line in g01block.lines:
+                block_to_filter.lines.append(line)
+        block_to_filter.refreshStats()
+
+    lines = len(block_to_filter.lines)
+    print("arc_fit_filter: {} arcs, lines from {} to {}, reduction ratio {:.2f}, max deviation {:.4f}".format(
+        arcs, total_lines, lines, total_lines / lines if lines else 1, deviation))
+
+
+def uncovered(segment, others, tolerance):
+    """
+    parts of a segment not overlapped by other segments lying on it
+    :param segment: (x0, y0, x1, y1)
+    :param others: list of (x0, y0, x1, y1)
+    :param tolerance: max distance of the ends of other segments from the segment line
+    :return: list of (t0, t1), distances from the segment start, parts and gaps shorter than tolerance are ignored
+    """
+    x0, y0, x1, y1 = segment
+    length = math.hypot(x1 - x0, y1 - y0)
+    ux = (x1 - x0) / length
+    uy = (y1 - y0) / length
+    covered = []
+    for ax, ay, bx, by in others:
+        if abs(ux*(ay - y0) - uy*(ax - x0)) > tolerance or abs(ux*(by - y0) - uy*(bx - x0)) > tolerance:
+            continue
+        ta = ux*(ax - x0) + uy*(ay - y0)
+        tb = ux*(bx - x0) + uy*(by - y0)
+        lo = max(min(ta, tb), 0.0)
+        hi = min(max(ta, tb), length)
+        if hi - lo > tolerance:
+            covered.append((lo, hi))
+    covered.sort()
+    pieces = []
+    t = 0.0
+    for lo, hi in covered:
+        if lo - t > tolerance:
+            pieces.append((t, lo))
+        t = max(t, hi)
+    if length - t > tolerance:
+        pieces.append((t, length))
+    return pieces
+
+
+def dedupe_filter(par):
+    """
+    remove G01 moves cutting again where another G01 move already cut, e.g. edges shared by nested or tiled parts:
+    cut segments are hashed by the line they lie on, a segment lying within tolerance on segments cut
+    before it, in either direction, becomes a G00 move; a partly overlapped one is cut only where it is not.
+    Blocks are split where G00 moves are left, as if read from file, so that they stay valid
+    :param par: tolerance
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    try:
+        tolerance = float(par)
+    except ValueError:
+        tolerance = eval(par)
+
+    print("dedupe_filter: {}".format(tolerance))
+    if tolerance <= 0:
+        print("dedupe_filter: tolerance must be positive")
+        return
+
+    if block_to_filter.streaming:
+        print("dedupe_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
+    geometry = block_to_filter.geometry
+    xs = geometry.x.tolist()
+    ys = geometry.y.tolist()
+    zs = geometry.z.tolist()
+    motions = geometry.motion.tolist()
+
+    # cut segments in line order: (line, (x0, y0, x1, y1), z), only fast parsed G01 moves can change
+    segments = []
+    px = py = pz = math.nan
+    for line in block_to_filter.lines:
+        i = line.index
+        motion = motions[i]
+        if motion not in (RAPID, LINEAR) and motion not in ARCS:
+            continue
+        x = px if math.isnan(xs[i]) else xs[i]
+        y = py if math.isnan(ys[i]) else ys[i]
+        z = pz if math.isnan(zs[i]) else zs[i]
+        if motion == LINEAR and not line.flags & WORD_Z and not (math.isnan(px) or math.isnan(py) or math.isnan(x) or
+                                                                   math.isnan(y)) and (x, y) != (px, py):
+            segments.append((line, (px, py, x, y), None if math.isnan(z) else z))
+        px, py, pz = x, y, z
+    if len(segments) == 0:
+        print("dedupe_filter: no G01 move")
+        return
+
+    lengths = [math.hypot(b[2] - b[0], b[3] - b[1]) for _line, b, _z in segments]
+    cell_size = max(4.0 * tolerance, sorted(lengths)[len(lengths) // 2])
+    grids = {}
+    # quantized ends of segments cut whole, in either direction
+    cut = set()
+    # pieces left of changed lines
+    changed = {}
+    removed = 0
+    eliminated = 0.0
+    for k, (line, segment, z) in enumerate(segments):
+        grid = grids.setdefault(z, LineGrid(tolerance, cell_size))
+        whole = [(0.0, lengths[k])]
+        ends = sorted(((round(segment[0] / tolerance), round(segment[1] / tolerance)),
+                       (round(segment[2] / tolerance), round(segment[3] / tolerance))))
+        key = (z, ends[0], ends[1])
+        pieces = whole
+        if line.line is None and lengths[k] > tolerance:
+            if key in cut:
+                pieces = []
+            else:
+                others = [segments[j][1] for j in grid.near(*segment)]
+                if len(others):
+                    pieces = uncovered(segment, others, tolerance)
+        if pieces != whole:
+            changed[id(line)] = (segment, lengths[k], pieces)
+            removed += len(pieces) == 0
+            eliminated += lengths[k] - sum(t1 - t0 for t0, t1 in pieces)
+        else:
+            cut.add(key)
+        if len(pieces):
+            grid.add(k, *segment)
+
+    if len(changed) == 0:
+        print("dedupe_filter: no duplicate, cut length {:.3f}".format(sum(lengths)))
+        return
+
+    # G01Blocks, or (G01Block, its lines and new rows) of the changed ones
+    g01blocks = []
+    for g01block in block_to_filter.g01blocks:
+        if not any(id(line) in changed for line in g01block.lines):
+            g01blocks.append(g01block)
+            continue
+
+        # (line, motion): original lines, possibly turned into G00, or new rows
+        items = []
+        for line in g01block.lines:
+            if id(line) not in changed:
+                items.append((line, motions[line.index]))
+                continue
+            (x0, y0, x1, y1), length, pieces = changed[id(line)]
+            words = line.flags & (WORD_F | WORD_S | S_FIRST)
+            for t0, t1 in pieces:
+                if t0 > 0:
+                    items.append(((RAPID, x0 + (x1 - x0)*t0/length, y0 + (y1 - y0)*t0/length, math.nan, math.nan,
+                                   math.nan, WORD_X | WORD_Y), RAPID))
+                if t1 < length:
+                    items.append(((LINEAR, x0 + (x1 - x0)*t1/length, y0 + (y1 - y0)*t1/length, math.nan,
+                                   geometry.f[line.index], geometry.s[line.index], WORD_X | WORD_Y | words), LINEAR))
+                else:
+                    items.append((line, LINEAR))
+            if len(pieces) == 0 or pieces[-1][1] < length:
+                items.append((line, RAPID))
+
+        # a G00 move followed by another one, or by no cut, is useless
+        useless = set()
+        following = None
+        for k in range(len(items) - 1, -1, -1):
+            motion = items[k][1]
+            if motion == RAPID and following in (RAPID, None):
+                useless.add(k)
+            elif motion != NO_MOTION:
+                following = motion
+
+        # useless lines are dropped, their F and S words go to the next cut
+        kept = []
+        dropped = []
+        words = 0
+        feed = speed = math.nan
+        for k, (item, motion) in enumerate(items):
+            if k in useless:
+                if isinstance(item, tuple):
+                    continue
+                if item.line is not None:
+                    item.removeMotion()
+                    kept.append((item, NO_MOTION))
+                    continue
+                words |= item.flags & (WORD_F | WORD_S | S_FIRST)
+                feed = geometry.f[item.index] if item.flags & WORD_F else feed
+                speed = geometry.s[item.index] if item.flags & WORD_S else speed
+                last = item
+                dropped.append(item.index)
+                continue
+            if isinstance(item, tuple):
+                if words and motion == LINEAR:
+                    item = item[:4] + (item[4] if item[6] & WORD_F else feed,
+                                       item[5] if item[6] & WORD_S else speed,
+                                       item[6] | words)
+                    words = 0
+            elif motion == RAPID:
+                geometry.motion[item.index] = RAPID
+            elif words and motion == LINEAR and item.line is None:
+                if not item.flags & WORD_F:
+                    geometry.f[item.index] = feed
+                if not item.flags & WORD_S:
+                    geometry.s[item.index] = speed
+                item.flags |= words
+                words = 0
+            kept.append((item, motion))
+        if words:
+            # no cut left in the block: keep the words, alone
+            dropped.remove(last.index)
+            last.removeMotion()
+            kept.append((last, NO_MOTION))
+        geometry.removeRows(np.array(dropped, dtype=np.int64))
+        g01blocks.append((g01block, [item for item, _motion in kept]))
+
+    # new rows of all the blocks are added at once, extending the columns once
+    added = iter(block_to_filter.addLines([item for entry in g01blocks if isinstance(entry, tuple)
+                                           for item in entry[1] if isinstance(item, tuple)]))
+    block_to_filter.g01blocks = []
+    for entry in g01blocks:
+        if not isinstance(entry, tuple):
+            block_to_filter.g01blocks.append(entry)
+            continue
+        g01block, kept = entry
+        g01block.lines = [next(added) if isinstance(item, tuple) else item for item in kept]
+        block_to_filter.g01blocks += g01block.split()
+
+    # rearrange original lines
+    block_to_filter.lines = []
+    for g01block in block_to_filter.g01blocks:
+        for line in g01block.lines:
+            block_to_filter.lines.append(line)
+    block_to_filter.refreshStats()
+
+    total = sum(lengths)
+    print("dedupe_filter: {} moves removed, {} shortened, cut length from {:.3f} to {:.3f}, {:.3f} ({:.1f}%) "
+          "eliminated".format(removed, len(changed) - removed, total, total - eliminated, eliminated,
+                              100.0 * eliminated / total))
+
+
+def changes(values):
+    """
+    :param values: numpy array of modal words, NaN if missing
+    :return: mask of values defined and different from the previous defined one
+    """
+    previous = np.empty_like(values)
+    previous[:1] = np.nan
+    previous[1:] = fill_forward(values)[:-1]
+    return ~np.isnan(values) & (values != previous)
+
+
 def starty_filter(par):
     """
     modify gcodes in order to start at x=par
@@ -227,16 +781,11 @@ def starty_filter(par):
 
     print("starty_filter: {}".format(value))
 
-    if block_to_filter.xmin == value:
+    ymin = block_to_filter.ymin
+    if ymin == value:
         print("starty_filter: already start at {}".format(value))
 
-    for line in block_to_filter.lines:
-        for gcode in line.block.gcodes:
-            try:
-                if gcode.Y is not None:
-                    gcode.Y = gcode.Y - block_to_filter.ymin + value
-            except AttributeError:
-                pass
+    block_to_filter.transformBy(translation(0.0, value - ymin))
 
 
 def resize_filter(par):
@@ -262,8 +811,10 @@ def resize_filter(par):
     print("resize_filter: {}x{}".format(xb, yb))
 
     # determine xscale and yscale
-    xsize = block_to_filter.xmax-block_to_filter.xmin
-    ysize = block_to_filter.ymax-block_to_filter.ymin
+    xmin = block_to_filter.xmin
+    ymin = block_to_filter.ymin
+    xsize = block_to_filter.xmax-xmin
+    ysize = block_to_filter.ymax-ymin
     # print("block_to_filter {}".format(block_to_filter))
 
     factor = 1
@@ -279,17 +830,57 @@ def resize_filter(par):
         factor = xf if xf < yf else yf
 
     print("resize_filter: factor {}".format(factor))
-    for line in block_to_filter.lines:
-        for gcode in line.block.gcodes:
-            try:
-                if gcode.X is not None:
-                    gcode.X = gcode.X - block_to_filter.xmin
-                    gcode.X *= factor
-                if gcode.Y is not None:
-                    gcode.Y = gcode.Y - block_to_filter.ymin
-                    gcode.Y *= factor
-            except AttributeError:
-                pass
+
+    block_to_filter.transformBy(scaling(factor, factor) @ translation(-xmin, -ymin))
+
+
+def rotate_filter(par):
+    """
+    rotate gcode counterclockwise around the center of its bounding box
+    :param par: degrees
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    try:
+        value = float(par)
+    except ValueError:
+        value = eval(par)
+
+    print("rotate_filter: {}".format(value))
+
+    matrix = rotation(value, (block_to_filter.xmin + block_to_filter.xmax) / 2.0,
+                      (block_to_filter.ymin + block_to_filter.ymax) / 2.0)
+    if block_to_filter.streaming and not axis_aligned(matrix):
+        print("rotate_filter: only multiples of 180 degrees are available in stream mode")
+        return
+    block_to_filter.transformBy(matrix)
+
+
+def mirror_filter(par):
+    """
+    mirror gcode inside its bounding box, G02 and G03 are swapped
+    :param par: x flips X, y flips Y, xy both
+    :return:
+    """
+    if len(gCodeBlocks) == 0:
+        print("no gcode loaded: cannot apply filter")
+        return
+    block_to_filter = gCodeBlocks[-1]
+
+    par = par.lower()
+    if par not in ("x", "y", "xy"):
+        print("bad mirror filter format: valid is x, y or xy")
+        return
+
+    print("mirror_filter: {}".format(par))
+
+    block_to_filter.transformBy(scaling(-1.0 if 'x' in par else 1.0, -1.0 if 'y' in par else 1.0,
+                                        (block_to_filter.xmin + block_to_filter.xmax) / 2.0,
+                                        (block_to_filter.ymin + block_to_filter.ymax) / 2.0))
 
 
 def inside_first_filter():
@@ -303,30 +894,258 @@ def inside_first_filter():
         return
     block_to_filter = gCodeBlocks[-1]
 
+    if block_to_filter.outofcore:
+        ids = block_to_filter.movable()
+        ordered, depth = inside_first_order(block_to_filter.boxes(ids))
+        block_to_filter.reorder(ids[ordered])
+        block_to_filter.inside_first = True
+        print("inside_first_filter: {} blocks, nesting depth {}".format(len(ids), depth))
+        return
+    if block_to_filter.streaming:
+        print("inside_first_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
     g01blocks = block_to_filter.g01blocks
-    ng01 = len(g01blocks)
 
-    while True:
-        swp = False
-        for i in range(ng01-1):
-            for j in range(i+1, ng01):
-                if g01blocks[i].contains(g01blocks[j]):
-                    g01blocks[i], g01blocks[j] = g01blocks[j], g01blocks[i]
-                    swp = True
+    movable = [g01block.isvalid() for g01block in g01blocks]
+    to_order = [g01block for g01block, m in zip(g01blocks, movable) if m]
+
+    ordered, depth = inside_first_order([(b.xmin, b.ymin, b.xmax, b.ymax) for b in to_order])
+
+    it = iter(ordered)
+    block_to_filter.g01blocks = [to_order[next(it)] if m else g01block for g01block, m in zip(g01blocks, movable)]
+
+    block_to_filter.inside_first = True
+    print("inside_first_filter: {} blocks, nesting depth {}".format(len(to_order), depth))
+
+    # rearrange original lines
+    block_to_filter.lines = []
+    for g01block in block_to_filter.g01blocks:
+        for line in g01block.lines:
+            block_to_filter.lines.append(line)
+
+
+def inside_first_order(boxes):
+    """
+    depth first in original order, emit a box after all the boxes it contains
+    :param boxes: list of (xmin, ymin, xmax, ymax)
+    :return: (list of box ids, nesting depth)
+    """
+    contained = containment_lists(boxes)
+    ordered = []
+    level = [None] * len(boxes)
+    for root in range(len(boxes)):
+        if level[root] is not None:
+            continue
+        stack = [(root, 0)]
+        while stack:
+            i, next_child = stack.pop()
+            if next_child < len(contained[i]):
+                stack.append((i, next_child + 1))
+                child = contained[i][next_child]
+                if level[child] is None:
+                    stack.append((child, 0))
+            else:
+                level[i] = 1 + max((level[c] for c in contained[i]), default=0)
+                ordered.append(i)
+    return ordered, max(level, default=0)
+
+
+def rapid_distance(g01blocks):
+    """
+    total rapid travel between consecutive valid blocks
+    :param g01blocks:
+    :return: distance
+    """
+    distance = 0
+    last = None
+    for g01block in g01blocks:
+        if not g01block.isvalid() or g01block.startx is None:
+            continue
+        if last is not None:
+            distance += last.distanceToStart(g01block)
+        last = g01block
+    return distance
+
+
+def nearest_tour(to_order, containers=None, entry=False):
+    """
+    nearest neighbour tour of blocks: from the first block, always move to the nearest unvisited block start
+    :param to_order: valid G01Blocks having a start point
+    :param containers: optional, list of the blocks containing every block, by index in to_order:
+     a block is visited after all the blocks it contains, the tour starts from the first free block
+    :param entry: blocks may also start from any vertex of closed paths, or from the end of open paths:
+     all the entry vertices are indexed together, the nearest one is chosen
+    :return: (list of G01Blocks, number of blocks entered from another vertex)
+    """
+    # entry points of every block, block i owns points first[i] to first[i + 1]
+    paths = [g01block.path() if entry else None for g01block in to_order]
+    points = []
+    owner = []
+    vertices = []
+    first = []
+    for i, (g01block, path) in enumerate(zip(to_order, paths)):
+        first.append(len(points))
+        for vertex, x, y in g01block.entries(path):
+            points.append((x, y))
+            owner.append(i)
+            vertices.append(vertex)
+    first.append(len(points))
+
+    def leave(point):
+        current = owner[point]
+        if vertices[point]:
+            to_order[current].enterAt(paths[current], vertices[point])
+        return to_order[current].endPoint()
+
+    chosen = nearest_points(points, first, containers, leave)
+    return [to_order[owner[point]] for point in chosen], sum(1 for point in chosen if vertices[point])
+
+
+def nearest_points(points, first, containers=None, leave=None):
+    """
+    nearest neighbour tour of items having one or more entry points: from the first free item, always move
+    to the nearest entry point of an unvisited item
+    :param points: list of (x, y), item i owns points first[i] to first[i + 1]
+    :param first: list of the first point of every item, then the number of points
+    :param containers: optional, list of the items containing every item: an item is visited after
+     all the items it contains
+    :param leave: function of the entry point of a visited item, returning where the head is after it,
+     default the entry point itself
+    :return: list of entry points, one per item, in tour order
+    """
+    owner = [None] * len(points)
+    for i in range(len(first) - 1):
+        owner[first[i]:first[i + 1]] = [i] * (first[i + 1] - first[i])
+    waiting = [0] * (len(first) - 1)
+    if containers is not None:
+        for outer in containers:
+            for j in outer:
+                waiting[j] += 1
+
+    grid = PointGrid(points)
+    for i, count in enumerate(waiting):
+        if count:
+            for point in range(first[i], first[i + 1]):
+                grid.remove(point)
+    point = first[waiting.index(0)]
+    chosen = []
+    while point is not None:
+        current = owner[point]
+        for other in range(first[current], first[current + 1]):
+            grid.remove(other)
+        chosen.append(point)
+        if containers is not None:
+            for j in containers[current]:
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    for other in range(first[j], first[j + 1]):
+                        grid.add(other)
+        x, y = points[point] if leave is None else leave(point)
+        point = grid.nearest(x, y)
+    return chosen
+
+
+def inside_first_containers(boxes, offset=0):
+    """
+    :param boxes: list of (xmin, ymin, xmax, ymax) of the valid G01Blocks of a file ordered by inside first
+    :param offset: index of the first of them in the blocks to order
+    :return: list of the blocks containing every block, as indices in the blocks to order
+    """
+    outer = [[] for _box in boxes]
+    for j, inner in enumerate(containment_lists(boxes)):
+        for i in inner:
+            outer[i].append(offset + j)
+    return outer
+
+
+def improve_tour(to_order, ordered, containers, budget):
+    """
+    shorten a tour of blocks by 2-opt and Or-opt moves, see tour.Tour, until the time budget is spent
+    :param to_order: G01Blocks, as given to nearest_tour
+    :param ordered: the same G01Blocks, in tour order
+    :param containers: None, or list of the blocks containing every block, by index in to_order
+    :param budget: seconds
+    :return: (list of G01Blocks, moves applied, kicks, kicks kept)
+    """
+    index = {id(g01block): i for i, g01block in enumerate(to_order)}
+    tour = Tour([(g01block.startx, g01block.starty) for g01block in to_order],
+                [g01block.endPoint() for g01block in to_order],
+                [index[id(g01block)] for g01block in ordered], containers)
+    moves, kicks, kept = tour.improve(budget)
+    return [to_order[i] for i in tour.t], moves, kicks, kept
+
 
-        if not swp:
-            break
+def merge_filter(entry=False, budget=None):
+    """
+    merge all loaded files into the first one, and order their G01Blocks in a single tour, as optimize path
+    does on one file: the head goes to the nearest path of any file, instead of finishing files in order.
+    Files ordered by inside first keep containment: a block is cut after the blocks of its file it contains
+    :param entry: paths may start from another vertex, see nearest_tour
+    :param budget: seconds spent improving the tour, None not to improve it
+    :return:
+    """
+    print("merge_filter")
+    if len(gCodeBlocks) < 2:
+        print("merge_filter: at least two files must be loaded")
+        return
+    if any(block.streaming for block in gCodeBlocks):
+        print("merge_filter: not available in stream and out of core modes")
+        return
+
+    to_order = []
+    containers = []
+    for block in gCodeBlocks:
+        block.applyTransform()
+        part = [g01block for g01block in block.g01blocks if g01block.isvalid() and g01block.startx is not None]
+        if block.inside_first:
+            containers += inside_first_containers([(b.xmin, b.ymin, b.xmax, b.ymax) for b in part], len(to_order))
+        else:
+            containers += [[] for _g01block in part]
+        to_order += part
+
+    before = rapid_distance(to_order)
+    files = len(gCodeBlocks)
+    inside_first = all(block.inside_first for block in gCodeBlocks)
+    block_to_filter = gCodeBlocks[0]
+    block_to_filter.merge(gCodeBlocks[1:])
+    del gCodeBlocks[1:]
+    block_to_filter.inside_first = inside_first
+
+    entered = 0
+    if len(to_order) > 1:
+        ordered, entered = nearest_tour(to_order, containers, entry)
+        if budget is not None:
+            greedy = rapid_distance(ordered)
+            ordered, moves, kicks, kept = improve_tour(to_order, ordered, containers, budget)
+            print("merge_filter: {} moves, {} of {} kicks kept in {}s, rapid travel of the nearest path tour "
+                  "from {:.3f} to {:.3f}".format(moves, kept, kicks, budget, greedy, rapid_distance(ordered)))
+        it = iter(ordered)
+        block_to_filter.g01blocks = [next(it) if g01block.isvalid() and g01block.startx is not None else g01block
+                                     for g01block in block_to_filter.g01blocks]
+
+    after = rapid_distance(block_to_filter.g01blocks)
+    print("merge_filter: {} files, {} paths, {} entered from another vertex, rapid travel from {:.3f} to {:.3f}, "
+          "{:.1f}% less".format(files, len(to_order), entered, before, after,
+                                100.0 * (before - after) / before if before else 0.0))
 
     # rearrange original lines
     block_to_filter.lines = []
     for g01block in block_to_filter.g01blocks:
         for line in g01block.lines:
             block_to_filter.lines.append(line)
+    print(block_to_filter)
 
 
-def optimize_path_filter():
+def optimize_path_filter(entry=False, budget=None):
     """
-    organize gcode groups trying to minimize path
+    organize gcode groups trying to minimize path:
+    starting from the first valid block, always move to the nearest unvisited block start,
+    invalid blocks keep their position. After inside first, a block is still cut after the blocks it contains
+    :param entry: closed paths may start from any vertex, open paths may be reversed
+    :param budget: seconds spent improving the tour by 2-opt and Or-opt moves, None not to improve it
     :return:
     """
     print("optimize_path_filter...")
@@ -335,26 +1154,79 @@ def optimize_path_filter():
         return
     block_to_filter = gCodeBlocks[-1]
 
+    if block_to_filter.outofcore:
+        optimize_summary(block_to_filter, entry, budget)
+        return
+    if block_to_filter.streaming:
+        print("optimize_path_filter: not available in stream mode")
+        return
+    # coordinates are read
+    block_to_filter.applyTransform()
+
     g01blocks = block_to_filter.g01blocks
-    ng01 = len(g01blocks)
 
     print(block_to_filter)
 
-    for ri in range(ng01-1):
-        if ri % 10 == 0:
-            print(ri, end='\r')
-        next_block_index = ri + 1
-        idx_shortest = g01blocks[ri].shortestPathToStart2(g01blocks, next_block_index)
-        if idx_shortest is not None:
-            if idx_shortest != next_block_index:
-                g01blocks[next_block_index], g01blocks[idx_shortest] = \
-                    g01blocks[idx_shortest], g01blocks[next_block_index]
-
-    print()
+    movable = [g01block.isvalid() and g01block.startx is not None for g01block in g01blocks]
+    to_order = [g01block for g01block, m in zip(g01blocks, movable) if m]
+
+    before = rapid_distance(to_order)
+
+    containers = None
+    if block_to_filter.inside_first:
+        containers = inside_first_containers([(b.xmin, b.ymin, b.xmax, b.ymax) for b in to_order])
+
+    entered = 0
+    if len(to_order) > 1:
+        ordered, entered = nearest_tour(to_order, containers, entry)
+        if budget is not None:
+            greedy = rapid_distance(ordered)
+            ordered, moves, kicks, kept = improve_tour(to_order, ordered, containers, budget)
+            print("optimize_path_filter: {} moves, {} of {} kicks kept in {}s, rapid travel of the nearest path "
+                  "tour from {:.3f} to {:.3f}".format(moves, kept, kicks, budget, greedy, rapid_distance(ordered)))
+        it = iter(ordered)
+        block_to_filter.g01blocks = [next(it) if m else g01block for g01block, m in zip(g01blocks, movable)]
+
+    if entry:
+        print("optimize_path_filter: {} paths entered from another vertex".format(entered))
+    print("optimize_path_filter: rapid travel from {:.3f} to {:.3f}".format(before, rapid_distance(block_to_filter.g01blocks)))
+
     # rearrange original lines
     block_to_filter.lines = []
     for g01block in block_to_filter.g01blocks:
         for line in g01block.lines:
             block_to_filter.lines.append(line)
 
-    print("optimize_path_filter done.")
\ No newline at end of file
+    print("optimize_path_filter done.")
+
+
+def optimize_summary(block_to_filter, entry=False, budget=None):
+    """
+    optimize path of an out of core file, on the start and end points of its G01Blocks
+    :param block_to_filter: GCodeSpill
+    :param entry: not available, paths are not in memory
+    :param budget: seconds spent improving the tour, None not to improve it
+    :return:
+    """
+    if entry:
+        print("optimize_path_filter: path entry not available out of core, paths keep their start")
+    ids = block_to_filter.movable(start=True)
+    starts, ends = block_to_filter.points(ids)
+    containers = inside_first_containers(block_to_filter.boxes(ids)) if block_to_filter.inside_first else None
+
+    def travel(order):
+        return sum(math.hypot(ends[a][0] - starts[b][0], ends[a][1] - starts[b][1]) for a, b in zip(order, order[1:]))
+
+    before = travel(range(len(ids)))
+    if len(ids) > 1:
+        order = nearest_points(starts, list(range(len(ids) + 1)), containers, lambda i: ends[i])
+        if budget is not None:
+            tour = Tour(starts, ends, order, containers)
+            greedy = tour.cost()
+            moves, kicks, kept = tour.improve(budget)
+            print("optimize_path_filter: {} moves, {} of {} kicks kept in {}s, rapid travel of the nearest path "
+                  "tour from {:.3f} to {:.3f}".format(moves, kept, kicks, budget, greedy, tour.cost()))
+            order = tour.t
+        block_to_filter.reorder(ids[order], start=True)
+        print("optimize_path_filter: rapid travel from {:.3f} to {:.3f}".format(before, travel(order)))
+    print("optimize_path_filter done.")
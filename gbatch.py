@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import argparse
+import collections
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gdoctor
+
+
+def read_manifest(filename):
+    """
+    :param filename: text file, one gcode file per line, # starts a comment
+    :return: list of file names, relative to the manifest directory
+    """
+    base = os.path.dirname(filename)
+    files = []
+    with open(filename, 'r') as fh:
+        for line in fh:
+            line = line.split('#', 1)[0].strip()
+            if len(line):
+                files.append(os.path.join(base, line))
+    return files
+
+
+def process_file(argv):
+    """
+    run a gdoctor command line, in a worker process
+    :param argv: gdoctor arguments
+    :return: (ok, seconds, output of gdoctor, or error)
+    """
+    start = time.perf_counter()
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            gdoctor.run(argv)
+        return True, time.perf_counter() - start, out.getvalue()
+    except (Exception, SystemExit) as e:
+        return False, time.perf_counter() - start, out.getvalue() + "".join(traceback.format_exception_only(type(e), e))
+
+
+def output_files(inputs, output_dir):
+    """
+    output file of every input file, at its path relative to the deepest directory containing all the inputs,
+    so that inputs of the same name in different directories are not written to the same file
+    :param inputs: gcode file names
+    :param output_dir:
+    :return: list of file names
+    """
+    if len(inputs) == 0:
+        return []
+    paths = [os.path.abspath(filename) for filename in inputs]
+    base = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [os.path.join(output_dir, os.path.relpath(path, base)) for path in paths]
+
+
+def batch(inputs, output_dir, chain, workers=None, stream=False, parser="fast", verbose=False):
+    """
+    apply the same filter chain to many files, in parallel
+    :param inputs: gcode file names
+    :param output_dir: where filtered files are written, with the same path relative to the inputs directory
+    :param chain: gdoctor filter arguments, e.g. ["--filter-resize=100x"]
+    :param workers: worker processes, default the number of cpu
+    :param stream: --stream gdoctor option
+    :param parser: --parser gdoctor option
+    :param verbose: print gdoctor output of every file
+    :return: number of failed files
+    """
+    outputs = output_files(inputs, output_dir)
+    # e.g. a file listed twice by a manifest
+    twice = [output for output, count in collections.Counter(outputs).items() if count > 1]
+    if len(twice):
+        print("{}: written by more than one input file, no file processed".format(", ".join(sorted(twice))))
+        return len(inputs)
+    for directory in set(os.path.dirname(output) for output in outputs) | {output_dir}:
+        os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = {}
+        for filename, output in zip(inputs, outputs):
+            argv = ["--parser={}".format(parser)]
+            if stream:
+                argv.append("--stream")
+            argv += ["--readgcode={}".format(filename)] + chain
+            argv.append("--writegcode={}".format(output))
+            jobs[executor.submit(process_file, argv)] = filename
+
+        for job in as_completed(jobs):
+            filename = jobs[job]
+            ok, seconds, output = job.result()
+            print("{} {:8.3f}s {}".format("ok  " if ok else "FAIL", seconds, filename))
+            if not ok:
+                failed += 1
+            if verbose or not ok:
+                print(output)
+
+    print("{} files, {} failed, {:.3f}s".format(len(inputs), failed, time.perf_counter() - start))
+    return failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='gcode doctor, batch mode: filter options not listed here '
+                                                 'are gdoctor.py options, applied to every file',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     allow_abbrev=False)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", action="append", help="glob of gcode files, can be repeated")
+    source.add_argument("--manifest", help="text file listing gcode files, one per line")
+    parser.add_argument("--output-dir", required=True,
+                        help="directory of filtered files, at their path relative to the directory of all the inputs")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default the number of cpu")
+    parser.add_argument("--stream", action="store_true", help="gdoctor --stream")
+    parser.add_argument("--parser", choices=gdoctor.PARSERS, default="fast", help="gdoctor --parser")
+    parser.add_argument("--verbose", action="store_true", help="print gdoctor output of every file")
+
+    args, chain = parser.parse_known_args()
+
+    if args.manifest is not None:
+        inputs = read_manifest(args.manifest)
+    else:
+        inputs = sorted(set(name for pattern in args.input for name in glob.glob(pattern)))
+
+    for option in chain:
+        if option.startswith("--readgcode") or option.startswith("--writegcode"):
+            parser.error("{}: files are given by --input or --manifest and --output-dir".format(option))
+
+    sys.exit(1 if batch(inputs, args.output_dir, chain, args.workers, args.stream, args.parser, args.verbose) else 0)
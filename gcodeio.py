@@ -0,0 +1,167 @@
+import gzip
+import lzma
+import mmap
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODING = "utf-8"
+
+
+def open_zstd(filename, mode):
+    if zstandard is None:
+        raise RuntimeError("{}: zstd files need the zstandard package, pip3 install zstandard".format(filename))
+    return zstandard.open(filename, mode, encoding=ENCODING)
+
+
+# compressed file extensions, and how to open them in text mode
+COMPRESSED = {
+    ".gz": lambda filename, mode: gzip.open(filename, mode, encoding=ENCODING),
+    ".xz": lambda filename, mode: lzma.open(filename, mode, encoding=ENCODING),
+    ".zst": open_zstd,
+}
+
+
+def compression(filename):
+    """
+    :param filename:
+    :return: extension of a compressed file, None for plain files
+    """
+    for extension in COMPRESSED:
+        if filename.endswith(extension):
+            return extension
+    return None
+
+
+def open_gcode(filename, mode="r"):
+    """
+    open a gcode file in text mode, compressed files by their extension
+    :param filename:
+    :param mode: "r" or "w"
+    :return: file object
+    """
+    extension = compression(filename)
+    if extension is None:
+        return open(filename, mode, encoding=ENCODING)
+    return COMPRESSED[extension](filename, mode + "t")
+
+
+def read_lines(filename):
+    """
+    lines of a gcode file, as in text mode: plain files are memory mapped and split by
+    mmap.readline, without holding the whole file as a list of strings
+    :param filename:
+    :return: generator of lines, with their new line
+    """
+    if compression(filename) is None:
+        with open(filename, 'rb') as fh:
+            try:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                mm = None
+            # \r needs the universal newlines of text mode
+            if mm is not None and mm.find(b"\r") == -1:
+                with mm:
+                    for line in iter(mm.readline, b""):
+                        yield line.decode(ENCODING)
+                return
+            if mm is not None:
+                mm.close()
+
+    with open_gcode(filename) as fh:
+        yield from fh
+
+
+def line_ranges(filename, parts):
+    """
+    split a plain file at line boundaries into about equal byte ranges, that lines_at reads as read_lines would
+    :param filename:
+    :param parts: number of ranges
+    :return: list of (offset, length), empty for an empty file, None for compressed files and files with \r
+    """
+    if compression(filename) is not None:
+        return None
+    with open(filename, 'rb') as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return []
+        with mm:
+            if mm.find(b"\r") != -1:
+                return None
+            size = len(mm)
+            ends = []
+            for k in range(1, parts):
+                end = mm.find(b"\n", max(size * k // parts, ends[-1] if ends else 0))
+                if end == -1:
+                    break
+                ends.append(end + 1)
+    offsets = sorted(set([0] + ends + [size]))
+    return [(offset, end - offset) for offset, end in zip(offsets[:-1], offsets[1:])]
+
+
+def located_lines(filename, spill):
+    """
+    lines of a gcode file with their byte offset, so that they can be read again by offset:
+    offsets are in the file itself when it is a plain file without \r, otherwise lines are copied
+    to spill, and offsets are in spill
+    :param filename:
+    :param spill: binary file, written only if needed
+    :return: (True if offsets are in spill, generator of (offset, line))
+    """
+    if compression(filename) is None:
+        with open(filename, 'rb') as fh:
+            try:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    plain = mm.find(b"\r") == -1
+            except ValueError:
+                # empty file
+                plain = True
+        if plain:
+            return False, _mapped_lines(filename)
+    return True, _spilled_lines(filename, spill)
+
+
+def _mapped_lines(filename):
+    with open(filename, 'rb') as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return
+        with mm:
+            offset = 0
+            for line in iter(mm.readline, b""):
+                yield offset, line.decode(ENCODING)
+                offset += len(line)
+
+
+def _spilled_lines(filename, spill):
+    offset = 0
+    with open_gcode(filename) as fh:
+        for line in fh:
+            data = line.encode(ENCODING)
+            spill.write(data)
+            yield offset, line
+            offset += len(data)
+    spill.flush()
+
+
+def lines_at(mm, offset, length):
+    """
+    lines of a byte range, as read_lines gives them
+    :param mm: mmap, or bytes
+    :param offset:
+    :param length:
+    :return: list of lines, with their new line
+    """
+    data = mm[offset:offset + length].decode(ENCODING)
+    lines = data.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
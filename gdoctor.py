@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import argparse
 import math
+import mmap
+import os
 import sys
+import tempfile
+import numpy as np
 import pygcode
 
 from filters import feed_rate_multiply_filter, mindistance_filter, optimize_path_filter
+from filters import simplify_filter
+from filters import arc_fit_filter
 from filters import feed_rate_max_filter
 from filters import spindle_speed_multiply_filter
 from filters import spindle_speed_max_filter
@@ -12,27 +18,143 @@ from filters import startx_filter
 from filters import starty_filter
 from filters import inside_first_filter
 from filters import resize_filter
+from filters import rotate_filter
+from filters import mirror_filter
+from filters import merge_filter
+from filters import dedupe_filter
+from filters import merge_collinear_filter
 
+from cache import ParseCache
 from commons import gCodeBlocks
+import instrument
+from instrument import stage
+from serializer import GCodeWriter
+from estimate import estimate_report, RAPID_RATE, ACCELERATION, JUNCTION_DEVIATION
+from fastparse import motion_words, parse_chunks, join_chunks
+from gcodeio import open_gcode, read_lines, located_lines, lines_at, ENCODING
+from geometry import Geometry, gcode_values, positional, MOTION_CODES, WORD_FLAGS, NO_MOTION, WORD_X, WORD_Y, WORD_F
+from geometry import WORD_S, WORD_Z, NAN, RAPID, LINEAR, IDENTITY, axis_aligned, transform_points, transform_range
+from geometry import block_bounds, ARCS
+from geometry import fill_forward
 
+PARSERS = ("fast", "pygcode")
 
-class GCodeLine(pygcode.Line):
-    def __init__(self, s):
+# smaller files are parsed faster than worker processes start
+PARALLEL_SIZE = 1024*1024
+
+
+class GCodeLine:
+    """
+    compact gcode line: numeric words live in a Geometry, at row index, flags tell which words
+    are present; lines that are not plain G0/G1 lines also keep their pygcode Line
+    """
+    __slots__ = ("geometry", "index", "flags", "line", "islast")
+
+    def __init__(self, s, geometry, parser="fast"):
+        """
+        parse a line, appending its numeric words to geometry
+        :param s: line text
+        :param geometry: Geometry being read
+        :param parser: "fast" parses plain G0/G1 lines directly, falling back to pygcode for other lines
+        """
         self.islast = None
-        super().__init__(s)
+        self.geometry = geometry
+        words = motion_words(s) if parser == "fast" else None
+        if words is None:
+            self.line = pygcode.Line(s)
+            words = gcode_values(self.line.block.gcodes)
+        else:
+            self.line = None
+        self.flags = words[-1]
+        self.index = geometry.append(*words[:-1])
+
+    @staticmethod
+    def restore(geometry, index, flags, line=None, islast=None):
+        """
+        a line already parsed into geometry, e.g. loaded from the parse cache
+        :param geometry:
+        :param index: row of the line in geometry
+        :param flags: words present in the line
+        :param line: pygcode Line, for lines that are not plain G0/G1 lines
+        :param islast:
+        :return: the new GCodeLine
+        """
+        self = GCodeLine.__new__(GCodeLine)
+        self.geometry = geometry
+        self.index = index
+        self.flags = flags
+        self.line = line
+        self.islast = islast
+        return self
+
+    @property
+    def comment(self):
+        return None if self.line is None else self.line.comment
+
+    def empty(self):
+        """
+        :return: True if the line has no gcode
+        """
+        if self.line is not None:
+            return len(self.line.block.gcodes) == 0
+        return self.geometry.motion[self.index] == NO_MOTION and not self.flags & (WORD_F | WORD_S)
+
+    def word(self, letter):
+        """
+        :param letter: one of X, Y, Z, F, S
+        :return: value of the word, None if missing
+        """
+        value = getattr(self.geometry, letter.lower())[self.index]
+        if value != value:
+            return None
+        return float(value)
 
     def contains(self, class_type):
-        for gcode in self.block.gcodes:
+        motion = MOTION_CODES.get(class_type)
+        if motion is not None:
+            return self.geometry.motion[self.index] == motion
+        flag = WORD_FLAGS.get(class_type)
+        if flag is not None:
+            return bool(self.flags & flag)
+        if self.line is None:
+            return False
+        for gcode in self.line.block.gcodes:
             if type(gcode) == class_type:
                 return True
         return False
 
     def get(self, class_type):
-        for gcode in self.block.gcodes:
+        """
+        pygcode gcode of class_type, with the values of the geometry:
+        filters change the geometry, the returned gcode is only kept for lines holding a pygcode Line
+        :param class_type:
+        :return:
+        """
+        if self.line is None:
+            line = pygcode.Line(str(self))
+        else:
+            self.geometry.updateLines([self])
+            line = self.line
+        for gcode in line.block.gcodes:
             if type(gcode) == class_type:
                 return gcode
         return None
 
+    def removeMotion(self):
+        """
+        remove the positional gcode
+        :return:
+        """
+        if self.line is not None:
+            self.line.block.gcodes = [gcode for gcode in self.line.block.gcodes if not positional(gcode)]
+        self.geometry.removeMotion(self.index)
+
+    def __str__(self):
+        if self.line is None:
+            return self.geometry.format(self.index, self.flags)
+        self.geometry.updateLines([self])
+        return str(self.line)
+
 
 class G01Block:
     """
@@ -42,9 +164,9 @@ class G01Block:
     def __init__(self):
         self.lines = []
         self.xmin = sys.float_info.max
-        self.xmax = sys.float_info.min
+        self.xmax = -sys.float_info.max
         self.ymin = sys.float_info.max
-        self.ymax = sys.float_info.min
+        self.ymax = -sys.float_info.max
         self.startx = None
         self.starty = None
         self.endx = None
@@ -54,37 +176,143 @@ class G01Block:
 
     def appendLine(self, line):
 
-        gcode = None
-
-        if line.contains(pygcode.gcodes.GCodeRapidMove):
-            gcode = line.get(pygcode.gcodes.GCodeRapidMove)
-        if line.contains(pygcode.gcodes.GCodeLinearMove):
-            gcode = line.get(pygcode.gcodes.GCodeLinearMove)
-
-        if gcode is not None:
+        move = line.contains(pygcode.gcodes.GCodeRapidMove) or line.contains(pygcode.gcodes.GCodeLinearMove)
+        if move:
             line.islast = True
             if self.last01line is not None:
                 self.last01line.islast = False
             self.last01line = line
-            if gcode.X is not None:
-                self.xmin = min(gcode.X, self.xmin)
-                self.xmax = max(gcode.X, self.xmax)
-
-            if gcode.Y is not None:
-                self.ymin = min(gcode.Y, self.ymin)
-                self.ymax = max(gcode.Y, self.ymax)
-
-            if (gcode.X is not None) and (gcode.Y is not None):
+        # arc end points count in bounds, e.g. arcs made by arc fit
+        if move or line.contains(pygcode.gcodes.GCodeArcMoveCW) or line.contains(pygcode.gcodes.GCodeArcMoveCCW):
+            x = line.word('X')
+            y = line.word('Y')
+            if x is not None:
+                self.xmin = min(x, self.xmin)
+                self.xmax = max(x, self.xmax)
+
+            if y is not None:
+                self.ymin = min(y, self.ymin)
+                self.ymax = max(y, self.ymax)
+
+            if (x is not None) and (y is not None):
                 if self.first:
-                    self.startx = gcode.X
-                    self.starty = gcode.Y
+                    self.startx = x
+                    self.starty = y
                     self.first = False
                 else:
-                    self.endx = gcode.X
-                    self.endy = gcode.Y
+                    self.endx = x
+                    self.endy = y
 
         self.lines.append(line)
 
+    def transformBy(self, matrix):
+        """
+        move bounds, start and end point along with an axis aligned transform, already applied to the geometry:
+        other transforms need GCodeBlock.updateBounds
+        :param matrix: 3x3 numpy array
+        :return:
+        """
+        xrange = None if self.xmin == sys.float_info.max else (self.xmin, self.xmax)
+        yrange = None if self.ymin == sys.float_info.max else (self.ymin, self.ymax)
+        xrange, yrange = transform_range(matrix, xrange, yrange)
+        if xrange is not None:
+            self.xmin, self.xmax = xrange
+        if yrange is not None:
+            self.ymin, self.ymax = yrange
+        if self.startx is not None:
+            self.startx, self.starty = transform_points(matrix, self.startx, self.starty)
+        if self.endx is not None:
+            self.endx, self.endy = transform_points(matrix, self.endx, self.endy)
+
+    def split(self):
+        """
+        G01Blocks of the lines of this block, segmented as read_from_file does, e.g. after filters turned
+        G01 moves into G00
+        :return: list of G01Block
+        """
+        blocks = []
+        lma = G01Block()
+        for line in self.lines:
+            if not(line.contains(pygcode.gcodes.GCodeLinearMove) or line.empty()):
+                if lma.size() > 0:
+                    blocks.append(lma)
+                    lma = G01Block()
+            lma.appendLine(line)
+        if lma.size() > 0:
+            blocks.append(lma)
+        return blocks
+
+    def path(self):
+        """
+        vertices of a plain path, that can be cut starting from another vertex: a G00 followed by G01 moves
+        in the XY plane, fast parsed, with the same feed rate and spindle speed along all the moves
+        :return: (rows, x, y) numpy arrays of the G00 and G01 lines, None for other blocks
+        """
+        moves = [line for line in self.lines if not line.empty()]
+        if len(moves) < 2 or any(line.line is not None or line.flags & WORD_Z for line in moves):
+            return None
+        geometry = moves[0].geometry
+        rows = np.array([line.index for line in moves], dtype=np.int64)
+        motion = geometry.motion[rows]
+        if motion[0] != RAPID or (motion[1:] != LINEAR).any():
+            return None
+        for column in (geometry.f, geometry.s):
+            values = column[rows]
+            defined = np.flatnonzero(~np.isnan(values))
+            # a value set after the first G01 would not hold for the moves before it, once moved
+            if len(defined) and (defined[0] > 1 or (values[defined] != values[defined[0]]).any()):
+                return None
+        x = fill_forward(geometry.x[rows])
+        y = fill_forward(geometry.y[rows])
+        if np.isnan(x[0]) or np.isnan(y[0]):
+            return None
+        return rows, x, y
+
+    @staticmethod
+    def closed(path):
+        """
+        :param path: as returned by path
+        :return: True if the path ends where it starts
+        """
+        _rows, x, y = path
+        return abs(x[-1] - x[0]) <= 1e-9 and abs(y[-1] - y[0]) <= 1e-9
+
+    def entries(self, path):
+        """
+        vertices the block can start from
+        :param path: as returned by path, None if the block cannot change its start
+        :return: list of (vertex, x, y): the start, then any other vertex of closed paths, the end of open paths
+        """
+        if path is None:
+            return [(0, self.startx, self.starty)]
+        _rows, x, y = path
+        vertices = range(len(x) - 1) if G01Block.closed(path) else (0, len(x) - 1)
+        return [(vertex, float(x[vertex]), float(y[vertex])) for vertex in vertices]
+
+    def enterAt(self, path, vertex):
+        """
+        cut the path starting from another vertex: a closed path keeps its direction, an open path
+        entered at its last vertex is reversed. Lines keep their place and words, only X and Y move
+        :param path: as returned by path
+        :param vertex: one of entries
+        :return:
+        """
+        if vertex == 0:
+            return
+        rows, x, y = path
+        if G01Block.closed(path):
+            order = np.concatenate((np.arange(vertex, len(x) - 1), np.arange(0, vertex + 1)))
+        else:
+            order = np.arange(len(x) - 1, -1, -1)
+        geometry = self.lines[0].geometry
+        geometry.x[rows] = x[order]
+        geometry.y[rows] = y[order]
+        for line in self.lines:
+            if not line.empty():
+                line.flags |= WORD_X | WORD_Y
+        self.startx, self.starty = float(x[order[0]]), float(y[order[0]])
+        self.endx, self.endy = float(x[order[-1]]), float(y[order[-1]])
+
     def size(self):
         return len(self.lines)
 
@@ -93,11 +321,12 @@ class G01Block:
             return False
         first = self.lines[0]
         for last in self.lines[::-1]:
-            if len(last.block.gcodes):
+            if not last.empty():
                 break
         if not first.contains(pygcode.gcodes.GCodeRapidMove):
             return False
-        if not (last.contains(pygcode.gcodes.GCodeStopSpindle) or last.contains(pygcode.gcodes.GCodeLinearMove)):
+        if not (last.contains(pygcode.gcodes.GCodeStopSpindle) or last.contains(pygcode.gcodes.GCodeLinearMove) or
+                last.contains(pygcode.gcodes.GCodeArcMoveCW) or last.contains(pygcode.gcodes.GCodeArcMoveCCW)):
             return False
 
         return True
@@ -105,11 +334,21 @@ class G01Block:
     def distanceToStart(self, other_block):
         if (not self.isvalid()) or (not other_block.isvalid()):
             return None
-        dx = self.endx-other_block.startx
-        dy = self.endy-other_block.endy
+        endx, endy = self.endPoint()
+        dx = endx-other_block.startx
+        dy = endy-other_block.starty
         distance = math.sqrt(dx*dx+dy*dy)
         return distance
 
+    def endPoint(self):
+        """
+        where the head stays after this block, the start point if the block never moves on both axes
+        :return: (x, y)
+        """
+        if self.endx is None:
+            return self.startx, self.starty
+        return self.endx, self.endy
+
     def shortestPathToStart(self, block_array):
         """
         return the index of the shortest
@@ -168,75 +407,360 @@ class GCodeBlock:
     """
     gcode block, red from file or generated by function
     """
+    streaming = False
+    outofcore = False
+
     @staticmethod
-    def read_from_file(filename):
-        g = GCodeBlock("file: {}".format(filename))
+    def read_from_file(filename, parser="fast", cache=None, workers=1):
+        """
+        :param filename:
+        :param parser: one of PARSERS
+        :param cache: ParseCache, None to always parse the file
+        :param workers: processes parsing files of at least PARALLEL_SIZE bytes with the fast parser, in chunks
+        :return: the new GCodeBlock
+        """
+        desc = "file: {}".format(filename)
+        if cache is not None:
+            key = cache.key(filename, parser)
+            arrays = cache.load(key)
+            if arrays is not None:
+                print("parse cache hit {}".format(key))
+                g = GCodeBlock.fromArrays(desc, arrays)
+                print (g)
+                return g
+
+        if workers > 1 and parser == "fast" and os.path.getsize(filename) >= PARALLEL_SIZE:
+            print("parse in {} processes".format(workers))
+            g = GCodeBlock(desc)
+            chunks = []
+            # lines of a chunk are made while workers parse the next ones
+            for chunk in parse_chunks(filename, parser, workers):
+                g.restoreLines(chunk, len(g.lines))
+                chunks.append(chunk)
+            arrays = join_chunks(chunks)
+            # the last move of a chunk is not the last one of its G01Block, when the next chunk goes on with moves
+            islast = np.concatenate([chunk["islast"] for chunk in chunks]) if chunks else arrays["islast"]
+            for k in np.flatnonzero(islast != arrays["islast"]).tolist():
+                g.lines[k].islast = (False, True, None)[arrays["islast"][k]]
+            g.restoreBlocks(arrays)
+            if cache is not None:
+                cache.store(key, arrays)
+            print (g)
+            return g
+
+        g = GCodeBlock(desc)
         lma = G01Block()
-        with open(filename, 'r') as fh:
-            for line_text in fh.readlines():
-                line = GCodeLine(line_text)
-                g.appendLine(line)
-                if not(line.contains(pygcode.gcodes.GCodeLinearMove)  or len(line.gcodes)==0):
-                #if line.contains(pygcode.gcodes.GCodeRapidMove):
-                    if lma.size() > 0:
-                        g.g01blocks.append(lma)
-                        lma = G01Block()
-
-                lma.appendLine(line)
+        for line_text in read_lines(filename):
+            line = g.parseLine(line_text, parser)
+            if not(line.contains(pygcode.gcodes.GCodeLinearMove) or line.empty()):
+            #if line.contains(pygcode.gcodes.GCodeRapidMove):
+                if lma.size() > 0:
+                    g.g01blocks.append(lma)
+                    lma = G01Block()
+
+            lma.appendLine(line)
 
         if lma.size() > 0:
             g.g01blocks.append(lma)
+        g.buildGeometry()
+        if cache is not None:
+            cache.store(key, g.toArrays())
         print (g)
         return g
 
+    @staticmethod
+    def fromArrays(desc, arrays):
+        """
+        rebuild a block from the arrays of toArrays
+        :param desc:
+        :param arrays: dict of numpy arrays
+        :return: the new GCodeBlock
+        """
+        g = GCodeBlock(desc)
+        g.restoreLines(arrays)
+        g.restoreBlocks(arrays)
+        return g
+
+    def restoreLines(self, arrays, start=0):
+        """
+        append lines already parsed into arrays, the ones of toArrays or a chunk of them
+        :param arrays: dict of numpy arrays, flags, islast, fallback_index and fallback_text at least
+        :param start: geometry row of the first line
+        :return:
+        """
+        geometry = self.geometry
+        fallback = dict(zip(arrays["fallback_index"].tolist(), arrays["fallback_text"].tolist()))
+        flags = arrays["flags"].tolist()
+        # -1 is None
+        islast = [(False, True, None)[v] for v in arrays["islast"].tolist()]
+        self.lines += [GCodeLine.restore(geometry, start + i, flags[i],
+                                         pygcode.Line(fallback[i]) if i in fallback else None, islast[i])
+                       for i in range(len(flags))]
+
+    def restoreBlocks(self, arrays):
+        """
+        geometry columns, G01Blocks and stats of restored lines
+        :param arrays: dict of numpy arrays, as toArrays
+        :return:
+        """
+        for name in Geometry.columns:
+            setattr(self.geometry, name, arrays[name])
+
+        start = 0
+        for size, bounds in zip(arrays["block_size"].tolist(), arrays["block_bounds"].tolist()):
+            lma = G01Block()
+            lma.lines = self.lines[start:start + size]
+            start += size
+            lma.xmin, lma.xmax, lma.ymin, lma.ymax = bounds[:4]
+            # NaN is None
+            lma.startx, lma.starty, lma.endx, lma.endy = [None if v != v else v for v in bounds[4:]]
+            lma.first = lma.startx is None
+            for line in lma.lines:
+                if line.islast:
+                    lma.last01line = line
+            self.g01blocks.append(lma)
+
+        self.updateStats()
+
+    def toArrays(self):
+        """
+        parsed lines and G01Block segmentation of a block just read from file, as numpy arrays
+        :return: dict of numpy arrays
+        """
+        arrays = {name: getattr(self.geometry, name) for name in Geometry.columns}
+        fallback = [line for line in self.lines if line.line is not None]
+        arrays["fallback_index"] = np.array([line.index for line in fallback], dtype=np.int64)
+        arrays["fallback_text"] = np.array([line.line.text.rstrip("\n") for line in fallback], dtype=str)
+        arrays["flags"] = np.array([line.flags for line in self.lines], dtype=np.uint8)
+        arrays["islast"] = np.array([-1 if line.islast is None else int(line.islast) for line in self.lines],
+                                    dtype=np.int8)
+        arrays["block_size"] = np.array([lma.size() for lma in self.g01blocks], dtype=np.int64)
+        arrays["block_bounds"] = np.array([[lma.xmin, lma.xmax, lma.ymin, lma.ymax] +
+                                           [NAN if v is None else v for v in (lma.startx, lma.starty, lma.endx, lma.endy)]
+                                           for lma in self.g01blocks], dtype=np.float64).reshape(-1, 8)
+        return arrays
+
     def __init__(self, desc):
         self.desc = desc
         self.lines = []
         self.g01blocks = []
+        # unknown ranges are empty, min above max
         self.xmin = sys.float_info.max
-        self.xmax = sys.float_info.min
+        self.xmax = -sys.float_info.max
         self.ymin = sys.float_info.max
-        self.ymax = sys.float_info.min
-        self.smin = 0
-        self.smax = 0
-        self.fmin = 0
-        self.fmax = 0
+        self.ymax = -sys.float_info.max
+        self.smin = sys.float_info.max
+        self.smax = -sys.float_info.max
+        self.fmin = sys.float_info.max
+        self.fmax = -sys.float_info.max
+        self.geometry = Geometry()
+        # pending affine transform of X, Y, see transformBy
+        self.transform = IDENTITY
+        # G01Blocks ordered by inside first, merge keeps containment
+        self.inside_first = False
+
+    def parseLine(self, line_text, parser="fast"):
+        """
+        parse and append a line
+        :param line_text:
+        :param parser: one of PARSERS
+        :return: the new GCodeLine
+        """
+        line = GCodeLine(line_text, self.geometry, parser)
+        self.lines.append(line)
+        return line
 
-    def appendLine(self, line):
-        gcode = None
-        gcode_spindle_speed = None
-        gcode_feed_rate = None
-
-        if line.contains(pygcode.gcodes.GCodeRapidMove):
-            gcode = line.get(pygcode.gcodes.GCodeRapidMove)
-        if line.contains(pygcode.gcodes.GCodeLinearMove):
-            gcode = line.get(pygcode.gcodes.GCodeLinearMove)
-
-        if line.contains(pygcode.gcodes.GCodeSpindleSpeed):
-            gcode_spindle_speed = line.get(pygcode.gcodes.GCodeSpindleSpeed)
-        if line.contains(pygcode.gcodes.GCodeFeedRate):
-            gcode_feed_rate = line.get(pygcode.gcodes.GCodeFeedRate)
-
-        if gcode is not None:
-            if gcode.X is not None:
-                self.xmin = min(gcode.X, self.xmin)
-                self.xmax = max(gcode.X, self.xmax)
-
-            if gcode.Y is not None:
-                self.ymin = min(gcode.Y, self.ymin)
-                self.ymax = max(gcode.Y, self.ymax)
-
-        if gcode_spindle_speed is not None:
-            self.smin = min(gcode_spindle_speed.word.value, self.smin)
-            self.smax = max(gcode_spindle_speed.word.value, self.smax)
-        if gcode_feed_rate is not None:
-            self.fmin = min(gcode_feed_rate.word.value, self.fmin)
-            self.fmax = max(gcode_feed_rate.word.value, self.fmax)
+    def buildGeometry(self):
+        """
+        freeze the columnar store of parsed lines, and compute stats
+        :return:
+        """
+        self.geometry.freeze()
+        self.updateStats()
 
-        self.lines.append(line)
+    def updateStats(self):
+        """
+        compute X and Y ranges of G00, G01 and arc moves, with the pending transform, F and S ranges,
+        from the geometry: a vectorized reduction of whole columns, removed lines have no word left
+        :return:
+        """
+        geometry = self.geometry
+        moves = geometry.moves()
+        if (self.transform == IDENTITY).all():
+            xrange = Geometry.range(geometry.x, moves)
+            yrange = Geometry.range(geometry.y, moves)
+        elif axis_aligned(self.transform):
+            xrange, yrange = transform_range(self.transform, Geometry.range(geometry.x, moves),
+                                             Geometry.range(geometry.y, moves))
+        else:
+            xrange, yrange = self.transformedRanges(self.transform)
+        if not np.isnan(geometry.i).all():
+            # arcs made by filters may bulge out of their end points
+            order = np.array([line.index for line in self.lines], dtype=np.int64)
+            x, y = geometry.arcExtremes(order, self.transform)
+            xrange = Geometry.range(np.append(x, xrange or ()))
+            yrange = Geometry.range(np.append(y, yrange or ()))
+        self.xmin, self.xmax = xrange or (sys.float_info.max, -sys.float_info.max)
+        self.ymin, self.ymax = yrange or (sys.float_info.max, -sys.float_info.max)
+        self.smin, self.smax = Geometry.range(geometry.s) or (sys.float_info.max, -sys.float_info.max)
+        self.fmin, self.fmax = Geometry.range(geometry.f) or (sys.float_info.max, -sys.float_info.max)
+
+    def transformedRanges(self, matrix):
+        """
+        X and Y ranges of G00, G01 and arc moves after a transform mixing X and Y, from the modal positions
+        :param matrix: 3x3 numpy array
+        :return: (xmin, xmax), (ymin, ymax), None where unknown
+        """
+        order = np.array([line.index for line in self.lines], dtype=np.int64)
+        touched, x, y = self.geometry.modalPositions(order)
+        motion = self.geometry.motion[order]
+        moves = touched & ((motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS))
+        x, y = transform_points(matrix, x[moves], y[moves])
+        return Geometry.range(x), Geometry.range(y)
+
+    def mapStats(self, name, function):
+        """
+        move the F or S range along with a line local filter mapping the values of the column,
+        without reading the column again
+        :param name: "f" or "s"
+        :param function: monotonic function of a value
+        :return:
+        """
+        low = getattr(self, name + "min")
+        if low == sys.float_info.max:
+            return
+        values = sorted(function(v) for v in (low, getattr(self, name + "max")))
+        setattr(self, name + "min", values[0])
+        setattr(self, name + "max", values[1])
+
+    def updateBounds(self):
+        """
+        compute bounds, start and end point of all the G01Blocks from the geometry, as appendLine would
+        see their lines now, e.g. after filters removed or replaced moves: one vectorized pass over all lines.
+        Arcs made by filters count with their whole extent
+        :return:
+        """
+        g01blocks = self.g01blocks
+        sizes = np.array([len(g01block.lines) for g01block in g01blocks], dtype=np.int64)
+        rows = np.array([line.index for g01block in g01blocks for line in g01block.lines], dtype=np.int64)
+        geometry = self.geometry
+        bounds = block_bounds(geometry.x[rows], geometry.y[rows], geometry.motion[rows], sizes,
+                              geometry.arcExtremes(rows))
+        for g01block, row in zip(g01blocks, bounds.tolist()):
+            g01block.xmin, g01block.xmax, g01block.ymin, g01block.ymax = row[:4]
+            # NaN is None
+            g01block.startx, g01block.starty, g01block.endx, g01block.endy = [None if v != v else v for v in row[4:]]
+            g01block.first = g01block.startx is None
+
+    def refreshStats(self):
+        """
+        stats and G01Block bounds from the geometry, after a filter removed or replaced lines
+        :return:
+        """
+        self.updateStats()
+        self.updateBounds()
+
+    def mergeStats(self, other):
+        """
+        extend stats to the ones of another block
+        :param other:
+        :return:
+        """
+        self.xmin = min(self.xmin, other.xmin)
+        self.xmax = max(self.xmax, other.xmax)
+        self.ymin = min(self.ymin, other.ymin)
+        self.ymax = max(self.ymax, other.ymax)
+        self.smin = min(self.smin, other.smin)
+        self.smax = max(self.smax, other.smax)
+        self.fmin = min(self.fmin, other.fmin)
+        self.fmax = max(self.fmax, other.fmax)
+
+    def apply(self, line_filter):
+        """
+        apply a line local filter to all the lines
+        :param line_filter: function taking a GCodeBlock
+        :return:
+        """
+        line_filter(self)
+
+    def addLines(self, rows):
+        """
+        new fast parsed lines, to be placed by the caller in lines and G01Blocks
+        :param rows: list of (motion, x, y, z, f, s, flags)
+        :return: list of GCodeLine
+        """
+        start = self.geometry.extend([row[:6] for row in rows])
+        return [GCodeLine.restore(self.geometry, start + k, row[6]) for k, row in enumerate(rows)]
+
+    def merge(self, others):
+        """
+        append the lines and G01Blocks of other loaded blocks, as if read from a single file:
+        pending transforms are applied, geometries are concatenated
+        :param others: list of GCodeBlock, their lines move to this block
+        :return:
+        """
+        blocks = [self] + others
+        for block in blocks:
+            block.applyTransform()
+        self.geometry, offsets = Geometry.concatenate([block.geometry for block in blocks])
+        for block, offset in zip(blocks, offsets):
+            for line in block.lines:
+                line.geometry = self.geometry
+                line.index += offset
+        for other in others:
+            self.lines += other.lines
+            self.g01blocks += other.g01blocks
+            self.mergeStats(other)
+        self.desc = "merge of {}".format(", ".join(block.desc for block in blocks))
+
+    def transformBy(self, matrix):
+        """
+        compose an affine transform with the pending one: geometric filters only update bounds, analytically
+        for axis aligned transforms, the composed transform is applied to the lines once, by applyTransform
+        :param matrix: 3x3 numpy array
+        :return:
+        """
+        self.transform = matrix @ self.transform
+        if axis_aligned(matrix):
+            xrange = None if self.xmin == sys.float_info.max else (self.xmin, self.xmax)
+            yrange = None if self.ymin == sys.float_info.max else (self.ymin, self.ymax)
+            xrange, yrange = transform_range(matrix, xrange, yrange)
+        else:
+            xrange, yrange = self.transformedRanges(self.transform)
+        if xrange is not None:
+            self.xmin, self.xmax = xrange
+        if yrange is not None:
+            self.ymin, self.ymax = yrange
+
+    def applyTransform(self):
+        """
+        apply the pending transform to the geometry, in one pass, before writing or before a filter
+        reading coordinates
+        :return:
+        """
+        if (self.transform == IDENTITY).all():
+            return
+        order = np.array([line.index for line in self.lines], dtype=np.int64)
+        self.geometry.readOffsets([line for line in self.lines if line.line is not None], self.transform)
+        filled = self.geometry.transform(self.transform, order)
+        if len(filled):
+            filled = set(filled.tolist())
+            for line in self.lines:
+                if line.index in filled:
+                    line.flags |= WORD_X | WORD_Y
+        if axis_aligned(self.transform):
+            for g01block in self.g01blocks:
+                g01block.transformBy(self.transform)
+        else:
+            # moves missing a word got it
+            self.updateBounds()
+        self.transform = IDENTITY
 
     def __repr__(self):
         s = "{}, {} lines of code, g01blocks: {}".format(self.desc, len(self.lines), len(self.g01blocks))
+        return self.statsRepr(s)
+
+    def statsRepr(self, s):
         if self.xmin != sys.float_info.max:
             s = "{}, X from {} to {}".format(s, self.xmin, self.xmax)
         if self.ymin != sys.float_info.max:
@@ -249,18 +773,301 @@ class GCodeBlock:
         return s
 
 
-def write_gcode(filename):
+class GCodeStream:
+    """
+    gcode file processed in chunks of lines at write time, in order to use constant memory:
+    line local filters are queued by apply, global stats are computed by a pre-scan
+    of the file, only when a filter needs them
+    """
+    streaming = True
+    outofcore = False
+    stats = ("xmin", "xmax", "ymin", "ymax", "smin", "smax", "fmin", "fmax")
+    chunk_size = 1000
+
+    def __init__(self, filename, parser="fast"):
+        self.desc = "file: {}, streaming".format(filename)
+        self.filename = filename
+        self.parser = parser
+        self.line_filters = []
+        self.scanned = None
+        # pending affine transform of X, Y, axis aligned
+        self.transform = IDENTITY
+
+    def __getattr__(self, name):
+        if name in GCodeStream.stats:
+            if self.scanned is None:
+                self.scanned = self.prescan()
+            return getattr(self.scanned, name)
+        raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+
+    def prescan(self):
+        """
+        compute global stats, without keeping lines, with the line local filters queued so far:
+        later filters update them, see mapStats and transformBy
+        :return: the GCodeBlock holding the stats
+        """
+        print("prescan of file {}".format(self.filename))
+        g = GCodeBlock(self.desc)
+        for chunk in self.chunks():
+            if len(self.line_filters):
+                chunk.updateStats()
+            g.mergeStats(chunk)
+        return g
+
+    def apply(self, line_filter):
+        """
+        queue a line local filter, applied to every chunk when writing
+        :param line_filter: function taking a GCodeBlock
+        :return:
+        """
+        self.line_filters.append(line_filter)
+
+    def mapStats(self, name, function):
+        """
+        move the F or S range along with a queued line local filter, if already scanned
+        :param name: "f" or "s"
+        :param function: monotonic function of a value
+        :return:
+        """
+        if self.scanned is not None:
+            self.scanned.mapStats(name, function)
+
+    def transformBy(self, matrix):
+        """
+        compose an axis aligned transform with the pending one, applied to every chunk when writing:
+        transforms mixing X and Y would need the modal position carried from chunk to chunk
+        :param matrix: 3x3 numpy array
+        :return:
+        """
+        if not axis_aligned(matrix):
+            raise ValueError("only axis aligned transforms are available in stream mode")
+        if self.scanned is None:
+            self.scanned = self.prescan()
+        self.scanned.transformBy(matrix)
+        self.transform = matrix @ self.transform
+
+    def readChunks(self):
+        """
+        read the file, chunk by chunk
+        :return: generator of GCodeBlock
+        """
+        chunk = GCodeBlock(self.desc)
+        for line_text in read_lines(self.filename):
+            chunk.parseLine(line_text, self.parser)
+            if len(chunk.lines) == GCodeStream.chunk_size:
+                chunk.buildGeometry()
+                yield chunk
+                chunk = GCodeBlock(self.desc)
+        chunk.buildGeometry()
+        yield chunk
+
+    def chunks(self):
+        """
+        read the file, chunk by chunk, applying queued filters
+        :return: generator of GCodeBlock
+        """
+        for chunk in self.readChunks():
+            for line_filter in self.line_filters:
+                chunk.apply(line_filter)
+            chunk.transform = self.transform
+            yield chunk
+
+    def __repr__(self):
+        if self.scanned is None:
+            return self.desc
+        return self.scanned.statsRepr(self.desc)
+
+
+class GCodeSpill(GCodeStream):
+    """
+    gcode file too large for memory, whose G01Blocks can be reordered: reading keeps, for every G01Block,
+    a row of summary arrays (bounds, start and end point, isvalid, byte offset and length of its lines),
+    as global filters need, and no line. Block lines stay in the file, or in a temporary spill file
+    for compressed files, and are read again by offset at write time, in the order of the blocks,
+    chunk by chunk, as streams are, with their queued line local filters
+    """
+    outofcore = True
+
+    def __init__(self, filename, parser="fast"):
+        GCodeStream.__init__(self, filename, parser)
+        self.desc = "file: {}, out of core".format(filename)
+        self.spill = tempfile.TemporaryFile(prefix="gdoctor-")
+        self.inside_first = False
+        self.read()
+
+    def read(self):
+        """
+        parse the file once, computing stats and the summary of G01Blocks, segmented as read_from_file does
+        :return:
+        """
+        spilled, lines = located_lines(self.filename, self.spill)
+        self.source = self.spill if spilled else None
+        self.scanned = GCodeBlock(self.desc)
+        # summary rows, converted to arrays every chunk
+        bounds = []
+        valid = []
+        offsets = []
+        parts = []
+
+        def close(g01block, offset):
+            bounds.append([g01block.xmin, g01block.xmax, g01block.ymin, g01block.ymax] +
+                          [NAN if v is None else v for v in (g01block.startx, g01block.starty, g01block.endx,
+                                                             g01block.endy)])
+            valid.append(g01block.isvalid())
+            offsets.append(offset)
+
+        chunk = GCodeBlock(self.desc)
+        lma = G01Block()
+        start = end = 0
+        for offset, line_text in lines:
+            line = chunk.parseLine(line_text, self.parser)
+            if not(line.contains(pygcode.gcodes.GCodeLinearMove) or line.empty()):
+                if lma.size() > 0:
+                    close(lma, start)
+                    lma = G01Block()
+                    start = offset
+            lma.appendLine(line)
+            end = offset + len(line_text.encode(ENCODING))
+            if len(chunk.lines) == GCodeStream.chunk_size:
+                chunk.buildGeometry()
+                self.scanned.mergeStats(chunk)
+                chunk = GCodeBlock(self.desc)
+                GCodeSpill.compact(lma)
+                if len(bounds):
+                    parts.append((np.array(bounds, dtype=np.float64), np.array(valid, dtype=bool),
+                                  np.array(offsets, dtype=np.int64)))
+                    bounds, valid, offsets = [], [], []
+        chunk.buildGeometry()
+        self.scanned.mergeStats(chunk)
+        if lma.size() > 0:
+            close(lma, start)
+        parts.append((np.array(bounds, dtype=np.float64).reshape(-1, 8), np.array(valid, dtype=bool),
+                      np.array(offsets, dtype=np.int64)))
+
+        self.bounds = np.concatenate([part[0] for part in parts])
+        self.valid = np.concatenate([part[1] for part in parts])
+        self.offset = np.concatenate([part[2] for part in parts])
+        self.length = np.diff(np.append(self.offset, end))
+        # blocks in writing order
+        self.order = np.arange(len(self.offset), dtype=np.int64)
+
+    @staticmethod
+    def compact(g01block):
+        """
+        drop the lines of a G01Block still being read that isvalid does not look at,
+        so that a block longer than a chunk does not keep all its lines in memory
+        :param g01block:
+        :return:
+        """
+        last = [line for line in g01block.lines[1:] if not line.empty()][-1:]
+        g01block.lines = g01block.lines[:1] + last
+
+    def movable(self, start=False):
+        """
+        :param start: only blocks having a start point
+        :return: numpy array of the valid blocks, in writing order
+        """
+        ids = self.order[self.valid[self.order]]
+        if start:
+            ids = ids[~np.isnan(self.bounds[ids, 4])]
+        return ids
+
+    def boxes(self, ids):
+        """
+        :param ids: numpy array of blocks
+        :return: list of (xmin, ymin, xmax, ymax)
+        """
+        return self.bounds[ids][:, [0, 2, 1, 3]].tolist()
+
+    def points(self, ids):
+        """
+        :param ids: numpy array of blocks
+        :return: (starts, ends) lists of (x, y), the end is the start for blocks never moving on both axes
+        """
+        bounds = self.bounds[ids]
+        ends = np.where(np.isnan(bounds[:, 6:8]), bounds[:, 4:6], bounds[:, 6:8])
+        return bounds[:, 4:6].tolist(), ends.tolist()
+
+    def reorder(self, ids, start=False):
+        """
+        :param ids: numpy array, the blocks returned by movable in their new order: they take the places of
+         the movable ones, other blocks stay where they are
+        :param start: as given to movable
+        :return:
+        """
+        mask = self.valid[self.order]
+        if start:
+            mask &= ~np.isnan(self.bounds[self.order, 4])
+        self.order[mask] = ids
+
+    def transformBy(self, matrix):
+        """
+        compose an axis aligned transform with the pending one, moving block summaries along
+        :param matrix: 3x3 numpy array
+        :return:
+        """
+        GCodeStream.transformBy(self, matrix)
+        (a, _b, c), (_d, e, f) = matrix[:2].tolist()
+        bounds = self.bounds
+        for low, high, scale, shift in ((0, 1, a, c), (2, 3, e, f)):
+            # unset bounds, min above max, stay unset
+            known = bounds[:, low] <= bounds[:, high]
+            ends = bounds[known][:, [low, high]] * scale + shift
+            bounds[known, low] = ends.min(axis=1)
+            bounds[known, high] = ends.max(axis=1)
+        bounds[:, [4, 6]] = bounds[:, [4, 6]] * a + c
+        bounds[:, [5, 7]] = bounds[:, [5, 7]] * e + f
+
+    def readChunks(self):
+        """
+        read the lines of G01Blocks again, in writing order, chunk by chunk
+        :return: generator of GCodeBlock
+        """
+        source = self.source if self.source is not None else open(self.filename, 'rb')
+        try:
+            source.seek(0, 2)
+            mm = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) if source.tell() else b""
+            chunk = GCodeBlock(self.desc)
+            for b in self.order.tolist():
+                for line_text in lines_at(mm, int(self.offset[b]), int(self.length[b])):
+                    chunk.parseLine(line_text, self.parser)
+                if len(chunk.lines) >= GCodeStream.chunk_size:
+                    chunk.buildGeometry()
+                    yield chunk
+                    chunk = GCodeBlock(self.desc)
+            chunk.buildGeometry()
+            yield chunk
+        finally:
+            if source is not self.source:
+                source.close()
+
+    def __repr__(self):
+        return self.scanned.statsRepr("{}, g01blocks: {}".format(self.desc, len(self.order)))
+
+
+def write_gcode(filename, precision=None, drop_modal=False):
+    """
+    write all the blocks to a file
+    :param filename:
+    :param precision: decimal digits of plain G0/G1 lines, None for the pygcode format
+    :param drop_modal: drop G00/G01, F and S words repeating the last written ones
+    :return:
+    """
 
     print("write_gcode to file {}".format(filename))
 
-    with open(filename, "w") as h:
+    with open_gcode(filename, "w") as h:
+        writer = GCodeWriter(h, precision, drop_modal)
         for block in gCodeBlocks:
-            h.write("; <gcodedoctor>\n")
-            h.write("; {}\n".format(block))
-            h.write("; </gcodedoctor>\n")
-            for line in block.lines:
-                if len(line.block.gcodes) or line.comment is not None:
-                    h.write("{}\n".format(line))
+            writer.write("; <gcodedoctor>")
+            writer.write("; {}".format(block))
+            writer.write("; </gcodedoctor>")
+            if block.streaming:
+                for chunk in block.chunks():
+                    writer.writeBlock(chunk)
+            else:
+                writer.writeBlock(block)
+        writer.flush()
 
 #            for g01block in block.g01blocks:
 #                h.write("; {}\n".format(g01block))
@@ -268,99 +1075,292 @@ def write_gcode(filename):
 #                    h.write("{}\n".format(line))
 
 
-def read_gcode(filename):
+def read_gcode(filename, stream=False, parser="fast", cache=None, outofcore=False, workers=1):
     """
     Read gcode into new buffer
     :param filename:
+    :param stream: if True, do not load the file, process it at write time
+    :param parser: one of PARSERS
+    :param cache: ParseCache of loaded files, not used by streams
+    :param outofcore: if True, keep only a summary of G01Blocks, see GCodeSpill
+    :param workers: parsing processes of loaded files
     :return:
     """
     print("read_gcode from file {}".format(filename))
-    block = GCodeBlock.read_from_file(filename)
+    if outofcore:
+        block = GCodeSpill(filename, parser)
+        print(block)
+    elif stream:
+        block = GCodeStream(filename, parser)
+    else:
+        block = GCodeBlock.read_from_file(filename, parser, cache, workers)
     gCodeBlocks.append(block)
 
 
 class GcodeReadAction(argparse.Action):
 
     def __call__(self, _parser, namespace, values, option_string=None):
-        read_gcode(values)
+        with stage(option_string, values):
+            cache = None
+            if namespace.cache_dir is not None:
+                cache = ParseCache(namespace.cache_dir, namespace.cache_size * 1024 * 1024)
+            read_gcode(values, stream=namespace.stream, parser=namespace.parser, cache=cache,
+                       outofcore=namespace.out_of_core, workers=namespace.parse_workers)
 
 
 class GcodeWriteAction(argparse.Action):
 
     def __call__(self, _parser, namespace, values, option_string=None):
-        write_gcode(values)
+        with stage(option_string, values):
+            write_gcode(values, precision=namespace.precision, drop_modal=namespace.drop_modal_words)
 
 
 class GcodeInsideFirstFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        inside_first_filter()
+        with stage(option_string):
+            inside_first_filter()
 
 
 class GcodeFeedRateFilterMultiplyAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        feed_rate_multiply_filter(values)
+        with stage(option_string, values):
+            feed_rate_multiply_filter(values)
 
 
 class GcodeFeedRateMaxFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        feed_rate_max_filter(values)
+        with stage(option_string, values):
+            feed_rate_max_filter(values)
 
 
 class GcodeSpindleSpeedFilterMultiplyAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        spindle_speed_multiply_filter(values)
+        with stage(option_string, values):
+            spindle_speed_multiply_filter(values)
 
 
 class GcodeSpindleSpeedMaxAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        spindle_speed_max_filter(values)
+        with stage(option_string, values):
+            spindle_speed_max_filter(values)
 
 
 class GcodeStartXFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        startx_filter(values)
+        with stage(option_string, values):
+            startx_filter(values)
 
 
 class GcodeStartYFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        starty_filter(values)
+        with stage(option_string, values):
+            starty_filter(values)
 
 
 class GcodeResizeFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        resize_filter(values)
+        with stage(option_string, values):
+            resize_filter(values)
+
+
+class GcodeRotateFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string, values):
+            rotate_filter(values)
+
+
+class GcodeMirrorFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string, values):
+            mirror_filter(values)
 
 
 class GcodeMinDistanceFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        mindistance_filter(values)
+        with stage(option_string, values):
+            mindistance_filter(values)
 
 
-class GcodeOptimizePathFilterAction(argparse.Action):
+class GcodeSimplifyFilterAction(argparse.Action):
     def __call__(self, _parser, namespace, values, option_string=None):
-        optimize_path_filter()
+        with stage(option_string, values):
+            simplify_filter(values)
 
 
+class GcodeDedupeFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string, values):
+            dedupe_filter(values)
 
-if __name__ == "__main__":
+
+class GcodeMergeCollinearFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string, values):
+            merge_collinear_filter(values)
+
+
+class GcodeEstimateAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string):
+            estimate_report(namespace.rapid_rate, namespace.acceleration, namespace.junction_deviation)
 
 
+class GcodeArcFitFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string, values):
+            arc_fit_filter(values)
+
+
+class GcodeMergeAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string):
+            merge_filter(namespace.path_entry, namespace.optimize_time_budget)
+
+
+class GcodeOptimizePathFilterAction(argparse.Action):
+    def __call__(self, _parser, namespace, values, option_string=None):
+        with stage(option_string):
+            optimize_path_filter(namespace.path_entry, namespace.optimize_time_budget)
+
+
+def duration(text):
+    """
+    :param text: e.g. 5s, 500ms, 2m, 5 is seconds
+    :return: seconds
+    """
+    value, scale = text, 1.0
+    for suffix, unit in (("ms", 0.001), ("s", 1.0), ("m", 60.0)):
+        if text.endswith(suffix):
+            value, scale = text[:-len(suffix)], unit
+            break
+    try:
+        seconds = float(value) * scale
+    except ValueError:
+        raise argparse.ArgumentTypeError("{}: duration expected, e.g. 5s, 500ms, 2m".format(text))
+    if seconds < 0:
+        raise argparse.ArgumentTypeError("{}: negative duration".format(text))
+    return seconds
+
+
+def build_parser():
+    """
+    command line parser: actions are executed while parsing, in command line order
+    :return:
+    """
     parser = argparse.ArgumentParser(description='gcode doctor', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--stream", action="store_true",
+                        help="process following --readgcode files line by line at write time, "
+                             "only line local filters are available")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="following --readgcode files keep in memory only a summary of their paths, "
+                             "that inside first and optimize path reorder, lines are read again at write time")
+    parser.add_argument("--parser", choices=PARSERS, default="fast",
+                        help="parser of following --readgcode files, fast falls back to pygcode for uncommon lines")
+    parser.add_argument("--parse-workers", type=int, default=1,
+                        help="processes parsing following --readgcode files in chunks, with the fast parser; "
+                             "files smaller than 1 MB are parsed by this process")
+    parser.add_argument("--cache-dir",
+                        help="parse cache of following --readgcode files, keyed by file content")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="MB of the parse cache, least recently used files are evicted")
+    parser.add_argument("--stats", help="write wall and cpu time, peak memory, lines touched and travel "
+                                        "of every stage to this json file")
+    parser.add_argument("--profile-dir", help="with --stats, write a cProfile dump of every stage in this directory")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --stats, record the peak python memory of every stage, slower")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="run jobs sent as http requests to a unix socket path, or [host:]port of a loopback "
+                             "address, see server.py; other options are given by every job")
+    parser.add_argument("--workers", type=int, help="with --serve, worker processes, default the number of cpu")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="with --serve, jobs waiting for a worker, more are refused until the queue drains")
+    parser.add_argument("--input-dir", help="with --serve, directory of the input files named by jobs, "
+                                            "jobs can only send gcode text without it")
+    parser.add_argument("--output-dir", help="with --serve, directory of the output files named by jobs, "
+                                             "jobs can only get gcode text without it")
+    parser.add_argument("--precision", type=int,
+                        help="decimal digits of X, Y, Z, F, S of following --writegcode files, "
+                             "default is the pygcode format")
+    parser.add_argument("--drop-modal-words", action="store_true",
+                        help="following --writegcode files do not repeat G0/G1, F and S words equal to the previous ones")
     parser.add_argument("--readgcode", action=GcodeReadAction)
     parser.add_argument("--writegcode", action=GcodeWriteAction)
+    parser.add_argument("--rapid-rate", type=float, default=RAPID_RATE, help="G0 rate of --estimate, mm/min")
+    parser.add_argument("--acceleration", type=float, default=ACCELERATION, help="acceleration of --estimate, mm/s^2")
+    parser.add_argument("--junction-deviation", type=float, default=JUNCTION_DEVIATION,
+                        help="junction deviation of --estimate, mm")
+    parser.add_argument("--estimate", nargs=0, action=GcodeEstimateAction,
+                        help="print the estimated run time of the last read file, can be repeated between filters")
+    parser.add_argument("--path-entry", action="store_true",
+                        help="following --filter-optimize-path and --merge may start closed paths from any vertex, "
+                             "and cut open paths in reverse")
+    parser.add_argument("--optimize-time-budget", type=duration,
+                        help="following --filter-optimize-path and --merge improve the nearest path tour "
+                             "by 2-opt and Or-opt moves for this time, e.g. 5s")
+    parser.add_argument("--merge", nargs=0, action=GcodeMergeAction,
+                        help="merge all the files read so far into one, ordering their paths together; "
+                             "filters given before apply to the file read before them")
     parser.add_argument("--filter-inside-first", nargs=0, action=GcodeInsideFirstFilterAction)
     parser.add_argument("--filter-optimize-path", nargs=0, action=GcodeOptimizePathFilterAction)
     parser.add_argument("--filter-start-x", action=GcodeStartXFilterAction)
     parser.add_argument("--filter-start-y", action=GcodeStartYFilterAction)
     parser.add_argument("--filter-resize", action=GcodeResizeFilterAction)
+    parser.add_argument("--filter-rotate", action=GcodeRotateFilterAction,
+                        help="rotate counterclockwise by degrees around the center of the bounding box")
+    parser.add_argument("--filter-mirror", action=GcodeMirrorFilterAction, choices=("x", "y", "xy"),
+                        help="flip X, Y or both inside the bounding box")
     parser.add_argument("--filter-min-distance", action=GcodeMinDistanceFilterAction)
+    parser.add_argument("--filter-simplify", action=GcodeSimplifyFilterAction)
+    parser.add_argument("--filter-arc-fit", action=GcodeArcFitFilterAction)
+    parser.add_argument("--filter-dedupe", action=GcodeDedupeFilterAction,
+                        help="do not cut again G01 moves lying within this distance on moves already cut")
+    parser.add_argument("--filter-merge-collinear", action=GcodeMergeCollinearFilterAction,
+                        help="merge runs of collinear G01 moves within ANGLE degrees and, optionally, "
+                             "POWER spindle speed, e.g. 0.5,10", metavar="ANGLE[,POWER]")
     parser.add_argument("--filter-feed-rate-multiply", action=GcodeFeedRateFilterMultiplyAction)
     parser.add_argument("--filter-feed-rate-max", action=GcodeFeedRateMaxFilterAction)
     parser.add_argument("--filter-spindle-speed-multiply", action=GcodeSpindleSpeedFilterMultiplyAction)
     parser.add_argument("--filter-spindle-speed-max", action=GcodeSpindleSpeedMaxAction)
-
-    args = parser.parse_args()
+    return parser
 
 
+def run(argv):
+    """
+    execute a gdoctor command line, starting with no gcode loaded
+    :param argv: command line arguments, without the program name
+    :return:
+    """
+    del gCodeBlocks[:]
+    # --stats records every stage, wherever it is on the command line
+    options = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    options.add_argument("--stats")
+    options.add_argument("--profile-dir")
+    options.add_argument("--trace-memory", action="store_true")
+    options.add_argument("--serve")
+    options.add_argument("--workers", type=int)
+    options.add_argument("--max-queue", type=int, default=16)
+    options.add_argument("--cache-dir")
+    options.add_argument("--input-dir")
+    options.add_argument("--output-dir")
+    options, _others = options.parse_known_args(argv)
+    if options.serve is not None:
+        # imported here, as it imports this module
+        import server
+        server.serve(options.serve, options.workers, options.max_queue, options.cache_dir, options.input_dir,
+                     options.output_dir)
+        return
+    if options.stats is None:
+        build_parser().parse_args(argv)
+        return
+
+    recorder = instrument.start(options.profile_dir, options.trace_memory)
+    try:
+        build_parser().parse_args(argv)
+    finally:
+        instrument.stop()
+        recorder.report()
+        recorder.write(options.stats)
 
 
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,688 @@
+import math
+import sys
+
+import numpy as np
+import pygcode
+
+# motion column values
+NO_MOTION = -1
+RAPID = 0
+LINEAR = 1
+OTHER_MOTION = 2
+ARC_CW = 3
+ARC_CCW = 4
+ARCS = (ARC_CW, ARC_CCW)
+
+MOTION_CODES = {
+    pygcode.gcodes.GCodeRapidMove: RAPID,
+    pygcode.gcodes.GCodeLinearMove: LINEAR,
+    pygcode.gcodes.GCodeArcMoveCW: ARC_CW,
+    pygcode.gcodes.GCodeArcMoveCCW: ARC_CCW,
+}
+ARC_CODES = {
+    ARC_CW: pygcode.gcodes.GCodeArcMoveCW,
+    ARC_CCW: pygcode.gcodes.GCodeArcMoveCCW,
+}
+MOTION_WORDS = {
+    RAPID: "G00",
+    LINEAR: "G01",
+    ARC_CW: "G02",
+    ARC_CCW: "G03",
+}
+
+# words present in a line
+WORD_X = 1
+WORD_Y = 2
+WORD_Z = 4
+WORD_F = 8
+WORD_S = 16
+# S written before F
+S_FIRST = 32
+
+WORD_FLAGS = {
+    pygcode.gcodes.GCodeFeedRate: WORD_F,
+    pygcode.gcodes.GCodeSpindleSpeed: WORD_S,
+}
+
+NAN = float('nan')
+
+# 3x3 affine transform of X, Y
+IDENTITY = np.identity(3)
+
+
+def positional(gcode):
+    """
+    gcodes having X, Y, Z parameters, e.g. G00, G01, G02, G92
+    """
+    return 'X' in gcode.param_letters
+
+
+def format_value(value):
+    """
+    same format of pygcode float words
+    """
+    return "{0:g}".format(round(value, 3))
+
+
+def gcode_values(gcodes):
+    """
+    numeric words of pygcode gcodes
+    :param gcodes:
+    :return: (motion, x, y, z, f, s, flags)
+    """
+    x = y = z = f = s = NAN
+    flags = 0
+    motion = NO_MOTION
+    for gcode in gcodes:
+        cls = type(gcode)
+        if cls is pygcode.gcodes.GCodeFeedRate:
+            f = gcode.word.value
+            flags |= WORD_F
+        elif cls is pygcode.gcodes.GCodeSpindleSpeed:
+            s = gcode.word.value
+            if not flags & WORD_F:
+                flags |= S_FIRST
+            flags |= WORD_S
+        elif motion == NO_MOTION and positional(gcode):
+            motion = MOTION_CODES.get(cls, OTHER_MOTION)
+            params = gcode.params
+            if 'X' in params:
+                x = params['X'].value
+                flags |= WORD_X
+            if 'Y' in params:
+                y = params['Y'].value
+                flags |= WORD_Y
+            if 'Z' in params:
+                z = params['Z'].value
+                flags |= WORD_Z
+    return motion, x, y, z, f, s, flags
+
+
+class Geometry:
+    """
+    columnar store of the numeric words of a list of lines, row i is the line with index i:
+    X, Y, Z of the first positional gcode, F, S, and the kind of motion, NaN if a word is missing.
+    Rows are appended to python lists while reading, freeze turns them into numpy arrays;
+    filters then transform whole columns at once.
+    I, J are the center offsets of arcs made by filters, and of arcs read from file once a transform
+    read them from their pygcode line, NaN for other rows
+    """
+    columns = ("x", "y", "z", "f", "s", "motion", "i", "j")
+
+    def __init__(self):
+        self.x = []
+        self.y = []
+        self.z = []
+        self.f = []
+        self.s = []
+        self.motion = []
+
+    def __len__(self):
+        return len(self.motion)
+
+    def append(self, motion, x, y, z, f, s):
+        """
+        :return: the index of the new row
+        """
+        self.motion.append(motion)
+        self.x.append(x)
+        self.y.append(y)
+        self.z.append(z)
+        self.f.append(f)
+        self.s.append(s)
+        return len(self.motion) - 1
+
+    def freeze(self):
+        """
+        turn columns into numpy arrays
+        :return:
+        """
+        self.x = np.array(self.x, dtype=np.float64)
+        self.y = np.array(self.y, dtype=np.float64)
+        self.z = np.array(self.z, dtype=np.float64)
+        self.f = np.array(self.f, dtype=np.float64)
+        self.s = np.array(self.s, dtype=np.float64)
+        self.motion = np.array(self.motion, dtype=np.int8)
+        self.i = np.full(len(self.motion), np.nan)
+        self.j = np.full(len(self.motion), np.nan)
+
+    @staticmethod
+    def concatenate(geometries):
+        """
+        rows of frozen geometries, one after the other
+        :param geometries: list of Geometry
+        :return: (the new Geometry, offset of the first row of every geometry)
+        """
+        merged = Geometry()
+        for name in Geometry.columns:
+            setattr(merged, name, np.concatenate([getattr(g, name) for g in geometries]))
+        offsets = np.cumsum([0] + [len(g) for g in geometries[:-1]]).tolist()
+        return merged, offsets
+
+    def extend(self, rows):
+        """
+        append rows to frozen columns, e.g. for lines added by filters
+        :param rows: list of (motion, x, y, z, f, s)
+        :return: index of the first new row
+        """
+        start = len(self)
+        if len(rows):
+            motion, x, y, z, f, s = zip(*rows)
+            self.motion = np.concatenate((self.motion, np.array(motion, dtype=np.int8)))
+            for name, values in zip(("x", "y", "z", "f", "s"), (x, y, z, f, s)):
+                setattr(self, name, np.concatenate((getattr(self, name), np.array(values, dtype=np.float64))))
+            self.i = np.concatenate((self.i, np.full(len(rows), np.nan)))
+            self.j = np.concatenate((self.j, np.full(len(rows), np.nan)))
+        return start
+
+    def moves(self):
+        """
+        :return: mask of G00, G01, G02 and G03 rows
+        """
+        return (self.motion == RAPID) | (self.motion == LINEAR) | np.isin(self.motion, ARCS)
+
+    @staticmethod
+    def range(column, mask=None):
+        """
+        :param column:
+        :param mask: rows to consider, all if None
+        :return: (min, max) of the defined values, None if no value is defined
+        """
+        values = column if mask is None else column[mask]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None
+        return float(values.min()), float(values.max())
+
+    def removeRows(self, rows):
+        """
+        forget all the words of rows, e.g. of removed lines
+        :param rows: index array
+        :return:
+        """
+        self.motion[rows] = NO_MOTION
+        for column in (self.x, self.y, self.z, self.f, self.s, self.i, self.j):
+            column[rows] = np.nan
+
+    def removeMotion(self, i):
+        """
+        forget the positional gcode of row i
+        :param i:
+        :return:
+        """
+        self.motion[i] = NO_MOTION
+        self.x[i] = self.y[i] = self.z[i] = self.i[i] = self.j[i] = np.nan
+
+    def format(self, i, flags):
+        """
+        text of row i, as pygcode would write a G00/G01/G02/G03 line
+        :param i:
+        :param flags: words present in the line
+        :return:
+        """
+        words = []
+        motion = self.motion[i]
+        if motion != NO_MOTION:
+            words.append(MOTION_WORDS[motion])
+            if flags & WORD_X:
+                words.append("X" + format_value(self.x[i]))
+            if flags & WORD_Y:
+                words.append("Y" + format_value(self.y[i]))
+            if flags & WORD_Z:
+                words.append("Z" + format_value(self.z[i]))
+            if motion in ARCS:
+                words.append("I" + format_value(self.i[i]))
+                words.append("J" + format_value(self.j[i]))
+        if flags & S_FIRST:
+            words.append("S" + format_value(self.s[i]))
+        if flags & WORD_F:
+            words.append("F" + format_value(self.f[i]))
+        if flags & WORD_S and not flags & S_FIRST:
+            words.append("S" + format_value(self.s[i]))
+        return ' '.join(words)
+
+    def transform(self, matrix, order):
+        """
+        apply an affine transform to X, Y and to the I, J offsets of arcs, see readOffsets.
+        Axis aligned transforms (translate, scale, mirror) map X and Y of every row separately, a rotation
+        mixes them: moves missing X or Y take the modal value, 0 before the first one, and get both words.
+        Arcs are mirrored by transforms with negative determinant, G02 and G03 swapped
+        :param matrix: 3x3 numpy array
+        :param order: index array of rows, in line order
+        :return: index array of rows getting a missing X or Y word
+        """
+        if axis_aligned(matrix):
+            self.x, self.y = transform_points(matrix, self.x, self.y)
+            filled = np.zeros(0, dtype=np.int64)
+        else:
+            touched, x, y = self.modalPositions(order)
+            rows = order[touched]
+            filled = order[touched & (np.isnan(self.x[order]) | np.isnan(self.y[order]))]
+            self.x[rows], self.y[rows] = transform_points(matrix, x[touched], y[touched])
+        # offsets move with the linear part only
+        linear = matrix.copy()
+        linear[:2, 2] = 0.0
+        self.i, self.j = transform_points(linear, self.i, self.j)
+        if np.linalg.det(matrix) < 0:
+            cw = self.motion == ARC_CW
+            self.motion[self.motion == ARC_CCW] = ARC_CW
+            self.motion[cw] = ARC_CCW
+        return filled
+
+    def readOffsets(self, lines, matrix):
+        """
+        read the I, J words of arcs read from file into the columns, a missing word is 0, so that transforms
+        move them along with the arcs made by filters; updateLines writes them back. Arcs given by R get it
+        scaled in place, transforms of filters keep circles circles
+        :param lines: GCodeLine having a pygcode line
+        :param matrix: 3x3 numpy array, the transform about to be applied
+        :return:
+        """
+        scale = abs(np.linalg.det(matrix[:2, :2])) ** 0.5
+        for line in lines:
+            i = line.index
+            if self.motion[i] not in ARCS or self.i[i] == self.i[i]:
+                continue
+            for gcode in line.line.block.gcodes:
+                if positional(gcode):
+                    params = gcode.params
+                    if 'I' in params or 'J' in params:
+                        self.i[i] = params['I'].value if 'I' in params else 0.0
+                        self.j[i] = params['J'].value if 'J' in params else 0.0
+                    elif 'R' in params:
+                        params['R'].value *= scale
+                    break
+
+    def modalPositions(self, order):
+        """
+        X, Y of positional rows, as needed by a transform mixing them: moves missing a word take the
+        modal value, 0 before the first one; other positional gcodes, e.g. G92, count only with both words
+        :param order: index array of rows, in line order
+        :return: (touched, x, y) numpy arrays in line order, x and y are meaningful where touched
+        """
+        motion = self.motion[order]
+        moves = (motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS)
+        x = self.x[order]
+        y = self.y[order]
+        touched = np.where(moves, ~(np.isnan(x) & np.isnan(y)), ~(np.isnan(x) | np.isnan(y)))
+        mx = np.nan_to_num(fill_forward(np.where(moves, x, np.nan)))
+        my = np.nan_to_num(fill_forward(np.where(moves, y, np.nan)))
+        return touched, np.where(moves, mx, x), np.where(moves, my, y)
+
+    def arcExtremes(self, order, matrix=IDENTITY):
+        """
+        points where arcs made by filters, whose I, J are known, reach their X and Y extremes after a transform:
+        the crossings of their circle with the axes through its center, swept between start and end.
+        Arcs read from file count with their end point only
+        :param order: index array of rows, in line order
+        :param matrix: 3x3 numpy array
+        :return: (x, y) numpy arrays of 4 columns per row of order, NaN where a row is no such arc or its arc
+         does not sweep a crossing
+        """
+        extremes_x = np.full((len(order), 4), np.nan)
+        extremes_y = np.full((len(order), 4), np.nan)
+        motion = self.motion[order]
+        arcs = np.flatnonzero(np.isin(motion, ARCS) & ~np.isnan(self.i[order]))
+        if len(arcs) == 0:
+            return extremes_x, extremes_y
+        moves = (motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS)
+        # position after every row, an arc starts where the row before it left the tool
+        x = np.nan_to_num(fill_forward(np.where(moves, self.x[order], np.nan)))
+        y = np.nan_to_num(fill_forward(np.where(moves, self.y[order], np.nan)))
+        before = np.maximum(arcs - 1, 0)
+        sx = np.where(arcs > 0, x[before], 0.0)
+        sy = np.where(arcs > 0, y[before], 0.0)
+        cx = sx + np.nan_to_num(self.i[order][arcs])
+        cy = sy + np.nan_to_num(self.j[order][arcs])
+        full = (sx == x[arcs]) & (sy == y[arcs])
+        sx, sy = transform_points(matrix, sx, sy)
+        ex, ey = transform_points(matrix, x[arcs], y[arcs])
+        cx, cy = transform_points(matrix, cx, cy)
+        clockwise = (motion[arcs] == ARC_CW) != (np.linalg.det(matrix) < 0)
+
+        radius = np.hypot(sx - cx, sy - cy)
+        start = np.arctan2(sy - cy, sx - cx)
+        sweep = np.where(clockwise, start - np.arctan2(ey - cy, ex - cx),
+                         np.arctan2(ey - cy, ex - cx) - start) % (2 * np.pi)
+        sweep[full] = 2 * np.pi
+        axes = np.arange(4) * (np.pi / 2)
+        reached = np.where(clockwise[:, None], start[:, None] - axes, axes - start[:, None]) % (2 * np.pi)
+        swept = reached <= sweep[:, None]
+        extremes_x[arcs] = np.where(swept, cx[:, None] + radius[:, None] * np.round(np.cos(axes)), np.nan)
+        extremes_y[arcs] = np.where(swept, cy[:, None] + radius[:, None] * np.round(np.sin(axes)), np.nan)
+        return extremes_x, extremes_y
+
+    def updateLines(self, lines):
+        """
+        write column values back into the pygcode gcodes of lines
+        :param lines: GCodeLine having a pygcode line
+        :return:
+        """
+        for line in lines:
+            i = line.index
+            found = False
+            gcodes = line.line.block.gcodes
+            for k, gcode in enumerate(gcodes):
+                cls = type(gcode)
+                if cls is pygcode.gcodes.GCodeFeedRate:
+                    gcode.word.value = self.f[i]
+                elif cls is pygcode.gcodes.GCodeSpindleSpeed:
+                    gcode.word.value = self.s[i]
+                elif not found and positional(gcode):
+                    found = True
+                    params = gcode.params
+                    motion = self.motion[i]
+                    if cls in ARC_CODES.values() and ARC_CODES[motion] is not cls:
+                        # mirrored
+                        gcode = gcodes[k] = ARC_CODES[motion]()
+                        gcode.params.update(params)
+                        params = gcode.params
+                    if motion in ARCS and self.i[i] == self.i[i]:
+                        for letter, value in (('I', self.i[i]), ('J', self.j[i])):
+                            if letter in params:
+                                params[letter].value = value
+                            elif value != 0:
+                                params[letter] = pygcode.Word(letter, value)
+                    if 'X' in params:
+                        params['X'].value = self.x[i]
+                    elif line.flags & WORD_X:
+                        # given by a transform
+                        params['X'] = pygcode.Word('X', self.x[i])
+                    if 'Y' in params:
+                        params['Y'].value = self.y[i]
+                    elif line.flags & WORD_Y:
+                        params['Y'] = pygcode.Word('Y', self.y[i])
+                    if 'Z' in params:
+                        params['Z'].value = self.z[i]
+
+
+def translation(dx, dy):
+    """
+    :return: 3x3 numpy array
+    """
+    return np.array([[1.0, 0.0, dx], [0.0, 1.0, dy], [0.0, 0.0, 1.0]])
+
+
+def scaling(sx, sy, x0=0.0, y0=0.0):
+    """
+    scale around x0, y0, a negative factor mirrors
+    :return: 3x3 numpy array
+    """
+    return np.array([[sx, 0.0, x0 - sx*x0], [0.0, sy, y0 - sy*y0], [0.0, 0.0, 1.0]])
+
+
+def rotation(degrees, x0=0.0, y0=0.0):
+    """
+    counterclockwise rotation around x0, y0, multiples of 90 degrees are exact
+    :return: 3x3 numpy array
+    """
+    quarter = degrees / 90.0
+    if quarter == round(quarter):
+        c, s = ((1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0))[int(round(quarter)) % 4]
+    else:
+        c = math.cos(math.radians(degrees))
+        s = math.sin(math.radians(degrees))
+    return np.array([[c, -s, x0 - c*x0 + s*y0], [s, c, y0 - s*x0 - c*y0], [0.0, 0.0, 1.0]])
+
+
+def transform_points(matrix, x, y):
+    """
+    :param matrix: 3x3 numpy array
+    :param x: numpy array, or float
+    :param y:
+    :return: transformed (x, y), a NaN coordinate stays NaN under axis aligned transforms
+    """
+    (a, b, c), (d, e, f) = matrix[:2].tolist()
+    if axis_aligned(matrix):
+        return a*x + c, e*y + f
+    return a*x + b*y + c, d*x + e*y + f
+
+
+def axis_aligned(matrix):
+    """
+    :param matrix: 3x3 numpy array
+    :return: True if the transform maps X and Y separately, as translate, scale and mirror do
+    """
+    return matrix[0, 1] == 0 and matrix[1, 0] == 0
+
+
+def transform_range(matrix, xrange, yrange):
+    """
+    ranges of X and Y after an axis aligned transform
+    :param matrix: 3x3 numpy array
+    :param xrange: (min, max), None if unknown
+    :param yrange: (min, max), None if unknown
+    :return: (xmin, xmax), (ymin, ymax), None where unknown
+    """
+    (a, _b, c), (_d, e, f) = matrix[:2].tolist()
+    if xrange is not None:
+        xrange = tuple(sorted(a*v + c for v in xrange))
+    if yrange is not None:
+        yrange = tuple(sorted(e*v + f for v in yrange))
+    return xrange, yrange
+
+
+def fill_forward(values):
+    """
+    replace NaN with the last defined value before it, as modal words do
+    :param values: numpy array
+    :return: new numpy array, leading NaN are kept
+    """
+    defined = ~np.isnan(values)
+    last = np.where(defined, np.arange(len(values)), 0)
+    np.maximum.accumulate(last, out=last)
+    return values[last]
+
+
+def block_bounds(x, y, motion, sizes, extremes=None):
+    """
+    bounds, start and end point of consecutive runs of rows, e.g. the lines of G01Blocks, as G01Block.appendLine
+    computes them: X and Y of G00, G01 and arc moves, start and end at the first and last move with both words
+    :param x: numpy arrays, in line order
+    :param y:
+    :param motion:
+    :param sizes: numpy array, rows of every run
+    :param extremes: (x, y) of arcs, as Geometry.arcExtremes, widening the bounds, None for end points only
+    :return: numpy array, a row (xmin, xmax, ymin, ymax, startx, starty, endx, endy) per run: unknown ranges
+     are empty, min above max, unknown points are NaN
+    """
+    moves = (motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS)
+    x = np.where(moves, x, np.nan)
+    y = np.where(moves, y, np.nan)
+    point = ~(np.isnan(x) | np.isnan(y))
+    positions = np.arange(len(x))
+    low_x = high_x = x
+    low_y = high_y = y
+    if extremes is not None:
+        low_x = np.fmin(x, np.fmin.reduce(extremes[0], axis=1))
+        high_x = np.fmax(x, np.fmax.reduce(extremes[0], axis=1))
+        low_y = np.fmin(y, np.fmin.reduce(extremes[1], axis=1))
+        high_y = np.fmax(y, np.fmax.reduce(extremes[1], axis=1))
+    bounds = np.full((len(sizes), 8), np.nan)
+    bounds[:, [0, 2]] = sys.float_info.max
+    bounds[:, [1, 3]] = -sys.float_info.max
+    filled = np.flatnonzero(sizes)
+    if len(filled) == 0:
+        return bounds
+    starts = (np.cumsum(sizes) - sizes)[filled]
+    # fmin and fmax skip NaN, NaN if all the values of a run are
+    for column, values, reduce in ((0, low_x, np.fmin), (1, high_x, np.fmax), (2, low_y, np.fmin),
+                                   (3, high_y, np.fmax)):
+        reduced = reduce.reduceat(values, starts)
+        known = ~np.isnan(reduced)
+        bounds[filled[known], column] = reduced[known]
+    first = np.minimum.reduceat(np.where(point, positions, len(x)), starts)
+    last = np.maximum.reduceat(np.where(point, positions, -1), starts)
+    start = first < len(x)
+    bounds[filled[start], 4] = x[first[start]]
+    bounds[filled[start], 5] = y[first[start]]
+    end = last > first
+    bounds[filled[end], 6] = x[last[end]]
+    bounds[filled[end], 7] = y[last[end]]
+    return bounds
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    """
+    distance of points from the segment a-b
+    :param px: numpy array of x
+    :param py: numpy array of y
+    :return: numpy array of distances
+    """
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx*dx + dy*dy
+    if length2 == 0:
+        return np.hypot(px - ax, py - ay)
+    t = np.clip(((px - ax)*dx + (py - ay)*dy) / length2, 0, 1)
+    return np.hypot(px - (ax + t*dx), py - (ay + t*dy))
+
+
+def simplify_polyline(x, y, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification: every removed point is not farther than tolerance
+    from the segment joining the kept points around it
+    :param x: numpy array
+    :param y: numpy array
+    :param tolerance:
+    :return: mask of points to keep, first and last are always kept
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        distance = segment_distance(x[a+1:b], y[a+1:b], x[a], y[a], x[b], y[b])
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance:
+            i += a + 1
+            keep[i] = True
+            stack.append((a, i))
+            stack.append((i, b))
+    return keep
+
+
+def circle_center(ax, ay, bx, by, cx, cy):
+    """
+    center of the circle through three points
+    :return: (x, y), NaN if the points are collinear
+    """
+    # relative to a, for precision
+    bx = bx - ax
+    by = by - ay
+    cx = cx - ax
+    cy = cy - ay
+    d = 2.0 * (bx*cy - by*cx)
+    b2 = bx*bx + by*by
+    c2 = cx*cx + cy*cy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ux = (cy*b2 - by*c2) / d
+        uy = (bx*c2 - cx*b2) / d
+    finite = np.isfinite(ux) & np.isfinite(uy)
+    return np.where(finite, ax + ux, np.nan), np.where(finite, ay + uy, np.nan)
+
+
+def arc_deviation(x, y, cx, cy):
+    """
+    max distance of a polyline from the arc centered in cx, cy going through its first point,
+    turning in the direction of the polyline: every point and every segment are measured
+    :param x: numpy array
+    :param y: numpy array
+    :return: (deviation, counterclockwise), deviation is inf if points do not turn around the
+     center in a single direction, or turn for a full circle
+    """
+    dx = x - cx
+    dy = y - cy
+    r = math.hypot(dx[0], dy[0])
+    radial = np.abs(np.hypot(dx, dy) - r)
+    step = np.arctan2(dx[:-1]*dy[1:] - dy[:-1]*dx[1:], dx[:-1]*dx[1:] + dy[:-1]*dy[1:])
+    ccw = bool(step[0] > 0)
+    if not ((step > 0).all() if ccw else (step < 0).all()) or abs(step.sum()) > 1.9 * math.pi:
+        return math.inf, ccw
+    # a segment is as far from the arc as its sagitta, plus the distance of its ends
+    chord = np.hypot(np.diff(x), np.diff(y))
+    sagitta = r - np.sqrt(np.maximum(r*r - chord*chord/4.0, 0.0))
+    return float(max(radial.max(), (sagitta + np.maximum(radial[:-1], radial[1:])).max())), ccw
+
+
+def fit_arc(x, y, tolerance):
+    """
+    arc through the first, middle and last point of a polyline
+    :param x: numpy array
+    :param y: numpy array
+    :param tolerance:
+    :return: (cx, cy, counterclockwise, deviation), None if the polyline is farther than tolerance from
+     the arc, or so flat that a line is as good
+    """
+    m = len(x) // 2
+    cx, cy = circle_center(x[0], y[0], x[m], y[m], x[-1], y[-1])
+    if math.isnan(cx):
+        return None
+    r = math.hypot(x[0] - cx, y[0] - cy)
+    chord = math.hypot(x[-1] - x[0], y[-1] - y[0])
+    if chord < 2.0*r and r - math.sqrt(r*r - chord*chord/4.0) <= tolerance:
+        return None
+    deviation, ccw = arc_deviation(x, y, cx, cy)
+    if deviation > tolerance:
+        return None
+    return float(cx), float(cy), ccw, deviation
+
+
+def fit_arcs(x, y, tolerance, min_points=4):
+    """
+    greedy arc fitting of a polyline: from every point, the longest run of points fitting an arc
+    is found by doubling, then bisecting its length. A vectorized pass over all the point triples
+    skips points that cannot start an arc
+    :param x: numpy array
+    :param y: numpy array
+    :param tolerance: max distance of the polyline from arcs
+    :param min_points: points of the shortest arc, first and last included
+    :return: list of (first, last, cx, cy, counterclockwise, deviation)
+    """
+    n = len(x)
+    arcs = []
+    if n < min_points:
+        return arcs
+
+    # triples on a circle, with both segments within tolerance from it
+    cx, cy = circle_center(x[:-2], y[:-2], x[1:-1], y[1:-1], x[2:], y[2:])
+    r = np.hypot(x[:-2] - cx, y[:-2] - cy)
+    segment = np.hypot(np.diff(x), np.diff(y))
+    longest = np.maximum(segment[:-1], segment[1:])
+    with np.errstate(invalid='ignore'):
+        sagitta = r - np.sqrt(np.maximum(r*r - longest*longest/4.0, 0.0))
+        candidate = (~np.isnan(cx) & (sagitta <= tolerance)).tolist()
+
+    a = 0
+    while a + min_points <= n:
+        if not candidate[a]:
+            a += 1
+            continue
+        b = a + min_points - 1
+        fit = fit_arc(x[a:b+1], y[a:b+1], tolerance)
+        if fit is None:
+            a += 1
+            continue
+        good = b
+        bad = None
+        length = min_points
+        while good < n - 1:
+            b = min(a + 2*length - 1, n - 1)
+            other = fit_arc(x[a:b+1], y[a:b+1], tolerance)
+            if other is None:
+                bad = b
+                break
+            good, fit, length = b, other, 2*length
+        while bad is not None and bad - good > 1:
+            b = (good + bad) // 2
+            other = fit_arc(x[a:b+1], y[a:b+1], tolerance)
+            if other is None:
+                bad = b
+            else:
+                good, fit = b, other
+        arcs.append((a, good) + fit)
+        a = good
+    return arcs
@@ -0,0 +1,235 @@
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+from commons import gCodeBlocks
+from geometry import fill_forward, transform_points, RAPID, LINEAR, ARCS
+
+# active Recorder, None if stages are not recorded
+recorder = None
+
+
+def start(profile_dir=None, trace_memory=False):
+    """
+    record following stages
+    :param profile_dir: if given, a cProfile dump of every stage is written there
+    :param trace_memory: record the peak python memory of every stage
+    :return: the new Recorder
+    """
+    global recorder
+    recorder = Recorder(profile_dir, trace_memory)
+    return recorder
+
+
+def stop():
+    """
+    stop recording stages
+    :return:
+    """
+    global recorder
+    recorder.close()
+    recorder = None
+
+
+def stage(name, argument=None):
+    """
+    context of a stage, e.g. a filter: recorded if a Recorder is active
+    :param name: e.g. the command line option
+    :param argument: option value
+    :return: context manager
+    """
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.stage(name, argument)
+
+
+def travel(block):
+    """
+    G00, G01 and arc distance of the lines of a block, in their order, arcs measured by their chord;
+    other motions are not measured. The pending transform of the block is taken into account
+    :param block: GCodeBlock
+    :return: (rapid distance, cut distance)
+    """
+    geometry = block.geometry
+    order = np.array([line.index for line in block.lines], dtype=np.int64)
+    motion = geometry.motion[order]
+    moves = (motion == RAPID) | (motion == LINEAR) | np.isin(motion, ARCS)
+    x = fill_forward(np.where(moves, geometry.x[order], np.nan))
+    y = fill_forward(np.where(moves, geometry.y[order], np.nan))
+    x, y = transform_points(block.transform, x, y)
+    distance = np.hypot(np.diff(x), np.diff(y))
+    rapid = motion[1:] == RAPID
+    return float(np.nansum(distance[rapid])), float(np.nansum(distance[moves[1:] & ~rapid]))
+
+
+class Snapshot:
+    """
+    line order and numeric words of a loaded GCodeBlock, to tell what a stage changed
+    """
+    def __init__(self, block):
+        self.order = np.array([line.index for line in block.lines], dtype=np.int64)
+        self.columns = [np.array(getattr(block.geometry, name), copy=True) for name in block.geometry.columns]
+
+    def changes(self, block):
+        """
+        :param block: the same block, after a stage
+        :return: dict of lines added, removed, with changed words, moved after another line
+        """
+        order = np.array([line.index for line in block.lines], dtype=np.int64)
+        added = np.setdiff1d(order, self.order)
+        removed = np.setdiff1d(self.order, order)
+
+        changed = np.zeros(len(block.geometry), dtype=bool)
+        for before, name in zip(self.columns, block.geometry.columns):
+            after = getattr(block.geometry, name)[:len(before)]
+            changed[:len(before)] |= ~((before == after) | (np.isnan(before) & np.isnan(after)))
+
+        # kept lines whose previous line is not the same one of before
+        kept = self.order[np.isin(self.order, order)]
+        now = order[np.isin(order, kept)]
+        moved = 0
+        if len(kept) > 1:
+            previous = np.full(len(block.geometry), -1, dtype=np.int64)
+            previous[kept[1:]] = kept[:-1]
+            moved = int(np.count_nonzero(previous[now[1:]] != now[:-1]))
+
+        return {
+            "lines_added": int(len(added)),
+            "lines_removed": int(len(removed)),
+            "lines_changed": int(np.count_nonzero(changed[kept])),
+            "lines_moved": moved,
+        }
+
+
+class Recorder:
+    """
+    wall time, cpu time, max resident memory of the process, lines touched and travel of every stage.
+    The peak python memory of a stage is traced with tracemalloc only on request, as it slows down
+    stages allocating many small arrays by an order of magnitude
+    """
+    def __init__(self, profile_dir=None, trace_memory=False):
+        self.stages = []
+        self.profile_dir = profile_dir
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        self.trace_memory = trace_memory
+        self.tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    def close(self):
+        if self.tracing:
+            tracemalloc.stop()
+
+    @staticmethod
+    def maxRss():
+        """
+        :return: max resident memory of the process so far, in bytes, None if not available
+        """
+        if resource is None:
+            return None
+        # kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @contextlib.contextmanager
+    def stage(self, name, argument=None):
+        blocks = list(gCodeBlocks)
+        snapshots = [None if block.streaming else Snapshot(block) for block in blocks]
+        profile = cProfile.Profile() if self.profile_dir is not None else None
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base, _peak = tracemalloc.get_traced_memory()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+            record = {
+                "stage": name,
+                "argument": argument,
+                "wall": wall,
+                "cpu": cpu,
+                "max_rss": self.maxRss(),
+            }
+            if self.trace_memory:
+                _size, peak = tracemalloc.get_traced_memory()
+                record["peak_memory"] = peak - base
+            record.update(self.measure(blocks, snapshots))
+            if profile is not None:
+                record["profile"] = os.path.join(self.profile_dir, "{:02d}_{}.prof".format(
+                    len(self.stages), name.strip("-").replace("-", "_")))
+                profile.dump_stats(record["profile"])
+            self.stages.append(record)
+
+    @staticmethod
+    def measure(blocks, snapshots):
+        """
+        :param blocks: blocks loaded before the stage
+        :param snapshots: their Snapshot, None for streams
+        :return: dict of lines and travel of loaded blocks after the stage, streams are not measured
+        """
+        totals = {"lines": 0, "lines_added": 0, "lines_removed": 0, "lines_changed": 0, "lines_moved": 0,
+                  "rapid_distance": 0.0, "cut_distance": 0.0}
+        before = dict(zip(map(id, blocks), snapshots))
+        loaded = False
+        for block in gCodeBlocks:
+            if block.streaming:
+                continue
+            loaded = True
+            totals["lines"] += len(block.lines)
+            snapshot = before.get(id(block))
+            if snapshot is None:
+                totals["lines_added"] += len(block.lines)
+            else:
+                for name, value in snapshot.changes(block).items():
+                    totals[name] += value
+            rapid, cut = travel(block)
+            totals["rapid_distance"] += rapid
+            totals["cut_distance"] += cut
+        return totals if loaded else {}
+
+    def report(self):
+        """
+        print a line per stage
+        :return:
+        """
+        for record in self.stages:
+            s = "stats: {}{} wall {:.3f}s cpu {:.3f}s".format(
+                record["stage"], "" if record["argument"] is None else "=" + str(record["argument"]),
+                record["wall"], record["cpu"])
+            if record["max_rss"] is not None:
+                s = "{}, max rss {:.1f} MB".format(s, record["max_rss"] / 1e6)
+            if "peak_memory" in record:
+                s = "{}, peak memory {:.1f} MB".format(s, record["peak_memory"] / 1e6)
+            if "lines" in record:
+                s = "{}, lines {} (+{} -{}, {} changed, {} moved), rapid {:.1f} cut {:.1f}".format(
+                    s, record["lines"], record["lines_added"], record["lines_removed"], record["lines_changed"],
+                    record["lines_moved"], record["rapid_distance"], record["cut_distance"])
+            print(s)
+
+    def write(self, filename):
+        """
+        write stages as json
+        :param filename:
+        :return:
+        """
+        with open(filename, "w") as h:
+            json.dump({"stages": self.stages}, h, indent=1)
@@ -0,0 +1,183 @@
+import math
+
+from geometry import format_value, MOTION_WORDS, NO_MOTION, ARCS, WORD_X, WORD_Y, WORD_Z, WORD_F, WORD_S, S_FIRST
+
+
+def fixed_format(precision):
+    """
+    :param precision: decimal digits
+    :return: function formatting a float with at most precision decimals, without trailing zeros
+    """
+    def format_fixed(value):
+        s = "{:.{}f}".format(value, precision)
+        if '.' in s:
+            s = s.rstrip('0').rstrip('.')
+        if s == "-0":
+            s = "0"
+        return s
+    return format_fixed
+
+
+def arc_offsets(start, end, offset, fmt, unit):
+    """
+    I, J words of an arc, rounded to the center among the nearest ones that is at the same distance from the start
+    and end points as written, so that the rounded end point stays on the circle
+    :param start: (x, y) as written
+    :param end: (x, y) as written
+    :param offset: (i, j) from start to center, not rounded
+    :param fmt: function formatting a float
+    :param unit: smallest step of fmt
+    :return: (I, J) texts
+    """
+    best = None
+    i0 = float(fmt(offset[0]))
+    j0 = float(fmt(offset[1]))
+    for di in (0, -unit, unit):
+        for dj in (0, -unit, unit):
+            i, j = fmt(i0 + di), fmt(j0 + dj)
+            cx, cy = start[0] + float(i), start[1] + float(j)
+            mismatch = abs(math.hypot(start[0] - cx, start[1] - cy) - math.hypot(end[0] - cx, end[1] - cy))
+            if best is None or mismatch < best[0] - unit*1e-6:
+                best = (mismatch, i, j)
+    return best[1], best[2]
+
+
+class GCodeWriter:
+    """
+    write the lines of GCodeBlock to a text file: plain G0/G1 lines, and arcs made by filters, are formatted from the geometry
+    columns, converted to python floats once per block, other lines by pygcode. I, J of arcs are rounded from the start
+    point as written, see arc_offsets.
+    Lines are joined and written every buffer_lines lines.
+    Optionally, G00/G01, F and S words equal to the last written ones are dropped, as they are modal
+    """
+    buffer_lines = 10000
+
+    def __init__(self, h, precision=None, drop_modal=False):
+        """
+        :param h: text file
+        :param precision: decimal digits of plain G0/G1 lines, None for the pygcode format
+        :param drop_modal: drop repeated G00/G01, F, S words
+        """
+        self.h = h
+        self.format = format_value if precision is None else fixed_format(precision)
+        self.unit = 10.0**-(3 if precision is None else precision)
+        self.drop_modal = drop_modal
+        self.buffer = []
+        # last written motion word, F and S values, None if unknown
+        self.motion = None
+        self.f = None
+        self.s = None
+        # start of the next arc: last X, Y of the geometry, and the function they were written with
+        self.x = self.y = float("nan")
+        self.x_format = self.y_format = self.format
+
+    def write(self, text):
+        """
+        :param text: a line, without new line
+        :return:
+        """
+        self.buffer.append(text)
+        if len(self.buffer) >= GCodeWriter.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            self.h.write("\n".join(self.buffer))
+            self.buffer = []
+
+    def writeBlock(self, block):
+        """
+        write the lines of a block, in their order, applying its pending transform
+        :param block: GCodeBlock
+        :return:
+        """
+        block.applyTransform()
+        geometry = block.geometry
+        motions = geometry.motion.tolist()
+        x = geometry.x.tolist()
+        y = geometry.y.tolist()
+        z = geometry.z.tolist()
+        f = geometry.f.tolist()
+        s = geometry.s.tolist()
+        i_offset = geometry.i.tolist()
+        j_offset = geometry.j.tolist()
+        fmt = self.format
+        drop = self.drop_modal
+        last_x, last_y, x_format, y_format = self.x, self.y, self.x_format, self.y_format
+
+        for line in block.lines:
+            i = line.index
+            flags = line.flags
+            if line.line is not None:
+                if not line.empty() or line.comment is not None:
+                    self.write(str(line))
+                    if drop:
+                        self.fallback(line, motions[i], f[i], s[i])
+                if motions[i] != NO_MOTION:
+                    if x[i] == x[i]:
+                        last_x, x_format = x[i], format_value
+                    if y[i] == y[i]:
+                        last_y, y_format = y[i], format_value
+                continue
+
+            words = []
+            motion = motions[i]
+            if motion != NO_MOTION:
+                word = MOTION_WORDS[motion]
+                if not (drop and word == self.motion):
+                    words.append(word)
+                self.motion = word
+                if flags & WORD_X:
+                    words.append("X" + fmt(x[i]))
+                if flags & WORD_Y:
+                    words.append("Y" + fmt(y[i]))
+                if flags & WORD_Z:
+                    words.append("Z" + fmt(z[i]))
+                if motion in ARCS:
+                    if last_x == last_x and last_y == last_y:
+                        start = (float(x_format(last_x)), float(y_format(last_y)))
+                        end = (float(fmt(x[i])) if flags & WORD_X else start[0],
+                               float(fmt(y[i])) if flags & WORD_Y else start[1])
+                        # offsets from the start as written, to the center
+                        offset = (i_offset[i] + last_x - start[0], j_offset[i] + last_y - start[1])
+                        center_i, center_j = arc_offsets(start, end, offset, fmt, self.unit)
+                    else:
+                        center_i, center_j = fmt(i_offset[i]), fmt(j_offset[i])
+                    words.append("I" + center_i)
+                    words.append("J" + center_j)
+                if flags & WORD_X:
+                    last_x, x_format = x[i], fmt
+                if flags & WORD_Y:
+                    last_y, y_format = y[i], fmt
+            if flags & S_FIRST:
+                self.spindle(words, fmt(s[i]))
+            if flags & WORD_F:
+                value = fmt(f[i])
+                if not (drop and value == self.f):
+                    words.append("F" + value)
+                self.f = value
+            if flags & WORD_S and not flags & S_FIRST:
+                self.spindle(words, fmt(s[i]))
+            if words:
+                self.write(' '.join(words))
+        self.x, self.y, self.x_format, self.y_format = last_x, last_y, x_format, y_format
+
+    def spindle(self, words, value):
+        if not (self.drop_modal and value == self.s):
+            words.append("S" + value)
+        self.s = value
+
+    def fallback(self, line, motion, f, s):
+        """
+        update modal state after a line written by pygcode
+        """
+        if motion != NO_MOTION:
+            self.motion = MOTION_WORDS.get(motion)
+        elif len(line.line.block.gcodes):
+            # e.g. a canned cycle cancel, motion mode is not known any more
+            self.motion = None
+        if line.flags & WORD_F:
+            self.f = format_value(f)
+        if line.flags & WORD_S:
+            self.s = format_value(s)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gdoctor
+from gbatch import process_file
+
+# options a job cannot give: files and process wide settings belong to the server
+SERVER_OPTIONS = ("--readgcode", "--writegcode", "--stream", "--parser", "--cache-dir", "--cache-size",
+                  "--stats", "--profile-dir", "--trace-memory", "--serve", "--workers", "--max-queue",
+                  "--input-dir", "--output-dir", "--parse-workers", "-h", "--help")
+
+# largest request body, gcode text included
+MAX_REQUEST = 256*1024*1024
+
+# longest --optimize-time-budget of a job, seconds, so that every job ends in bounded time
+MAX_BUDGET = 60.0
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+def warm():
+    """
+    worker initializer: load parsers, so that the first job does not pay for it
+    :return:
+    """
+    for parser in gdoctor.PARSERS:
+        block = gdoctor.GCodeBlock("warm")
+        for line in ("G00 X1 Y2", "G01 X3 Y4 F100 S200", "G02 X1 Y0 I1 J0", "M5"):
+            block.parseLine(line, parser)
+        block.buildGeometry()
+
+
+class JobError(Exception):
+    pass
+
+
+def parse_address(address):
+    """
+    :param address: unix socket path, containing a /, or [host:]port, host a loopback address
+    :return: (path, None, None) or (None, host, port)
+    """
+    if "/" in address:
+        return address, None, None
+    host, _sep, port = address.rpartition(":")
+    host = host.strip("[]") or "127.0.0.1"
+    if host != "localhost" and not ipaddress.ip_address(host).is_loopback:
+        raise ValueError("{}: not a loopback address, jobs are served to local clients only".format(host))
+    return None, host, int(port)
+
+
+def numeric(value):
+    """
+    :param value: filter value, e.g. 0.5, 0.5,10, 100x100, x50
+    :return: True if made of numbers, that filters read without evaluating them
+    """
+    parts = value.replace(",", "x").split("x")
+    if not any(parts):
+        return False
+    for part in parts:
+        if len(part):
+            try:
+                float(part)
+            except ValueError:
+                return False
+    return True
+
+
+def confined(directory, name, what):
+    """
+    :param directory: server directory of job files, None if jobs cannot name files
+    :param name: file name given by a job, relative to directory
+    :param what: input or output, for errors
+    :return: path of the file
+    """
+    if directory is None:
+        raise JobError("{}: job {} files are not served, see --{}-dir".format(name, what, what))
+    if not isinstance(name, str) or os.path.isabs(name) or ".." in name.replace("\\", "/").split("/"):
+        raise JobError("{}: {} file name relative to the {} directory expected".format(name, what, what))
+    path = os.path.join(directory, name)
+    # symbolic links may lead out of the directory
+    root = os.path.realpath(directory)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise JobError("{}: out of the {} directory".format(name, what))
+    return path
+
+
+class GCodeServer:
+    """
+    run gdoctor jobs sent by a local front end, in a pool of worker processes started once:
+    a job is a gcode file, or its text, and a filter chain; the reply has the output file, or its text.
+    At most workers jobs run at once, at most max_queue wait for a worker, more are refused
+    with 503 until the queue drains.
+    Filter values must be numbers, or choices of their option, as filters evaluate other values;
+    time budgets are at most MAX_BUDGET; jobs name files only inside the input and output directories
+    """
+    def __init__(self, workers=None, max_queue=16, cache_dir=None, input_dir=None, output_dir=None):
+        """
+        :param workers: worker processes, default the number of cpu
+        :param max_queue: jobs waiting for a worker, beyond the running ones
+        :param cache_dir: --cache-dir of every job
+        :param input_dir: directory of the input files of jobs, None if jobs send gcode text only
+        :param output_dir: directory of the output files of jobs, None if jobs get gcode text only
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache_dir = cache_dir
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.options = {option: action for option, action in gdoctor.build_parser()._option_string_actions.items()
+                        if option not in SERVER_OPTIONS}
+        self.executor = None
+        self.slots = None
+        # jobs accepted and not finished, running or queued
+        self.pending = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.refused = 0
+        self.run_time = 0.0
+        self.queue_time = 0.0
+
+    async def start(self):
+        """
+        start worker processes, and wait until they are warm
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm)
+        self.slots = asyncio.Semaphore(self.workers)
+        await asyncio.gather(*[loop.run_in_executor(self.executor, time.sleep, 0.01) for _i in range(self.workers)])
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def commandLine(self, request, directory):
+        """
+        gdoctor arguments of a job
+        :param request: dict, input file or gcode text, filters, optional output file, stream, parser, stats
+        :param directory: temporary directory of the job
+        :return: (argv, output file, stats file or None)
+        """
+        filters = request.get("filters", [])
+        if not isinstance(filters, list) or not all(isinstance(option, str) for option in filters):
+            raise JobError("filters: list of gdoctor options expected")
+        self.checkFilters(filters)
+
+        if "gcode" in request:
+            source = os.path.join(directory, "in.gcode")
+            with open(source, "w", encoding="utf-8") as h:
+                h.write(request["gcode"])
+        elif "input" in request:
+            source = confined(self.input_dir, request["input"], "input")
+            if not os.path.isfile(source):
+                raise JobError("{}: no such file".format(request["input"]))
+        else:
+            raise JobError("input file or gcode text expected")
+
+        parser = request.get("parser", "fast")
+        if parser not in gdoctor.PARSERS:
+            raise JobError("parser: one of {} expected".format(", ".join(gdoctor.PARSERS)))
+        if request.get("output"):
+            output = confined(self.output_dir, request["output"], "output")
+            if not os.path.isdir(os.path.dirname(output)):
+                raise JobError("{}: no such directory".format(request["output"]))
+        else:
+            output = os.path.join(directory, "out.gcode")
+        stats = os.path.join(directory, "stats.json") if request.get("stats") else None
+
+        argv = ["--parser={}".format(parser)]
+        if self.cache_dir is not None:
+            argv.append("--cache-dir={}".format(self.cache_dir))
+        if stats is not None:
+            argv.append("--stats={}".format(stats))
+        if request.get("stream"):
+            argv.append("--stream")
+        argv += ["--readgcode={}".format(source)] + filters + ["--writegcode={}".format(output)]
+        return argv, output, stats
+
+    def checkFilters(self, filters):
+        """
+        allow job options only, with values that are numbers or choices of the option:
+        filters evaluate values that are not numbers, and these must not be code
+        :param filters: gdoctor arguments, --option=value or --option value
+        :return:
+        """
+        arguments = iter(filters)
+        for argument in arguments:
+            option, equal, value = argument.partition("=")
+            action = self.options.get(option)
+            if action is None:
+                raise JobError("{}: not a job option".format(argument))
+            if action.nargs == 0:
+                if equal:
+                    raise JobError("{}: takes no value".format(option))
+                continue
+            if not equal:
+                value = next(arguments, None)
+                if value is None:
+                    raise JobError("{}: value expected".format(option))
+            if action.choices is not None:
+                if value not in action.choices:
+                    raise JobError("{}: one of {} expected".format(option, ", ".join(action.choices)))
+            elif action.type is None:
+                # other values reach filters as text
+                if not numeric(value):
+                    raise JobError("{}={}: number expected".format(option, value))
+            else:
+                try:
+                    converted = action.type(value)
+                except (argparse.ArgumentTypeError, TypeError, ValueError) as e:
+                    raise JobError("{}: {}".format(option, e))
+                if action.type is gdoctor.duration and converted > MAX_BUDGET:
+                    raise JobError("{}={}: at most {:g}s".format(option, value, MAX_BUDGET))
+
+    async def job(self, request):
+        """
+        run a job, when a worker is free
+        :param request: dict, see commandLine
+        :return: (http status, reply dict)
+        """
+        if self.pending >= self.workers + self.max_queue:
+            self.refused += 1
+            return 503, {"error": "busy, {} jobs pending".format(self.pending)}
+
+        self.pending += 1
+        directory = tempfile.mkdtemp(prefix="gdoctor-")
+        try:
+            argv, output, stats = self.commandLine(request, directory)
+            received = time.perf_counter()
+            async with self.slots:
+                started = time.perf_counter()
+                self.running += 1
+                try:
+                    ok, seconds, log = await asyncio.get_running_loop().run_in_executor(self.executor, process_file,
+                                                                                        argv)
+                finally:
+                    self.running -= 1
+            total = time.perf_counter() - received
+
+            reply = {"ok": ok, "queued": started - received, "run": seconds, "total": total, "log": log}
+            if ok and "output" in request:
+                reply["output"] = output
+            elif ok:
+                with open(output, encoding="utf-8") as h:
+                    reply["gcode"] = h.read()
+            if stats is not None and os.path.exists(stats):
+                with open(stats) as h:
+                    reply["stats"] = json.load(h)
+
+            self.done += 1
+            self.failed += not ok
+            self.run_time += seconds
+            self.queue_time += started - received
+            print("{} {:8.3f}s queued {:.3f}s {}".format("ok  " if ok else "FAIL", seconds, started - received,
+                                                         request.get("input", "<gcode>")))
+            return 200, reply
+        except JobError as e:
+            return 400, {"error": str(e)}
+        finally:
+            self.pending -= 1
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self):
+        """
+        :return: dict of job counters and mean times
+        """
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "running": self.running,
+            "done": self.done,
+            "failed": self.failed,
+            "refused": self.refused,
+            "mean_run": self.run_time / self.done if self.done else None,
+            "mean_queued": self.queue_time / self.done if self.done else None,
+        }
+
+    async def route(self, method, path, body):
+        """
+        :return: (http status, reply dict)
+        """
+        if method == "POST" and path == "/jobs":
+            try:
+                request = json.loads(body.decode("utf-8"))
+            except ValueError as e:
+                return 400, {"error": "bad json: {}".format(e)}
+            if not isinstance(request, dict):
+                return 400, {"error": "json object expected"}
+            return await self.job(request)
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        return 404, {"error": "{} {}: POST /jobs or GET /stats".format(method, path)}
+
+    async def handle(self, reader, writer):
+        """
+        serve one http request per connection
+        """
+        try:
+            method, path, _version = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _sep, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_REQUEST:
+                status, reply = 413, {"error": "request larger than {} bytes".format(MAX_REQUEST)}
+            else:
+                status, reply = await self.route(method, path, await reader.readexactly(length))
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, reply = 400, {"error": "bad request: {}".format(e)}
+
+        data = json.dumps(reply).encode("utf-8")
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status, REASONS[status], len(data)).encode("latin-1"))
+        writer.write(data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def serve(self, address):
+        """
+        listen until cancelled
+        :param address: see parse_address
+        :return:
+        """
+        path, host, port = parse_address(address)
+        await self.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+        print("serving on {}, {} workers, queue of {} jobs".format(address, self.workers, self.max_queue))
+        task = asyncio.current_task()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, task.cancel)
+            except NotImplementedError:
+                # windows, ctrl-c still raises KeyboardInterrupt
+                pass
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+def serve(address, workers=None, max_queue=16, cache_dir=None, input_dir=None, output_dir=None):
+    """
+    run a GCodeServer, until interrupted or terminated
+    :param address: unix socket path, or [host:]port, host a loopback address
+    :param workers: worker processes, default the number of cpu
+    :param max_queue: jobs waiting for a worker, beyond the running ones
+    :param cache_dir: parse cache of every job
+    :param input_dir: directory of the input files of jobs
+    :param output_dir: directory of the output files of jobs
+    :return:
+    """
+    try:
+        parse_address(address)
+    except ValueError as e:
+        print("serve: {}".format(e))
+        return
+    server = GCodeServer(workers, max_queue, cache_dir, input_dir, output_dir)
+    try:
+        asyncio.run(server.serve(address))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("server stopped")
+    finally:
+        server.close()
@@ -0,0 +1,280 @@
+import math
+
+
+class PointGrid:
+    """
+    uniform grid of 2d points supporting nearest neighbour query and deletion
+    useful to chain G01Blocks without rescanning all the remaining ones
+    """
+    def __init__(self, points):
+        """
+        :param points: list of (x, y) tuples, the point id is its index in the list
+        """
+        self.points = points
+        self.cells = {}
+        self.count = 0
+
+        if len(points) == 0:
+            self.xmin = self.ymin = 0
+            self.cell_size = 1
+            return
+
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        self.xmin = min(xs)
+        self.ymin = min(ys)
+        width = max(xs) - self.xmin
+        height = max(ys) - self.ymin
+        # about one point per cell
+        side = math.sqrt(width * height / len(points)) if width > 0 and height > 0 else 0
+        if side == 0:
+            side = max(width, height) / len(points)
+        self.cell_size = side if side > 0 else 1
+
+        for i, p in enumerate(points):
+            self.cells.setdefault(self._cell(p[0], p[1]), []).append(i)
+        self.count = len(points)
+
+        self.cxmax = int((max(xs) - self.xmin) / self.cell_size)
+        self.cymax = int((max(ys) - self.ymin) / self.cell_size)
+
+    def _cell(self, x, y):
+        return int((x - self.xmin) / self.cell_size), int((y - self.ymin) / self.cell_size)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, i):
+        """
+        add back point i, removed before
+        :param i: point id
+        :return:
+        """
+        p = self.points[i]
+        self.cells.setdefault(self._cell(p[0], p[1]), []).append(i)
+        self.count += 1
+
+    def remove(self, i):
+        """
+        remove point i from the grid
+        :param i: point id
+        :return:
+        """
+        p = self.points[i]
+        key = self._cell(p[0], p[1])
+        cell = self.cells[key]
+        cell.remove(i)
+        if len(cell) == 0:
+            del self.cells[key]
+        self.count -= 1
+
+    def nearest(self, x, y):
+        """
+        return the id of the point nearest to x, y, the lowest id on ties
+        :param x:
+        :param y:
+        :return: point id, None if grid is empty
+        """
+        if self.count == 0:
+            return None
+
+        cx, cy = self._cell(x, y)
+        # clamp the query cell, so that rings are bounded by the grid
+        qx = min(max(cx, 0), self.cxmax)
+        qy = min(max(cy, 0), self.cymax)
+        offset = max(abs(cx - qx), abs(cy - qy))
+        max_ring = max(qx, self.cxmax - qx, qy, self.cymax - qy)
+
+        best_d = None
+        best_i = None
+        ring = 0
+        while ring <= max_ring:
+            for key in self._ring(qx, qy, ring):
+                cell = self.cells.get(key)
+                if cell is None:
+                    continue
+                for i in cell:
+                    px, py = self.points[i]
+                    dx = px - x
+                    dy = py - y
+                    d = dx*dx+dy*dy
+                    if best_d is None or d < best_d or (d == best_d and i < best_i):
+                        best_d = d
+                        best_i = i
+            if best_d is not None:
+                # points outside visited rings are at least this far
+                reach = max(ring, offset - 1) * self.cell_size
+                if best_d < reach * reach:
+                    break
+            ring += 1
+
+        return best_i
+
+    def neighbours(self, x, y, k):
+        """
+        return the ids of the k points nearest to x, y, nearest first
+        :param x:
+        :param y:
+        :param k:
+        :return: list of point ids, shorter if the grid has less than k points
+        """
+        k = min(k, self.count)
+        if k == 0:
+            return []
+
+        cx, cy = self._cell(x, y)
+        qx = min(max(cx, 0), self.cxmax)
+        qy = min(max(cy, 0), self.cymax)
+        offset = max(abs(cx - qx), abs(cy - qy))
+        max_ring = max(qx, self.cxmax - qx, qy, self.cymax - qy)
+
+        found = []
+        ring = 0
+        while ring <= max_ring:
+            for key in self._ring(qx, qy, ring):
+                for i in self.cells.get(key, ()):
+                    px, py = self.points[i]
+                    found.append(((px - x)*(px - x) + (py - y)*(py - y), i))
+            if len(found) >= k:
+                found.sort()
+                del found[k:]
+                reach = max(ring, offset - 1) * self.cell_size
+                if found[-1][0] < reach * reach:
+                    break
+            ring += 1
+
+        found.sort()
+        return [i for _d, i in found[:k]]
+
+    @staticmethod
+    def _ring(cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield x, cy - r
+            yield x, cy + r
+        for y in range(cy - r + 1, cy + r):
+            yield cx - r, y
+            yield cx + r, y
+
+
+def containment_lists(boxes):
+    """
+    find, for every box, the boxes it strictly contains:
+    boxes are registered in a uniform grid, so that only the boxes overlapping
+    the lower left corner of a box are candidate containers
+    :param boxes: list of (xmin, ymin, xmax, ymax) tuples, the box id is its index in the list
+    :return: list of lists of contained box ids, in ascending order
+    """
+    n = len(boxes)
+    if n == 0:
+        return []
+
+    xmin = min(b[0] for b in boxes)
+    ymin = min(b[1] for b in boxes)
+    width = max(b[2] for b in boxes) - xmin
+    height = max(b[3] for b in boxes) - ymin
+
+    # cells as large as a typical box, but never more cells than boxes
+    sides = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes)
+    cell_size = max(sides[n // 2], math.sqrt(width * height / n))
+    if cell_size <= 0:
+        cell_size = max(width, height, 1)
+
+    def cell(x, y):
+        return int((x - xmin) / cell_size), int((y - ymin) / cell_size)
+
+    cells = {}
+    for i, b in enumerate(boxes):
+        cx0, cy0 = cell(b[0], b[1])
+        cx1, cy1 = cell(b[2], b[3])
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cells.setdefault((cx, cy), []).append(i)
+
+    contained = [[] for _ in boxes]
+    for i, b in enumerate(boxes):
+        for j in cells[cell(b[0], b[1])]:
+            p = boxes[j]
+            if p[0] < b[0] and p[2] > b[2] and p[1] < b[1] and p[3] > b[3]:
+                contained[j].append(i)
+
+    return contained
+
+
+class LineGrid:
+    """
+    2d segments hashed by the line they lie on: quantized direction, offset of the line from the origin,
+    and position along the line, to find the segments lying on another one, not only passing near it
+    """
+    def __init__(self, distance, cell_size):
+        """
+        :param distance: max distance of the ends of a segment from the line of a segment it lies on
+        :param cell_size: about the typical segment length, step along lines
+        """
+        self.distance = distance
+        self.cell_size = max(cell_size, 2.0 * distance)
+        # a segment as long as a cell turns by less than a step from a line it lies on,
+        # and moves away from the line of its step by about distance along a cell
+        self.steps = int(math.ceil(math.pi * self.cell_size / (2.0 * distance)))
+        self.angle_step = math.pi / self.steps
+        self.offset_step = 4.0 * distance
+        self.cells = {}
+
+    def _keys(self, a, x0, y0, x1, y1, margin):
+        """
+        keys of the cells along a segment, in the lines of direction step a, widened by margin
+        """
+        angle = (a + 0.5) * self.angle_step
+        ux = math.cos(angle)
+        uy = math.sin(angle)
+        t0 = ux*x0 + uy*y0
+        t1 = ux*x1 + uy*y1
+        o0 = ux*y0 - uy*x0
+        o1 = ux*y1 - uy*x1
+        if t1 < t0:
+            t0, t1, o0, o1 = t1, t0, o1, o0
+        keys = []
+        for t in range(int(math.floor((t0 - margin) / self.cell_size)),
+                       int(math.floor((t1 + margin) / self.cell_size)) + 1):
+            # offsets of the part of the segment in the cell, the nearest end out of it
+            lo = min(max(t * self.cell_size, t0), t1)
+            hi = max(min((t + 1) * self.cell_size, t1), t0)
+            if t1 - t0 > self.distance:
+                oa = o0 + (o1 - o0) * (lo - t0) / (t1 - t0)
+                ob = o0 + (o1 - o0) * (hi - t0) / (t1 - t0)
+            else:
+                oa, ob = o0, o1
+            for o in range(int(math.floor((min(oa, ob) - margin) / self.offset_step)),
+                           int(math.floor((max(oa, ob) + margin) / self.offset_step)) + 1):
+                keys.append((a, o, t))
+        return keys
+
+    def add(self, i, x0, y0, x1, y1):
+        """
+        :param i: segment id, segments not longer than distance are not added, no segment lies on them
+        :return:
+        """
+        length = math.hypot(x1 - x0, y1 - y0)
+        if length <= self.distance:
+            return
+        angle = math.atan2(y1 - y0, x1 - x0) % math.pi
+        # directions of the lines the segment lies on
+        spread = math.asin(min(1.0, 2.0 * self.distance / length))
+        first = int(math.floor((angle - spread) / self.angle_step))
+        last = min(int(math.floor((angle + spread) / self.angle_step)), first + self.steps - 1)
+        for a in range(first, last + 1):
+            for key in self._keys(a % self.steps, x0, y0, x1, y1, 0.0):
+                self.cells.setdefault(key, []).append(i)
+
+    def near(self, x0, y0, x1, y1):
+        """
+        :return: ids of segments that may lie on the given segment, a superset of them
+        """
+        a = int((math.atan2(y1 - y0, x1 - x0) % math.pi) / self.angle_step) % self.steps
+        found = set()
+        for key in self._keys(a, x0, y0, x1, y1, 2.0 * self.distance):
+            if key in self.cells:
+                found.update(self.cells[key])
+        return found
@@ -0,0 +1,329 @@
+import collections
+import math
+import random
+import time
+
+import numpy as np
+
+from spatial import PointGrid
+
+# successors and predecessors of a block tried by moves
+NEIGHBOURS = 8
+# longest run of blocks moved by Or-opt
+OR_SEGMENT = 3
+# max positions between the cuts of a kick
+KICK_SPAN = 50
+# smaller gains are rounding noise
+EPSILON = 1e-9
+
+
+class Tour:
+    """
+    open tour of directed blocks, e.g. G01Blocks: travel from a block to the next one goes from its end
+    to the start of the next one, blocks are never reversed and the first block does not move.
+    Blocks may have to be visited before others, e.g. inner paths before the paths containing them.
+    Improved by 2-opt and Or-opt moves towards the nearest neighbours of blocks, then by random local kicks
+    kept when local search after them finds a shorter tour, until a deadline
+    """
+    def __init__(self, starts, ends, order, containers=None):
+        """
+        :param starts: list of (x, y), start point of every block
+        :param ends: list of (x, y), end point of every block
+        :param order: list of block ids, the initial tour
+        :param containers: optional, list of the blocks to be visited after every block, by block id
+        """
+        self.sx = [p[0] for p in starts]
+        self.sy = [p[1] for p in starts]
+        self.ex = [p[0] for p in ends]
+        self.ey = [p[1] for p in ends]
+        self.columns = [np.array(column, dtype=np.float64) for column in (self.sx, self.sy, self.ex, self.ey)]
+        self.t = list(order)
+        self.pos = [0] * len(self.t)
+        for k, b in enumerate(self.t):
+            self.pos[b] = k
+
+        self.after = containers if containers is not None else [[] for _b in self.t]
+        self.before = [[] for _b in self.t]
+        for b, outer in enumerate(self.after):
+            for o in outer:
+                self.before[o].append(b)
+
+        self.start_grid = PointGrid(list(starts))
+        self.end_grid = PointGrid(list(ends))
+        # neighbour lists, built when first needed
+        self.successors = {}
+        self.predecessors = {}
+
+        n = len(self.t)
+        self.fwd = np.zeros(max(n - 1, 0))
+        self.rev = np.zeros(max(n - 1, 0))
+        # prefix sums of fwd and rev, up to date until position summed
+        self.F = np.zeros(max(n, 1))
+        self.R = np.zeros(max(n, 1))
+        self.summed = 0
+        self.edges(0, n - 1)
+
+    def d(self, a, b):
+        """
+        :return: travel from the end of block a to the start of block b
+        """
+        return math.hypot(self.ex[a] - self.sx[b], self.ey[a] - self.sy[b])
+
+    def cost(self):
+        return float(self.fwd.sum())
+
+    def succ(self, b):
+        """
+        :return: blocks starting nearest to the end of b
+        """
+        if b not in self.successors:
+            self.successors[b] = [c for c in self.start_grid.neighbours(self.ex[b], self.ey[b], NEIGHBOURS + 1)
+                                  if c != b][:NEIGHBOURS]
+        return self.successors[b]
+
+    def pred(self, b):
+        """
+        :return: blocks ending nearest to the start of b
+        """
+        if b not in self.predecessors:
+            self.predecessors[b] = [c for c in self.end_grid.neighbours(self.sx[b], self.sy[b], NEIGHBOURS + 1)
+                                    if c != b][:NEIGHBOURS]
+        return self.predecessors[b]
+
+    def edges(self, lo, hi):
+        """
+        update travel of edges from position lo to position hi, forward and backward:
+        their prefix sums are updated when reverseDelta needs them
+        """
+        lo = max(lo, 0)
+        hi = min(hi, len(self.t) - 1)
+        if hi > lo:
+            a = np.array(self.t[lo:hi + 1], dtype=np.int64)
+            sx, sy, ex, ey = [column[a] for column in self.columns]
+            self.fwd[lo:hi] = np.hypot(ex[:-1] - sx[1:], ey[:-1] - sy[1:])
+            self.rev[lo:hi] = np.hypot(ex[1:] - sx[:-1], ey[1:] - sy[:-1])
+            self.summed = min(self.summed, lo)
+
+    def prefix(self, j):
+        """
+        bring prefix sums up to date until position j, from the first changed edge
+        """
+        k = self.summed
+        if j > k:
+            self.F[k + 1:j + 1] = self.F[k] + np.cumsum(self.fwd[k:j])
+            self.R[k + 1:j + 1] = self.R[k] + np.cumsum(self.rev[k:j])
+            self.summed = j
+
+    def reverseDelta(self, i, j):
+        """
+        :return: change of travel reversing the blocks from position i to position j
+        """
+        t = self.t
+        delta = self.d(t[i - 1], t[j]) - self.d(t[i - 1], t[i])
+        if j + 1 < len(t):
+            delta += self.d(t[i], t[j + 1]) - self.d(t[j], t[j + 1])
+        self.prefix(j)
+        return delta + float(self.R[j] - self.R[i]) - float(self.F[j] - self.F[i])
+
+    def canReverse(self, i, j):
+        pos = self.pos
+        for k in range(i, j + 1):
+            for o in self.after[self.t[k]]:
+                if i <= pos[o] <= j:
+                    return False
+        return True
+
+    def reverse(self, i, j):
+        self.t[i:j + 1] = self.t[i:j + 1][::-1]
+        for k in range(i, j + 1):
+            self.pos[self.t[k]] = k
+        self.edges(i - 1, j + 1)
+
+    def moveDelta(self, i, length, q):
+        """
+        :return: change of travel moving the blocks from position i to i + length - 1 after position q
+        """
+        t = self.t
+        n = len(t)
+        s0 = t[i]
+        s1 = t[i + length - 1]
+        a = t[i - 1]
+        delta = -self.d(a, s0)
+        if i + length < n:
+            b = t[i + length]
+            delta += self.d(a, b) - self.d(s1, b)
+        c = t[q]
+        delta += self.d(c, s0)
+        if q + 1 < n:
+            e = t[q + 1]
+            delta += self.d(s1, e) - self.d(c, e)
+        return delta
+
+    def canMove(self, i, length, q):
+        pos = self.pos
+        if q >= i + length:
+            # blocks from i + length to q go before the run
+            for k in range(i, i + length):
+                for o in self.after[self.t[k]]:
+                    if i + length <= pos[o] <= q:
+                        return False
+        else:
+            # blocks from q + 1 to i - 1 go after the run
+            for k in range(i, i + length):
+                for o in self.before[self.t[k]]:
+                    if q < pos[o] < i:
+                        return False
+        return True
+
+    def move(self, i, length, q):
+        t = self.t
+        run = t[i:i + length]
+        if q >= i + length:
+            t[i:q + 1] = t[i + length:q + 1] + run
+            lo, hi = i, q
+        else:
+            t[q + 1:i + length] = run + t[q + 1:i]
+            lo, hi = q + 1, i + length - 1
+        for k in range(lo, hi + 1):
+            self.pos[t[k]] = k
+        self.edges(lo - 1, hi + 1)
+
+    def moves(self, b):
+        """
+        candidate moves creating an edge from or to a neighbour of block b
+        :return: generator of ("reverse", i, j) and ("move", i, length, q)
+        """
+        t = self.t
+        n = len(t)
+        p = self.pos[b]
+        for c in self.succ(b):
+            j = self.pos[c]
+            if j > p + 1:
+                # b then c
+                yield "reverse", p + 1, j
+                if p >= 1:
+                    yield "reverse", p, j - 1
+        for c in self.pred(b):
+            i = self.pos[c]
+            if i < p - 1:
+                # c then b
+                yield "reverse", i + 1, p
+                if i >= 1:
+                    yield "reverse", i, p - 1
+        for length in range(1, OR_SEGMENT + 1):
+            # runs starting with b, put after a predecessor of b, or before a successor of their last block
+            if 1 <= p and p + length <= n:
+                for c in self.pred(b):
+                    q = self.pos[c]
+                    if not p - 1 <= q <= p + length - 1:
+                        yield "move", p, length, q
+                for c in self.succ(t[p + length - 1]):
+                    q = self.pos[c] - 1
+                    if q >= 0 and not p - 1 <= q <= p + length - 1:
+                        yield "move", p, length, q
+            # runs ending with b, put before a successor of b
+            i = p - length + 1
+            if length > 1 and i >= 1:
+                for c in self.succ(b):
+                    q = self.pos[c] - 1
+                    if q >= 0 and not i - 1 <= q <= p:
+                        yield "move", i, length, q
+
+    def apply(self, candidate):
+        """
+        apply a candidate move if it shortens the tour and keeps precedence
+        :return: positions of the changed edges, None if not applied
+        """
+        if candidate[0] == "reverse":
+            _kind, i, j = candidate
+            if self.reverseDelta(i, j) < -EPSILON and self.canReverse(i, j):
+                self.reverse(i, j)
+                return i - 1, j + 1
+        else:
+            _kind, i, length, q = candidate
+            if self.moveDelta(i, length, q) < -EPSILON and self.canMove(i, length, q):
+                self.move(i, length, q)
+                lo, hi = (i, q) if q >= i + length else (q + 1, i + length - 1)
+                return lo - 1, hi + 1
+        return None
+
+    def localSearch(self, queue, deadline):
+        """
+        apply improving moves around the queued blocks, queueing the blocks of changed edges
+        :param queue: deque of block ids
+        :param deadline: time.perf_counter() value
+        :return: (number of applied moves, False if the deadline came first)
+        """
+        queued = set(queue)
+        applied = 0
+        while queue:
+            if time.perf_counter() > deadline:
+                return applied, False
+            b = queue.popleft()
+            queued.discard(b)
+            for candidate in self.moves(b):
+                changed = self.apply(candidate)
+                if changed is not None:
+                    applied += 1
+                    lo, hi = changed
+                    for k in (lo, lo + 1, hi - 1, hi, self.pos[b]):
+                        if 0 <= k < len(self.t) and self.t[k] not in queued:
+                            queue.append(self.t[k])
+                            queued.add(self.t[k])
+                    break
+        return applied, True
+
+    def kick(self, rng):
+        """
+        swap two random runs of blocks near each other, keeping precedence
+        :return: positions around the changed edges, None if the kick breaks precedence
+        """
+        n = len(self.t)
+        a = rng.randrange(1, n - 1)
+        b = min(a + rng.randint(1, KICK_SPAN), n - 1)
+        c = min(b + rng.randint(1, KICK_SPAN), n)
+        if not (a < b < c):
+            return None
+        # the run from b to c goes before the one from a to b
+        if not self.canMove(b, c - b, a - 1):
+            return None
+        self.move(b, c - b, a - 1)
+        return a - 1, a, a + c - b - 1, a + c - b, c - 1, c
+
+    def improve(self, seconds, seed=0):
+        """
+        :param seconds: time budget
+        :param seed: of random kicks
+        :return: (moves applied, kicks, kicks kept)
+        """
+        deadline = time.perf_counter() + seconds
+        n = len(self.t)
+        if n < 3:
+            return 0, 0, 0
+        # moves applied before the deadline count, the tour is as good as they made it
+        applied, _finished = self.localSearch(collections.deque(self.t[1:]), deadline)
+
+        rng = random.Random(seed)
+        best = list(self.t)
+        best_cost = self.cost()
+        kicks = kept = 0
+        while n > 3 and time.perf_counter() < deadline:
+            around = self.kick(rng)
+            if around is None:
+                continue
+            kicks += 1
+            queue = collections.deque(self.t[k] for k in set(around) if 0 <= k < n)
+            moves, _finished = self.localSearch(queue, deadline)
+            cost = self.cost()
+            if cost < best_cost - EPSILON:
+                applied += moves + 1
+                kept += 1
+                best = list(self.t)
+                best_cost = cost
+            else:
+                self.t = list(best)
+                for k, b in enumerate(self.t):
+                    self.pos[b] = k
+                self.edges(0, n - 1)
+        return applied, kicks, kept
+